@@ -0,0 +1,329 @@
+"""
+Launcher benchmarks. Simulated remote hosts (see sshserver.py) run their
+commands against the local tmux server; a synthetic config (see graphs.py)
+is brought up and down, and every scenario reports wall time, remote
+commands (round trips), ssh channels and connections opened, and launcher
+cpu time (median over the repetitions).
+
+Usage examples:
+
+    python benchmarks/bench.py --graph wide --processes 100 --hosts 4 --rtt 0.02
+    python benchmarks/bench.py --graph deep --processes 20 --save baseline.json
+    python benchmarks/bench.py --graph deep --processes 20 --baseline baseline.json --fail
+    python benchmarks/bench.py --graph wide --processes 100 --rtt 0.02 --agent
+    python benchmarks/bench.py --graph wide --processes 100 --hosts 4 --rtt 0.02 --jump
+
+Note: the benchmark runs with a temporary HOME (holding the ssh config of
+the simulated hosts), and overwrites the launcher resources in /tmp.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import asyncssh
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from concert_launcher import executor, remote
+
+import graphs
+
+scenarios = ['run', 'status', 'pstree', 'watch', 'kill']
+
+metrics = ['wall', 'cpu', 'commands', 'channels', 'connections']
+
+
+class SimulatedHosts:
+
+    """
+    Starts the ssh server process, and sets up a temporary HOME whose ssh
+    config maps host names clbench-host<i> to the simulated hosts
+    """
+
+    def __init__(self, num_hosts, rtt, loss, seed):
+        self.num_hosts = num_hosts
+        self.rtt = rtt
+        self.loss = loss
+        self.seed = seed
+        self.dir = tempfile.mkdtemp(prefix='concert_launcher_bench_')
+        self.server = None
+        self.machines = []
+
+
+    def start(self):
+
+        ssh_dir = os.path.join(self.dir, '.ssh')
+        os.makedirs(ssh_dir, mode=0o700)
+
+        # note: asyncssh reads the config and known hosts from HOME; the
+        # simulated hosts also get it, so that the shells they start do
+        # not depend on the user's rc files
+        os.environ['HOME'] = self.dir
+
+        key = asyncssh.generate_private_key('ssh-ed25519')
+        key_path = os.path.join(self.dir, 'host_key')
+        key.write_private_key(key_path)
+
+        self.server = subprocess.Popen([sys.executable,
+                                        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sshserver.py'),
+                                        '--hosts', str(self.num_hosts),
+                                        '--rtt', str(self.rtt),
+                                        '--loss', str(self.loss),
+                                        '--seed', str(self.seed),
+                                        '--host-key', key_path],
+                                       stdout=subprocess.PIPE)
+
+        ports = json.loads(self.server.stdout.readline())['ports']
+
+        pubkey = key.export_public_key().decode().strip()
+
+        with open(os.path.join(ssh_dir, 'config'), 'w') as f:
+            for i, port in enumerate(ports):
+                f.write(f'Host clbench-host{i}\n  HostName 127.0.0.1\n  Port {port}\n\n')
+
+        with open(os.path.join(ssh_dir, 'known_hosts'), 'w') as f:
+            for port in ports:
+                f.write(f'[127.0.0.1]:{port} {pubkey}\n')
+
+        self.machines = [f'bench@clbench-host{i}' for i in range(self.num_hosts)]
+
+        # the hosts are this machine: resources are copied rather than uploaded
+        resources = os.path.join(os.path.dirname(executor.__file__), 'resources')
+
+        for rf in executor.ConnectionPool.resource_files:
+            shutil.copy(os.path.join(resources, rf), '/tmp')
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.terminate()
+            self.server.wait()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+async def measure(coro_fn):
+
+    remote.Stats.reset()
+
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+
+    # launcher progress goes to stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        await coro_fn()
+
+    res = dict(wall=time.perf_counter() - t0, cpu=time.process_time() - cpu0)
+
+    res.update(remote.Stats.snapshot())
+
+    return res
+
+
+async def watch_all(launcher: executor.Launcher, timeout=60.0):
+
+    # time until the output of every process is streamed
+    processes = set(launcher.get_processes())
+
+    seen = set()
+
+    all_seen = asyncio.get_event_loop().create_future()
+
+    def printer_factory(process):
+        async def printer(l):
+            seen.add(process)
+            if seen == processes and not all_seen.done():
+                all_seen.set_result(True)
+        return printer
+
+    watch_task = asyncio.ensure_future(launcher.watch(None, printer_coro_factory=printer_factory))
+
+    try:
+        await asyncio.wait_for(all_seen, timeout=timeout)
+    finally:
+        watch_task.cancel()
+        await asyncio.wait([watch_task])
+
+
+async def run_once(cfg, selected):
+
+    launcher = executor.Launcher(cfg)
+
+    targets = graphs.targets(cfg)
+
+    fns = {
+        'run': lambda: launcher.execute_processes(targets),
+        'status': lambda: launcher.status(),
+        'pstree': lambda: launcher.pstree(),
+        'watch': lambda: watch_all(launcher),
+        'kill': lambda: launcher.kill(),
+    }
+
+    res = dict()
+
+    try:
+        for s in scenarios:
+            if s in selected:
+                res[s] = await measure(fns[s])
+    finally:
+        launcher.close()
+
+    return res
+
+
+def cleanup(cfg):
+    # sessions, and the grouped sessions created for every window
+    processes = [p for p in cfg.keys() if p != 'context']
+    sessions = set(cfg[p]['session'] for p in processes) | set(processes)
+    for s in sessions:
+        subprocess.call(['tmux', 'kill-session', '-t', s], stderr=subprocess.DEVNULL)
+
+
+def median(runs, s):
+    return {m: statistics.median(r[s][m] for r in runs) for m in metrics}
+
+
+def print_results(results, baseline=None, tolerance=0.2):
+
+    """
+    Print the results (compared with the baseline, if any), and return
+    the list of regressions
+    """
+
+    regressions = []
+
+    print(f'{"scenario":<10}' + ''.join(f'{m:>14}' for m in metrics))
+
+    for s, res in results['scenarios'].items():
+
+        line = f'{s:<10}'
+
+        base = None if baseline is None else baseline['scenarios'].get(s, None)
+
+        for m in metrics:
+
+            value = f'{res[m]:.3f}' if m in ('wall', 'cpu') else f'{res[m]}'
+
+            if base is not None and m in base.keys():
+
+                # timings are noisy, counts are exact
+                slack = tolerance if m in ('wall', 'cpu') else 0.0
+
+                if res[m] > base[m] * (1 + slack) + 1e-3:
+                    regressions.append(f'{s} {m}: {base[m]} -> {res[m]}')
+                    value += '!'
+
+                if base[m] > 0:
+                    value += f' ({res[m] / base[m]:.2f}x)'
+
+            line += f'{value:>14}'
+
+        print(line)
+
+    return regressions
+
+
+async def main(args):
+
+    hosts = SimulatedHosts(args.hosts, args.rtt, args.loss, args.seed)
+
+    selected = args.scenarios.split(',')
+
+    runs = []
+
+    cfg = None
+
+    try:
+
+        hosts.start()
+
+        cfg = graphs.graphs[args.graph](hosts.machines, args.processes)
+
+        if args.agent:
+            cfg['context'].setdefault('ssh', {})['agent'] = True
+
+        # every host but the first one is reached through the first one
+        if args.jump:
+            cfg['context'].setdefault('ssh', {})['jump'] = {m: hosts.machines[0] for m in hosts.machines[1:]}
+
+        if args.dump_config is not None:
+            with open(args.dump_config, 'w') as f:
+                yaml.safe_dump(cfg, f)
+
+        for i in range(args.repeat):
+            cleanup(cfg)
+            runs.append(await run_once(cfg, selected))
+    finally:
+        if cfg is not None:
+            cleanup(cfg)
+        hosts.stop()
+
+    results = {
+        'meta': {
+            'graph': args.graph,
+            'processes': args.processes,
+            'hosts': args.hosts,
+            'rtt': args.rtt,
+            'loss': args.loss,
+            'repeat': args.repeat,
+            'agent': args.agent,
+            'jump': args.jump,
+        },
+        'scenarios': {s: median(runs, s) for s in scenarios if s in selected},
+    }
+
+    baseline = None
+
+    if args.baseline is not None:
+
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        if baseline['meta'] != results['meta']:
+            print(f'warning: baseline was taken with different settings ({baseline["meta"]})')
+
+    regressions = print_results(results, baseline, tolerance=args.tolerance)
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    for r in regressions:
+        print(f'regression: {r}')
+
+    return len(regressions) == 0 or not args.fail
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='concert launcher benchmarks')
+    parser.add_argument('--graph', choices=list(graphs.graphs.keys()), default='wide', help='shape of the synthetic config')
+    parser.add_argument('--processes', '-n', type=int, default=20, help='number of processes')
+    parser.add_argument('--hosts', type=int, default=2, help='number of simulated hosts')
+    parser.add_argument('--rtt', type=float, default=0.0, help='injected round trip time (seconds)')
+    parser.add_argument('--loss', type=float, default=0.0, help='injected packet loss probability')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the loss process')
+    parser.add_argument('--agent', action='store_true', help='run the resident agent on the hosts')
+    parser.add_argument('--jump', action='store_true', help='reach all hosts but the first one through the first one')
+    parser.add_argument('--repeat', '-r', type=int, default=3, help='repetitions (medians are reported)')
+    parser.add_argument('--scenarios', default=','.join(scenarios), help=f'comma separated subset of {",".join(scenarios)}')
+    parser.add_argument('--save', default=None, help='save results to this json file (e.g. as a baseline)')
+    parser.add_argument('--baseline', default=None, help='compare with the results in this json file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slack on timings before reporting a regression')
+    parser.add_argument('--fail', action='store_true', help='exit with an error on regressions')
+    parser.add_argument('--dump-config', dest='dump_config', default=None, help='write the synthetic config to this yaml file')
+    args = parser.parse_args()
+
+    ok = asyncio.get_event_loop().run_until_complete(main(args))
+
+    exit(0 if ok else 1)
@@ -0,0 +1,103 @@
+"""
+Synthetic launcher configs for the benchmarks. Every generator returns a
+config dict; processes print a line and then sleep, and are ready as soon
+as their window is up.
+"""
+
+import random
+from typing import Dict, List
+
+
+def process(machine, session, depends=[]) -> Dict:
+    pfield = {
+        'cmd': 'echo started; sleep 100000',
+        'machine': machine,
+        'session': session,
+        'ready_check': 'true',
+    }
+    if len(depends) > 0:
+        pfield['depends'] = list(depends)
+    return pfield
+
+
+def context(session) -> Dict:
+    return {'context': {'session': session, 'params': {}}}
+
+
+def wide(machines: List[str], num_processes: int, prefix='clbench') -> Dict:
+
+    """
+    Independent processes, spread over machines (one session per machine)
+    """
+
+    cfg = context(prefix)
+
+    for i in range(num_processes):
+        m = i % len(machines)
+        cfg[f'w{i}'] = process(machines[m], f'{prefix}{m}')
+
+    return cfg
+
+
+def deep(machines: List[str], num_processes: int, prefix='clbench') -> Dict:
+
+    """
+    A single dependency chain, alternating machines
+    """
+
+    cfg = context(prefix)
+
+    for i in range(num_processes):
+        m = i % len(machines)
+        cfg[f'd{i}'] = process(machines[m], f'{prefix}{m}', depends=[f'd{i-1}'] if i > 0 else [])
+
+    return cfg
+
+
+def layered(machines: List[str], num_processes: int, width=10, fanin=3, seed=0, prefix='clbench') -> Dict:
+
+    """
+    Layers of width processes, each depending on up to fanin random
+    processes of the previous layer
+    """
+
+    rng = random.Random(seed)
+
+    cfg = context(prefix)
+
+    prev = []
+
+    for l in range((num_processes + width - 1) // width):
+
+        layer = []
+
+        for j in range(min(width, num_processes - l * width)):
+            name = f'l{l}_{j}'
+            m = rng.randrange(len(machines))
+            deps = rng.sample(prev, min(fanin, len(prev)))
+            cfg[name] = process(machines[m], f'{prefix}{m}', depends=deps)
+            layer.append(name)
+
+        prev = layer
+
+    return cfg
+
+
+graphs = {
+    'wide': wide,
+    'deep': deep,
+    'layered': layered,
+}
+
+
+def targets(cfg: Dict) -> List[str]:
+
+    """
+    Processes nobody depends on (running them runs everything)
+    """
+
+    processes = [p for p in cfg.keys() if p != 'context']
+
+    deps = set(d for p in processes for d in cfg[p].get('depends', []))
+
+    return [p for p in processes if p not in deps]
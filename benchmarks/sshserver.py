@@ -0,0 +1,224 @@
+"""
+Local stand-ins for the remote hosts of a benchmark: an asyncssh server
+per simulated host, which runs the commands it receives on this machine
+(against the local tmux server), reached through a tcp proxy that injects
+latency and packet loss.
+
+Run as a script, it serves the hosts until killed, and prints one json line
+with the proxy port of each host once ready.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import asyncssh
+
+
+class LossyLink:
+
+    """
+    Tcp proxy delaying every chunk by rtt/2 in each direction; a chunk is
+    lost with probability loss, which costs a retransmission timeout (the
+    stream stays ordered, as with tcp)
+    """
+
+    def __init__(self, target_port, rtt=0.0, loss=0.0, seed=0):
+        self.target_port = target_port
+        self.rtt = rtt
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.server = None
+        self.port = None
+
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+
+    def delay(self):
+        delay = self.rtt / 2
+        # lost chunks are resent after the retransmission timeout
+        while self.random.random() < self.loss:
+            delay += max(0.2, 2 * self.rtt)
+        return delay
+
+
+    async def _pipe(self, reader, writer):
+
+        queue = asyncio.Queue()
+
+        async def sender():
+            while True:
+                deliver_at, data = await queue.get()
+                if data is None:
+                    break
+                await asyncio.sleep(deliver_at - time.monotonic())
+                writer.write(data)
+                await writer.drain()
+            writer.close()
+
+        sender_task = asyncio.ensure_future(sender())
+
+        last = 0.0
+
+        try:
+            while True:
+                data = await reader.read(65536)
+                if len(data) == 0:
+                    break
+                # in order delivery
+                last = max(last, time.monotonic() + self.delay())
+                queue.put_nowait((last, data))
+        except ConnectionError:
+            pass
+        finally:
+            queue.put_nowait((last, None))
+
+        await sender_task
+
+
+    async def _handle(self, client_reader, client_writer):
+
+        try:
+            server_reader, server_writer = await asyncio.open_connection('127.0.0.1', self.target_port)
+        except OSError:
+            client_writer.close()
+            return
+
+        try:
+            await asyncio.gather(self._pipe(client_reader, server_writer),
+                                 self._pipe(server_reader, client_writer))
+        except ConnectionError:
+            pass
+
+
+class BenchSSHServer(asyncssh.SSHServer):
+
+    # no authentication
+    def begin_auth(self, username):
+        return False
+
+    # tunnels (hosts used as gateways)
+    def connection_requested(self, dest_host, dest_port, orig_host, orig_port):
+        return True
+
+
+async def handle_process(process: asyncssh.SSHServerProcess):
+
+    # run the command on this machine (without a controlling terminal,
+    # as interactive shells would otherwise compete for ours)
+    proc = await asyncio.create_subprocess_shell(process.command,
+                                                 stdin=asyncio.subprocess.PIPE,
+                                                 stdout=asyncio.subprocess.PIPE,
+                                                 stderr=asyncio.subprocess.PIPE,
+                                                 start_new_session=True)
+
+    async def forward(src, dst):
+        while True:
+            data = await src.read(65536)
+            if len(data) == 0:
+                break
+            dst.write(data.decode(errors='replace'))
+
+    async def forward_stdin():
+        # e.g. requests to the launcher agent
+        try:
+            while True:
+                data = await process.stdin.read(65536)
+                if len(data) == 0:
+                    break
+                proc.stdin.write(data.encode())
+                await proc.stdin.drain()
+        except (ConnectionError, asyncssh.Error):
+            pass
+        finally:
+            proc.stdin.close()
+
+    async def run():
+        await asyncio.gather(forward(proc.stdout, process.stdout),
+                             forward(proc.stderr, process.stderr))
+        return await proc.wait()
+
+    stdin_task = asyncio.ensure_future(forward_stdin())
+
+    run_task = asyncio.ensure_future(run())
+
+    # the client can close the channel before the command ends (e.g. tail -f)
+    closed_task = asyncio.ensure_future(process.channel.wait_closed())
+
+    try:
+        await asyncio.wait([run_task, closed_task], return_when=asyncio.FIRST_COMPLETED)
+        if run_task.done() and run_task.exception() is None:
+            retcode = run_task.result()
+            process.exit(retcode if retcode >= 0 else 128 - retcode)
+    finally:
+        for t in (run_task, closed_task, stdin_task):
+            t.cancel()
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
+async def start_hosts(num_hosts, host_key, rtt=0.0, loss=0.0, seed=0):
+
+    """
+    Start num_hosts servers, each behind its own lossy link, and return
+    the list of proxy ports (clients connect there)
+    """
+
+    ports = []
+
+    for i in range(num_hosts):
+
+        server = await asyncssh.listen('127.0.0.1', 0,
+                                       server_host_keys=[host_key],
+                                       server_factory=BenchSSHServer,
+                                       process_factory=handle_process,
+                                       sftp_factory=True,
+                                       allow_pty=True)
+
+        server_port = server.sockets[0].getsockname()[1]
+
+        link = LossyLink(server_port, rtt=rtt, loss=loss, seed=seed + i)
+
+        await link.start()
+
+        ports.append(link.port)
+
+    return ports
+
+
+async def serve(args):
+
+    host_key = asyncssh.read_private_key(args.host_key)
+
+    ports = await start_hosts(args.hosts, host_key, rtt=args.rtt, loss=args.loss, seed=args.seed)
+
+    print(json.dumps({'ports': ports}), flush=True)
+
+    # serve until killed
+    await asyncio.get_event_loop().create_future()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='simulated ssh hosts for the launcher benchmarks')
+    parser.add_argument('--hosts', type=int, default=1, help='number of simulated hosts')
+    parser.add_argument('--rtt', type=float, default=0.0, help='injected round trip time (seconds)')
+    parser.add_argument('--loss', type=float, default=0.0, help='injected packet loss probability')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the loss process')
+    parser.add_argument('--host-key', dest='host_key', required=True, help='server host key file')
+    args = parser.parse_args()
+
+    try:
+        asyncio.get_event_loop().run_until_complete(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
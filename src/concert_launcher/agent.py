@@ -0,0 +1,214 @@
+from typing import Dict
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AgentError(ConnectionError):
+
+    """
+    The agent exited (or its channel was closed) with requests in flight
+    """
+
+    pass
+
+
+class RemoteAgent:
+
+    """
+    Client of the resident agent of a host (see
+    resources/concert_launcher_agent.py). The agent runs on a single ssh
+    channel of the host connection, and serves concurrent requests, which
+    are matched to their responses by id.
+    """
+
+    path = '/tmp/concert_launcher_agent.py'
+
+    def __init__(self, ssh):
+        self.ssh = ssh
+        self.proc = None
+        self.reader_task = None
+        self.ids = 0
+        self.pending : Dict[int, asyncio.Future] = dict()
+        self.streams : Dict[int, asyncio.Queue] = dict()
+        self.closed = False
+        self.info = None
+
+
+    @property
+    def alive(self):
+        return self.proc is not None and not self.closed
+
+
+    async def start(self, timeout=None):
+
+        """
+        Start the agent, and wait for it to answer
+        """
+
+        # no pty: the protocol needs a clean byte stream (no echo, no \r\n)
+        self.proc = await self.ssh.create_process(f'python3 -u {self.path}', request_pty=False)
+
+        self.reader_task = asyncio.ensure_future(self._read())
+
+        try:
+            self.info = await asyncio.wait_for(self.call('hello'), timeout=timeout)
+        except BaseException:
+            self.close()
+            raise
+
+        logger.info(f'agent running on {self.ssh.machine} ({self.info})')
+
+
+    async def call(self, op, **args):
+
+        """
+        Send a request and return its result; RuntimeError is raised if the
+        request failed, AgentError if the agent is gone. Cancelling the call
+        cancels the request on the agent.
+        """
+
+        rid, fut = self._send(op, args)
+
+        try:
+            return await fut
+        except asyncio.CancelledError:
+            self._cancel(rid)
+            raise
+        finally:
+            self.pending.pop(rid, None)
+
+
+    async def stream(self, op, line_coro, **args):
+
+        """
+        Like call(), for requests streaming output lines (passed to
+        line_coro as they arrive)
+        """
+
+        queue = asyncio.Queue()
+
+        rid, fut = self._send(op, args)
+
+        self.streams[rid] = queue
+
+        get = None
+
+        try:
+
+            while True:
+
+                get = asyncio.ensure_future(queue.get())
+
+                await asyncio.wait([get, fut], return_when=asyncio.FIRST_COMPLETED)
+
+                if get.done():
+                    await line_coro(get.result())
+                    continue
+
+                get.cancel()
+
+                # lines received before the result
+                while not queue.empty():
+                    await line_coro(queue.get_nowait())
+
+                return fut.result()
+
+        except asyncio.CancelledError:
+            self._cancel(rid)
+            raise
+        finally:
+            if get is not None:
+                get.cancel()
+            self.pending.pop(rid, None)
+            self.streams.pop(rid, None)
+
+
+    def close(self):
+
+        if self.proc is not None:
+            self.proc.close()
+
+        self._fail_pending()
+
+
+    def _send(self, op, args):
+
+        if not self.alive:
+            raise AgentError(f'agent on {self.ssh.machine} is not running')
+
+        self.ids += 1
+
+        rid = self.ids
+
+        fut = asyncio.get_event_loop().create_future()
+
+        self.pending[rid] = fut
+
+        self.proc.stdin.write(json.dumps(dict(id=rid, op=op, args=args)) + '\n')
+
+        return rid, fut
+
+
+    def _cancel(self, rid):
+        if self.alive:
+            self.proc.stdin.write(json.dumps(dict(op='cancel', args=dict(target=rid))) + '\n')
+
+
+    async def _read(self):
+
+        try:
+
+            while True:
+
+                l = await self.proc.stdout.readline()
+
+                if len(l) == 0:
+                    break
+
+                try:
+                    msg = json.loads(l)
+                except ValueError:
+                    logger.warning(f'agent on {self.ssh.machine} sent an invalid line: {l.strip()}')
+                    continue
+
+                rid = msg.get('id', None)
+
+                if 'line' in msg.keys():
+                    queue = self.streams.get(rid, None)
+                    if queue is not None:
+                        queue.put_nowait(msg['line'])
+                    continue
+
+                fut = self.pending.get(rid, None)
+
+                if fut is None or fut.done():
+                    continue
+
+                if msg['ok']:
+                    fut.set_result(msg['result'])
+                else:
+                    fut.set_exception(RuntimeError(f'agent request failed ({msg["error"]})'))
+
+        except asyncio.CancelledError:
+            raise
+        except BaseException as ex:
+            logger.warning(f'agent on {self.ssh.machine}: {ex.__class__.__name__} ({ex})')
+        finally:
+            self._fail_pending()
+
+
+    def _fail_pending(self):
+
+        if not self.closed:
+            logger.info(f'agent on {self.ssh.machine} closed')
+
+        self.closed = True
+
+        for fut in self.pending.values():
+            if not fut.done():
+                fut.set_exception(AgentError(f'agent on {self.ssh.machine} exited'))
+
+        self.pending.clear()
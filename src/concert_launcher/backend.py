@@ -0,0 +1,171 @@
+from typing import List, Dict
+import json
+import logging
+import shlex
+
+from concert_launcher import remote
+
+logger = logging.getLogger(__name__)
+
+# backends run the managed processes ('windows', named after the process,
+# grouped by session) on a host. All of them run the launcher wrapper (same
+# log file, /tmp/<process>.stdout, same sched/limits/container handling),
+# report windows in the same format (see remote.tmux_ls), and leave pids that
+# are signalled the same way (see resources/concert_launcher_signal.py).
+#
+#   tmux:      a tmux window plus a grouped session per process, for
+#              interactive attach (default)
+#   headless:  the wrapper runs detached, with its records in files
+#              (resources/concert_launcher_headless.py), no tmux server or
+#              session bookkeeping: meant for large numbers of processes
+#
+# the backend is chosen by the 'backend' field of a process, or of the
+# context for all of them, e.g.
+#
+#   context:
+#     backend: headless
+
+
+class ProcessBackend:
+
+    """
+    Interface of process backends; list_cmd and parse_list describe how
+    windows are listed, the rest is built on them
+    """
+
+    name = None
+
+    def list_cmd(self, sessions: List[str]) -> str:
+        raise NotImplementedError
+
+
+    def parse_list(self, retcode, stdout, sessions: List[str]) -> Dict:
+        raise NotImplementedError
+
+
+    async def spawn(self, ssh, windows: List[Dict]) -> Dict:
+
+        """
+        Make sure the given windows (see remote.tmux_spawn_windows) are
+        running, with a single remote command; returns a dict (session,
+        window) -> {status, config_hash}
+        """
+
+        raise NotImplementedError
+
+
+    async def mark_stopped(self, ssh, windows: List[tuple]):
+
+        """
+        Mark (session, window) pairs as stopped on purpose (see
+        remote.tmux_mark_stopped)
+        """
+
+        raise NotImplementedError
+
+
+    async def list_windows(self, ssh, sessions: List[str]) -> Dict:
+
+        """
+        Dict session -> window -> info for the given sessions, with a
+        single remote command
+        """
+
+        retcode, stdout, _ = await remote.run_cmd(ssh, self.list_cmd(sessions), throw_on_failure=False)
+
+        return self.parse_list(retcode, stdout, sessions)
+
+
+    async def ls(self, ssh, session: str) -> Dict:
+
+        """
+        Dict window -> info of a session, with launcher state records
+        """
+
+        return await remote.ls_windows(ssh, session, self.list_cmd, self.parse_list)
+
+
+    async def alive(self, ssh, session: str, window: str) -> bool:
+        winfo = (await self.list_windows(ssh, [session]))[session].get(window, None)
+        return winfo is not None and not winfo['dead']
+
+
+class TmuxBackend(ProcessBackend):
+
+    name = 'tmux'
+
+    def list_cmd(self, sessions):
+        return remote._list_windows_cmd(sessions)
+
+
+    def parse_list(self, retcode, stdout, sessions):
+        return remote._parse_list_windows(retcode, stdout, sessions)
+
+
+    async def spawn(self, ssh, windows):
+        return await remote.tmux_spawn_windows(ssh, windows)
+
+
+    async def mark_stopped(self, ssh, windows):
+        await remote.tmux_mark_stopped(ssh, windows)
+
+
+    async def alive(self, ssh, session, window):
+        # (reports a missing tmux)
+        return await remote.tmux_session_alive(ssh, session, window)
+
+
+class HeadlessBackend(ProcessBackend):
+
+    name = 'headless'
+
+    def _cmd(self, request: Dict):
+        return f'python3 /tmp/concert_launcher_headless.py {shlex.quote(json.dumps(request))}'
+
+
+    def list_cmd(self, sessions):
+        return self._cmd(dict(op='ls', sessions=sessions))
+
+
+    def parse_list(self, retcode, stdout, sessions):
+
+        if retcode != 0:
+            raise RuntimeError(f'headless ls returned unexpected exit code {retcode}')
+
+        return json.loads(stdout)
+
+
+    async def spawn(self, ssh, windows):
+
+        req = [dict(session=w['session'], window=w['window'], cmd=remote.wrapper_cmd(w),
+                    config_hash=w.get('config_hash', None)) for w in windows]
+
+        _, stdout, _ = await remote.run_cmd(ssh, self._cmd(dict(op='spawn', windows=req)))
+
+        return {tuple(k.split(':', 1)): v for k, v in json.loads(stdout).items()}
+
+
+    async def mark_stopped(self, ssh, windows):
+
+        if len(windows) == 0:
+            return
+
+        await remote.run_cmd(ssh, self._cmd(dict(op='stop', windows=windows)), throw_on_failure=False)
+
+
+backends = {b.name: b for b in (TmuxBackend(), HeadlessBackend())}
+
+default = 'tmux'
+
+
+def validate(name) -> List[str]:
+    if name not in backends.keys():
+        return [f'unknown backend {name} (expected one of {", ".join(backends.keys())})']
+    return []
+
+
+def get(name=None) -> ProcessBackend:
+    name = name or default
+    if name not in backends.keys():
+        raise ValueError(validate(name)[0])
+    return backends[name]
@@ -4,4 +4,57 @@ class ConfigOptions:
 
     verbose = False 
 
-    
\ No newline at end of file
+    # default timeout (seconds) of commands run on connections without one
+    # of their own (e.g. the local machine), see remote.run_cmd
+    command_timeout = None
+
+
+class Timeouts:
+
+    """
+    Deadlines in seconds (None = no limit), read from the 'timeouts' field
+    of the context
+      - connect: opening an ssh connection
+      - command: a single remote command (excluding one shot processes and
+                 kill escalation, which are bounded by the operation budgets)
+      - ready:   a started process becoming ready (a process can override
+                 it with its own 'ready_timeout' field)
+      - run:     a whole run/sync operation
+      - kill:    a whole kill operation
+      - status:  a whole status/pstree read
+      - watch:   a whole watch of process output
+    """
+
+    fields = ['connect', 'command', 'ready', 'run', 'kill', 'status', 'watch']
+
+    def __init__(self, connect=10.0, command=60.0, ready=None, run=None, kill=None, status=None, watch=None):
+        self.connect = connect
+        self.command = command
+        self.ready = ready
+        self.run = run
+        self.kill = kill
+        self.status = status
+        self.watch = watch
+
+
+    @staticmethod
+    def from_cfg(cfg, **overrides):
+
+        """
+        Timeouts from the config context, with overrides (e.g. from the
+        command line) taking precedence unless None
+        """
+
+        timeouts = Timeouts(**cfg['context'].get('timeouts', {}))
+
+        for k, v in overrides.items():
+            if k not in Timeouts.fields:
+                raise KeyError(f'unknown timeout {k}')
+            if v is not None:
+                setattr(timeouts, k, v)
+
+        return timeouts
+
+
+    def __repr__(self):
+        return f'Timeouts({", ".join(f"{k}={getattr(self, k)}" for k in Timeouts.fields)})'
@@ -0,0 +1,251 @@
+from typing import List, Dict
+import asyncio
+import json
+import logging
+import shlex
+
+import asyncssh
+
+logger = logging.getLogger(__name__)
+
+# processes with a 'docker' field run inside that (running) container:
+#
+#   - the tmux window runs a single `docker exec` (no host shell on top of
+#     it), and the command is quoted once, like a native one (see the
+#     launcher wrapper)
+#   - the exec is tagged with the window it belongs to (the marker
+#     environment variable, inherited by the whole exec process tree), which
+#     is the handle used to signal it: killing the docker client does not
+#     stop an exec (see resources/concert_launcher_signal.py)
+#   - ready checks run on a shell kept open in the container
+#     (ContainerShell), so that its rc files are sourced once
+#   - state and usage of all containers of a host are read with a single
+#     command (remote.container_stats)
+
+marker = 'CONCERT_LAUNCHER_WINDOW'
+
+
+def marker_value(session: str, window: str) -> str:
+    return f'{session}:{window}'
+
+
+def exec_cmd(container: str, cmd: str) -> str:
+
+    """
+    Host command running cmd (escaped for a double quoted string, see
+    ConfigParser.parse_cmd) in container, without a tty
+    """
+
+    return f'docker exec -i {container} bash -ic "{cmd}"'
+
+
+class ContainerShell:
+
+    """
+    An interactive shell kept open in a container (one docker exec, on a
+    channel of the host connection), running commands one at a time and
+    returning their exit code. A command that times out closes the shell,
+    the next one starts a new one.
+    """
+
+    sentinel = '__concert_launcher_rc__'
+
+    def __init__(self, ssh, container):
+        self.ssh = ssh
+        self.container = container
+        self.proc = None
+        self.lock = asyncio.Lock()
+
+
+    @property
+    def alive(self):
+        if self.proc is None:
+            return False
+        if self.ssh is None:
+            return self.proc.returncode is None
+        return self.proc.exit_status is None
+
+
+    async def start(self):
+
+        # (no-op if running)
+        async with self.lock:
+            if not self.alive:
+                await self._start()
+
+
+    async def run(self, cmd, timeout=None) -> int:
+
+        async with self.lock:
+
+            try:
+
+                if not self.alive:
+                    await self._start()
+
+                return await asyncio.wait_for(self._run(cmd), timeout=timeout)
+
+            except asyncio.TimeoutError:
+                self.close()
+                raise asyncio.TimeoutError(f'command {cmd} timed out in container {self.container} after {timeout} s')
+            except BaseException:
+                self.close()
+                raise
+
+
+    def close(self):
+
+        if self.proc is None:
+            return
+
+        try:
+            if self.ssh is None:
+                self.proc.kill()
+            else:
+                self.proc.close()
+        except ProcessLookupError:
+            pass
+
+        self.proc = None
+
+
+    async def _start(self):
+
+        # note: no tty (the output must be a clean line stream); rc file
+        # output and prompts go to stderr, which is discarded
+        cmd = f'docker exec -i {self.container} bash -i'
+
+        logger.info(f'starting shell in container {self.container}')
+
+        if self.ssh is None:
+            self.proc = await asyncio.create_subprocess_shell(cmd,
+                                                              stdin=asyncio.subprocess.PIPE,
+                                                              stdout=asyncio.subprocess.PIPE,
+                                                              stderr=asyncio.subprocess.DEVNULL)
+        else:
+            self.proc = await self.ssh.create_process(cmd, request_pty=False, stderr=asyncssh.DEVNULL)
+
+
+    async def _run(self, cmd) -> int:
+
+        # the command runs in a subshell (so that it cannot exit the shell),
+        # its output is discarded, then its exit code is printed
+        line = f'( {cmd}\n) </dev/null >/dev/null 2>&1; echo "{self.sentinel} $?"\n'
+
+        if self.ssh is None:
+            self.proc.stdin.write(line.encode())
+            await self.proc.stdin.drain()
+        else:
+            self.proc.stdin.write(line)
+
+        while True:
+
+            l = await self.proc.stdout.readline()
+
+            if isinstance(l, bytes):
+                l = l.decode(errors='replace')
+
+            if len(l) == 0:
+                raise ConnectionError(f'shell in container {self.container} exited')
+
+            tokens = l.split()
+
+            if len(tokens) == 2 and tokens[0] == self.sentinel:
+                return int(tokens[1])
+
+
+def stats_cmd(containers: List[str]) -> str:
+
+    """
+    Single host command printing the state of the given containers (docker
+    inspect) and the usage of the running ones (one docker stats sample),
+    as json lines
+    """
+
+    names = ' '.join(shlex.quote(c) for c in containers)
+
+    inspect_fmt = shlex.quote('{"name": {{json .Name}}, "status": {{json .State.Status}}, "pid": {{.State.Pid}}}')
+    stats_fmt = shlex.quote('{"name": {{json .Name}}, "cpu": {{json .CPUPerc}}, "mem": {{json .MemUsage}}}')
+
+    filters = ' '.join(f'--filter name=^/{shlex.quote(c)}$' for c in containers)
+
+    # note: docker stats without arguments would list all containers
+    return f'docker inspect --format {inspect_fmt} {names} 2>/dev/null; ' \
+           f'ids=$(docker ps -q {filters}); ' \
+           f'[ -z "$ids" ] || docker stats --no-stream --format {stats_fmt} $ids; true'
+
+
+def parse_stats(stdout: str, containers: List[str]) -> Dict[str, Dict]:
+
+    """
+    Parse the output of stats_cmd: a dict container -> {status, pid, cpu,
+    mem, mem_limit} (cpu in percent, memory in bytes, None if unknown);
+    containers that do not exist have status 'missing'
+    """
+
+    ret = {c: dict(status='missing', pid=None, cpu=None, mem=None, mem_limit=None) for c in containers}
+
+    for l in stdout.split('\n'):
+
+        try:
+            d = json.loads(l)
+        except ValueError:
+            continue
+
+        c = d.get('name', '').lstrip('/')
+
+        if c not in ret.keys():
+            continue
+
+        if 'status' in d.keys():
+            # docker inspect
+            ret[c].update(status=d['status'], pid=d['pid'] or None)
+        else:
+            # docker stats
+            mem, _, mem_limit = d.get('mem', '').partition(' / ')
+            ret[c].update(cpu=_parse_percent(d.get('cpu', '')), mem=_parse_size(mem), mem_limit=_parse_size(mem_limit))
+
+    return ret
+
+
+def _parse_percent(s):
+    try:
+        return float(s.strip().rstrip('%'))
+    except ValueError:
+        return None
+
+
+size_units = {'B': 1, 'KB': 1e3, 'MB': 1e6, 'GB': 1e9, 'TB': 1e12,
+              'KIB': 1 << 10, 'MIB': 1 << 20, 'GIB': 1 << 30, 'TIB': 1 << 40}
+
+
+def _parse_size(s):
+
+    s = s.strip().upper()
+
+    for unit in sorted(size_units.keys(), key=len, reverse=True):
+        if s.endswith(unit):
+            try:
+                return int(float(s[:-len(unit)]) * size_units[unit])
+            except ValueError:
+                return None
+
+    return None
+
+
+def format_stats(stats: Dict) -> str:
+
+    if stats['status'] != 'running':
+        return f'container {stats["status"]}'
+
+    ret = 'container running'
+
+    if stats['cpu'] is not None:
+        ret += f', cpu {stats["cpu"]:.1f}%'
+
+    if stats['mem'] is not None:
+        ret += f', mem {stats["mem"] / (1 << 20):.0f} MiB'
+        if stats['mem_limit'] is not None:
+            ret += f' / {stats["mem_limit"] / (1 << 20):.0f} MiB'
+
+    return ret
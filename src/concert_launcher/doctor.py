@@ -0,0 +1,322 @@
+from typing import List, Dict
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import asyncssh
+
+from concert_launcher import remote, container
+from concert_launcher.executor import HostConnection
+
+logger = logging.getLogger(__name__)
+
+
+# measurements, in report order (see diagnose_host)
+probes = ['connect', 'exec', 'shell', 'shell -i', 'tmux', 'sftp']
+
+
+class HostReport:
+
+    """
+    Latency samples (seconds) of a machine, by probe name (ready checks
+    are named 'ready <process>'), plus sftp throughput (bytes/s) samples
+    and the errors met
+    """
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.via = None
+        self.samples : Dict[str, List[float]] = dict()
+        self.throughput : List[float] = []
+        self.errors : List[str] = []
+
+
+    def add(self, probe, dt):
+        self.samples.setdefault(probe, []).append(dt)
+
+
+    def median(self, probe):
+        s = self.samples.get(probe, [])
+        return statistics.median(s) if len(s) > 0 else None
+
+
+    def costs(self) -> Dict[str, float]:
+
+        """
+        Median cost of every step of a bring-up, each net of the steps it
+        includes: shell startup and tmux are measured through an exec
+        channel, interactive shell init on top of a plain shell
+        """
+
+        exec_ = self.median('exec') or 0.0
+
+        ret = dict()
+
+        if self.median('connect') is not None:
+            ret['connect'] = self.median('connect')
+
+        if self.median('exec') is not None:
+            ret['exec channel'] = exec_
+
+        if self.median('shell') is not None:
+            ret['shell startup'] = max(0.0, self.median('shell') - exec_)
+
+        if self.median('shell -i') is not None and self.median('shell') is not None:
+            ret['interactive shell init'] = max(0.0, self.median('shell -i') - self.median('shell'))
+
+        if self.median('tmux') is not None:
+            ret['tmux'] = max(0.0, self.median('tmux') - exec_)
+
+        for probe in self.samples.keys():
+            if probe.startswith('ready '):
+                ret[probe + ' check'] = max(0.0, self.median(probe) - exec_)
+
+        return ret
+
+
+    def dominant(self):
+        costs = self.costs()
+        if len(costs) == 0:
+            return None, None
+        k = max(costs.keys(), key=lambda k: costs[k])
+        return k, costs[k]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+
+    s = sorted(samples)
+
+    return {
+        'n': len(s),
+        'min': s[0],
+        'median': statistics.median(s),
+        'p90': s[min(len(s) - 1, int(0.9 * len(s)))],
+        'max': s[-1],
+    }
+
+
+async def _timed(coro):
+    t0 = time.monotonic()
+    ret = await coro
+    return time.monotonic() - t0, ret
+
+
+async def diagnose_host(machine, entries: List, samples=5, connect_timeout=None, command_timeout=None,
+                        ssh_options={}, sftp_size=1 << 20, jump: HostConnection = None) -> HostReport:
+
+    """
+    Measure the launcher overheads on a machine (None = local machine):
+      - connect:  opening an ssh connection
+      - exec:     opening an exec channel and running `true`
+      - shell:    `bash -c true`, i.e. exec plus a plain shell
+      - shell -i: `bash -ic true`, i.e. with the rc files (user commands)
+      - tmux:     `tmux list-w -a`
+      - sftp:     uploading sftp_size bytes
+      - ready <p>: the ready check of process p, as the launcher runs it
+                  (on a shell kept open in its container, if any)
+    Entries are the ConfigParsers of the processes on the machine; machines
+    behind a gateway are connected through the given jump connection,
+    opened once. Probes run one after the other, so that they do not compete.
+    """
+
+    report = HostReport('local' if machine is None else machine)
+
+    ssh = None
+
+    shells = dict()
+
+    async def probe(name, coro_fn):
+        # a failing probe is reported, and does not stop the others
+        for _ in range(samples):
+            try:
+                dt, _ = await _timed(coro_fn())
+                report.add(name, dt)
+            except asyncio.CancelledError:
+                raise
+            except BaseException as ex:
+                report.errors.append(f'{name}: {ex.__class__.__name__} ({ex})')
+                return
+
+    try:
+
+        if machine is not None:
+
+            ssh_options = dict(ssh_options)
+            ssh_options.pop('agent', None)
+            ssh_options['jump'] = jump
+            ssh_options['command_timeout'] = command_timeout
+
+            # the gateway connection is shared, and opened once
+            if jump is not None:
+                report.via = jump.machine
+                try:
+                    await jump.upstream()
+                except ConnectionError as ex:
+                    report.errors.append(f'gateway: {ex}')
+                    return report
+
+            async def connect():
+                conn = HostConnection(machine, connect_timeout=connect_timeout, **ssh_options)
+                ok = await conn.connect()
+                conn.close()
+                if not ok:
+                    raise ConnectionError(f'failed to connect to {machine}')
+
+            await probe('connect', connect)
+
+            ssh = HostConnection(machine, connect_timeout=connect_timeout, **ssh_options)
+
+            if not await ssh.connect():
+                report.errors.append(f'failed to connect to {machine}')
+                return report
+
+            await probe('exec', lambda: remote.run_cmd(ssh, 'true'))
+
+        # note: the local machine has no connection carrying the command
+        # timeout, it is given explicitly
+        timeout = command_timeout or None
+
+        await probe('shell', lambda: remote.run_cmd(ssh, "bash -c 'true'", timeout=timeout))
+
+        await probe('shell -i', lambda: remote.run_cmd(ssh, 'true', timeout=timeout, interactive=True))
+
+        # no server running is not an error
+        await probe('tmux', lambda: remote.run_cmd(ssh, 'tmux list-w -a', timeout=timeout, throw_on_failure=False))
+
+        if machine is not None:
+            await _probe_sftp(ssh, report, samples, sftp_size)
+
+        for e in entries:
+
+            if e.ready_check is None:
+                continue
+
+            name = f'ready {e.name}'
+
+            # as the launcher runs them (not ready is fine)
+            if e.docker is not None:
+                shell = shells.setdefault(e.docker, container.ContainerShell(ssh, e.docker))
+                await probe(name, lambda: shell.run(e.ready_check, timeout=timeout))
+            else:
+                await probe(name, lambda: remote.run_cmd(ssh, e.ready_check, timeout=timeout, throw_on_failure=False))
+
+    finally:
+
+        for shell in shells.values():
+            shell.close()
+
+        if ssh is not None:
+            ssh.close()
+
+    return report
+
+
+async def _probe_sftp(ssh, report: HostReport, samples, size):
+
+    fd, local_path = tempfile.mkstemp(prefix='concert_launcher_doctor_')
+
+    # note: the remote /tmp might be ours (e.g. local test hosts)
+    remote_path = f'/tmp/{os.path.basename(local_path)}.sftp'
+
+    try:
+
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(size))
+
+        # note: each upload opens its own sftp session, as putfile does
+        for _ in range(samples):
+            dt, _ = await _timed(ssh.put(local_path, remote_path))
+            report.add('sftp', dt)
+            report.throughput.append(size / dt)
+
+        await remote.run_cmd(ssh, f'rm -f {remote_path}', throw_on_failure=False)
+
+    except asyncio.CancelledError:
+        raise
+    except (asyncssh.Error, OSError) as ex:
+        report.errors.append(f'sftp: {ex.__class__.__name__} ({ex})')
+    finally:
+        os.remove(local_path)
+
+
+async def diagnose(launcher, processes: List[str] = None, samples=5, sftp_size=1 << 20) -> Dict[str, HostReport]:
+
+    """
+    Diagnose all machines used by the given processes (default: all), in
+    parallel; return a dict machine -> HostReport
+    """
+
+    if processes is None:
+        processes = launcher.get_processes()
+
+    by_host = dict()
+
+    for p in processes:
+
+        # note: ready checks are run as configured (in a container, on
+        # the shell kept open there), there is no command to parse
+        e = launcher.config_parser(p)
+
+        by_host.setdefault(e.machine, []).append(e)
+
+    timeouts = launcher.timeouts
+
+    ssh_options = launcher.cfg['context'].get('ssh', {})
+
+    # gateways are shared with the launcher pool
+    def jump(machine):
+        gateway = remote.jump_host(ssh_options.get('jump', {}), machine)
+        return None if gateway is None else launcher.pool.host_connection(gateway)
+
+    reports = await asyncio.gather(*[diagnose_host(machine, entries, samples=samples,
+                                                   connect_timeout=timeouts.connect,
+                                                   command_timeout=timeouts.command,
+                                                   ssh_options=ssh_options,
+                                                   sftp_size=sftp_size,
+                                                   jump=jump(machine))
+                                     for machine, entries in by_host.items()])
+
+    return {r.machine: r for r in reports}
+
+
+def format_report(reports: Dict[str, HostReport]) -> str:
+
+    ms = lambda t: f'{1e3 * t:8.1f}'
+
+    lines = []
+
+    for machine, r in reports.items():
+
+        lines.append(f'{machine}' if r.via is None else f'{machine} (via {r.via})')
+        lines.append(f'  {"":28s} {"n":>3s} {"min":>8s} {"median":>8s} {"p90":>8s} {"max":>8s}  (ms)')
+
+        names = probes + sorted(k for k in r.samples.keys() if k.startswith('ready '))
+
+        for name in names:
+            if name not in r.samples.keys():
+                continue
+            s = summarize(r.samples[name])
+            lines.append(f'  {name:28s} {s["n"]:3d} {ms(s["min"])} {ms(s["median"])} {ms(s["p90"])} {ms(s["max"])}')
+
+        if len(r.throughput) > 0:
+            lines.append(f'  sftp throughput {statistics.median(r.throughput) / (1 << 20):.1f} MiB/s (median)')
+
+        for err in r.errors:
+            lines.append(f'  error: {err}')
+
+        costs = r.costs()
+
+        if len(costs) > 0:
+            lines.append('  median costs: ' + ', '.join(f'{k} {1e3 * v:.1f} ms' for k, v in costs.items()))
+
+        k, v = r.dominant()
+
+        if k is not None:
+            lines.append(f'  dominant cost: {k} ({1e3 * v:.1f} ms)')
+
+        lines.append('')
+
+    return '\n'.join(lines)
@@ -0,0 +1,272 @@
+from typing import List
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LauncherEvent:
+
+    """
+    A launcher event. Kinds are
+      - 'state': process state change (state, and possibly exit_code
+                 and duration, i.e. seconds since the operation on the
+                 process started)
+      - 'message': human readable progress message (message)
+    """
+
+    STATE = 'state'
+    MESSAGE = 'message'
+
+    def __init__(self, kind, process, host=None, state=None, message=None,
+                 exit_code=None, duration=None, op=None, timestamp=None):
+        self.kind = kind
+        self.process = process
+        self.host = host
+        self.state = state
+        self.message = message
+        self.exit_code = exit_code
+        self.duration = duration
+        self.op = op
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+
+    def to_dict(self):
+        return {k: v for k, v in self.__dict__.items() if v is not None}
+
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+
+    def __repr__(self):
+        return f'LauncherEvent({self.to_dict()})'
+
+
+class Subscription:
+
+    """
+    Bounded event queue of a single subscriber. Publishing never blocks: if
+    a state event for the same process is still queued it is replaced by
+    the newer one (coalescing), and when the queue is full the oldest
+    message event is dropped. The latest state of every process is always
+    kept: a queue full of state events (one per process) grows past
+    maxsize rather than losing one, and new messages are dropped instead.
+    """
+
+    def __init__(self, bus, maxsize=256, filter_fn=None):
+        self.bus = bus
+        self.maxsize = maxsize
+        self.filter_fn = filter_fn
+        self.queue = collections.deque()
+        self.pending_state = dict()
+        self.available = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+
+
+    def put(self, ev: LauncherEvent):
+
+        if self.closed:
+            return
+
+        if self.filter_fn is not None and not self.filter_fn(ev):
+            return
+
+        if ev.kind == LauncherEvent.STATE:
+
+            # coalesce with a queued state update of the same process
+            # (the newer one takes its place at the back of the queue)
+            holder = self.pending_state.pop(ev.process, None)
+
+            if holder is not None:
+                self.queue.remove(holder)
+
+        if len(self.queue) >= self.maxsize and not self._drop_message() and ev.kind != LauncherEvent.STATE:
+            # queue is full of state updates (one per process)
+            self.dropped += 1
+            return
+
+        holder = [ev]
+
+        self.queue.append(holder)
+
+        if ev.kind == LauncherEvent.STATE:
+            self.pending_state[ev.process] = holder
+
+        self.available.set()
+
+
+    def _drop_message(self):
+
+        for holder in self.queue:
+            if holder[0].kind != LauncherEvent.STATE:
+                self.queue.remove(holder)
+                self.dropped += 1
+                return True
+
+        return False
+
+
+    def get_nowait(self) -> LauncherEvent:
+
+        holder = self.queue.popleft()
+
+        ev = holder[0]
+
+        if self.pending_state.get(ev.process, None) is holder:
+            del self.pending_state[ev.process]
+
+        if len(self.queue) == 0:
+            self.available.clear()
+
+        return ev
+
+
+    async def get(self) -> LauncherEvent:
+
+        """
+        Return the next event, or None once the subscription is closed and
+        all queued events were consumed
+        """
+
+        while len(self.queue) == 0:
+            if self.closed:
+                return None
+            await self.available.wait()
+
+        return self.get_nowait()
+
+
+    def close(self):
+
+        # queued events can still be consumed
+        self.closed = True
+        self.available.set()
+        self.bus.unsubscribe(self)
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        ev = await self.get()
+        if ev is None:
+            raise StopAsyncIteration
+        return ev
+
+
+class EventBus:
+
+    def __init__(self):
+        self.subscriptions : List[Subscription] = []
+
+
+    def subscribe(self, maxsize=256, filter_fn=None) -> Subscription:
+        sub = Subscription(self, maxsize=maxsize, filter_fn=filter_fn)
+        self.subscriptions.append(sub)
+        return sub
+
+
+    def unsubscribe(self, sub: Subscription):
+        if sub in self.subscriptions:
+            self.subscriptions.remove(sub)
+
+
+    def publish(self, ev: LauncherEvent):
+        for sub in list(self.subscriptions):
+            sub.put(ev)
+
+
+async def forward_to_callback(sub: Subscription, callback):
+
+    """
+    Deliver events to a legacy notify_event(process, text) coroutine
+    """
+
+    async for ev in sub:
+
+        if ev.kind == LauncherEvent.STATE:
+            text = f'state is {ev.state}'
+        else:
+            text = ev.message
+
+        try:
+            await callback(ev.process, text)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as ex:
+            logger.error(f'event callback raised {ex.__class__.__name__}: {ex}')
+
+
+class JsonLinesExporter:
+
+    """
+    Serves all bus events as JSON lines on a unix socket; every connected
+    client gets its own bounded subscription
+    """
+
+    def __init__(self, bus: EventBus, path: str, maxsize=1024):
+        self.bus = bus
+        self.path = path
+        self.maxsize = maxsize
+        self.server = None
+        self.subscriptions = []
+        self.clients = []
+
+
+    async def start(self):
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        self.server = await asyncio.start_unix_server(self._handle_client, path=self.path)
+
+        logger.info(f'serving events on {self.path}')
+
+
+    async def _handle_client(self, reader, writer):
+
+        sub = self.bus.subscribe(maxsize=self.maxsize)
+
+        self.subscriptions.append(sub)
+
+        done = asyncio.get_event_loop().create_future()
+
+        self.clients.append(done)
+
+        try:
+            async for ev in sub:
+                writer.write((ev.to_json() + '\n').encode())
+                await writer.drain()
+        except (ConnectionError, BrokenPipeError):
+            pass
+        finally:
+            sub.close()
+            self.subscriptions.remove(sub)
+            writer.close()
+            done.set_result(True)
+
+
+    async def close(self, timeout=1.0):
+
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+        # clients get the queued events, then eof
+        for sub in list(self.subscriptions):
+            sub.close()
+
+        pending = [c for c in self.clients if not c.done()]
+
+        if len(pending) > 0:
+            await asyncio.wait(pending, timeout=timeout)
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -2,27 +2,18 @@ from typing import List, Dict
 import os
 import logging
 import time
-from concert_launcher import print_utils, config, remote
+import yaml
+import json
+import hashlib
+import itertools
+import socket
+from concert_launcher import print_utils, config, remote, plan, events, sched, limits, profiling, container, files, backend
+from concert_launcher.agent import RemoteAgent
 import asyncssh
 import asyncio
 
 logger = logging.getLogger(__name__)
 
-# dict holding ssh connections (to avoid repeating them)
-connection_map : Dict[str, asyncssh.SSHClientConnection] = dict()
-connection_map_lock = asyncio.Lock()
-
-# pending procs = processes that are being started
-run_pending_proc = set()
-kill_pending_proc = set()
-
-# completed procs = processes that were successfully started
-run_completed_proc = set()
-run_completed_proc_cond = asyncio.Condition()
-kill_completed_proc = set()
-kill_completed_proc_cond = asyncio.Condition()
-
-
 
 class Variant:
 
@@ -55,686 +46,2299 @@ class Variant:
         logger.debug(f'        with cmd {self.cmd}')
 
 
-class ConfigParser:
-    
-    def __init__(self, process, cfg, notify_ev_callback=None, level=0) -> None:
+class _ConnectionObserver(asyncssh.SSHClient):
 
-        # master cfg
-        self.cfg = cfg
-        
-        # print with intentation to reflect dependency tree
-        self.print_fn = print_utils.ProgressReporter.get_print_fn(process, level)
-        self.notify_ev_callback = notify_ev_callback
-        
-        # not used atm
-        self.verbose = config.ConfigOptions.verbose
-        
-        # parse config
-        pfield = cfg[process]
-        self.pfield = pfield
+    def __init__(self):
+        self.lost = False
 
-        # cmd needs calling parse_cmd()
-        self.cmd = None 
-        
-        # parse remote machine (none = local machine)
-        self.machine = pfield.get('machine', None)
+    def connection_lost(self, exc):
+        self.lost = True
+        if exc is not None:
+            logger.warning(f'ssh connection lost ({exc})')
 
-        if self.machine == 'local':
-            self.machine = None
 
-        # parse docker
-        self.docker = pfield.get('docker', None)
-        
-        # cmd that returns 0 if proc is ready
-        self.ready_check = pfield.get('ready_check', None)
-        
-        # not persistent means one shot command (does not stay alive)
-        self.persistent = pfield.get('persistent', True)
-        
-        # session name for this proc (used to group procs into tmux sessions)
-        self.session = pfield.get('session', cfg['context']['session'])
-        
-        # list of dependencies
-        self.deps = pfield.get('depends', [])
+class _PooledConnection:
 
-        # parse variants
-        self.variants = []
-        
-        if 'variants' in pfield.keys():
-            for v in pfield['variants'].keys():
-                var = Variant(v, pfield['variants'])
-                self.variants.append(var)
+    def __init__(self, conn, observer: _ConnectionObserver, capacity):
+        self.conn = conn
+        self.observer = observer
+        self.capacity = capacity
+        self.active = 0
 
-        # save name
-        self.name = process
+    @property
+    def alive(self):
+        return not self.observer.lost
 
-        # force sigquit
-        self.force_sigquit = pfield.get('force_sigquit', False)
 
+class HostConnection:
 
-    async def print(self, text, **kwargs):
-        if self.notify_ev_callback is not None:
-            await self.notify_ev_callback(self.name, text)
-        self.print_fn(text)
+    """
+    Ssh connections to a machine, standing in for an asyncssh connection
+    (run() and create_process() are what the remote module uses).
+    Channels are spread over up to max_connections connections, with at
+    most max_channels channels each: extra connections are opened when
+    this budget is exhausted, further requests wait for a free channel.
+    Connections are kept alive (and detected dead) by ssh keepalives;
+    dead connections are dropped and replaced, reconnecting with
+    exponential backoff. Machines behind a gateway (jump) are reached
+    through tunnels over a single connection to the gateway.
+    """
 
+    def __init__(self, machine, connect_timeout=None,
+                 max_channels=8, max_connections=4,
+                 keepalive_interval=5.0, keepalive_count_max=3,
+                 reconnect_attempts=4, jump=None, command_timeout=None):
 
-    async def notify_state(self, state):
-        if self.notify_ev_callback is not None:
-            await self.notify_ev_callback(self.name, f'state is {state}')
+        self.machine = machine
+        self.username, self.host = machine.split('@')
+        self.connect_timeout = connect_timeout
+        self.max_channels = max_channels
+        self.max_connections = max_connections
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count_max = keepalive_count_max
+        self.reconnect_attempts = reconnect_attempts
 
+        # HostConnection of the gateway (None = direct connection)
+        self.jump = jump
 
-    def parse_cmd(self, user_params, user_variants):
+        # default timeout (seconds) of the commands run on the machine, see
+        # remote.run_cmd
+        self.command_timeout = command_timeout
 
-        # start with global params + user params
-        params = self.cfg['context'].get('params', {})
-        params = dict(params)
-        params.update(**user_params)
-            
-        # parse variants to update cmd and params
-        cmd = self.pfield['cmd']
+        self.conns : List[_PooledConnection] = []
+        self.opening = 0
+        self.cond = asyncio.Condition()
+        # first connection (shared with the tunnels of the machines behind)
+        self.connect_lock = asyncio.Lock()
 
-        for v in self.variants:
-            v : Variant = v
-            for vuser in user_variants:
-                if vuser not in v.choices:
-                    continue
-                if v.cmd[vuser] is not None:
-                    cmd = v.cmd[vuser].replace('{cmd}', cmd)
-                params.update(**v.params[vuser])
+        # resident agent (see agent.py), set by the connection pool
+        self.agent = None
 
-        # parse params
-        try:
-            self.cmd = cmd.format(**params)
-        except KeyError as e:
-            logger.error(f'{e}: specify missing params inside cfg.context.params or with --params key:=value')
-            raise e
 
-        # escape bash special chars
-        self.cmd = self.cmd.replace('$', '\\$')
-        self.cmd = self.cmd.replace('"', '\\"')
+    async def connect(self):
 
-        # add docker
-        if self.docker is not None:
-            self.cmd = f'docker exec -it {self.docker} bash -ic \\"{self.cmd}\\"'
-            if self.ready_check is not None:
-                self.ready_check = f'docker exec -it {self.docker} bash -ic "{self.ready_check}"'
+        """
+        Open the first connection (single attempt, unless one is open
+        already), return True on success
+        """
 
+        async with self.connect_lock:
 
-    async def connect(self):
-        
-        async with connection_map_lock:
-
-            # connect to remote
-            if self.machine is not None and self.machine not in connection_map.keys():
-                await self.print(f'opening ssh connection to remote {self.machine}')
-                self.ssh = await self._connect()
-                await self._upload_resources()
-                connection_map[self.machine] = self.ssh 
-                return self.ssh is not None
-            elif self.machine is not None:
-                self.ssh = connection_map[self.machine]
-                return self.ssh is not None
-            else:
-                self.ssh = None 
-                await self._upload_resources()
+            if any(pc.alive for pc in self.conns):
                 return True
 
+            pc = await self._connect()
 
-    async def _connect(self):
-        
-        user, host = self.machine.split('@')
-        conn = None
+            if pc is None:
+                return False
 
-        try:
-            logger.info(f'waiting for ssh connection to {self.machine}')
-            conn = await asyncssh.connect(host=host, username=user, request_pty='force')
-            logger.info(f'created ssh connection to {self.machine}')
-        except asyncssh.ChannelOpenError as ex:
-            logging.error(f'asyncssh.ChannelOpenError: failed to connect to {self.machine} ({ex.reason})')
-        except BaseException as ex:
-            logging.error(f'{ex.__class__}: failed to connect to {self.machine} ({ex})')
+            async with self.cond:
+                self.conns.append(pc)
+                self.cond.notify_all()
 
-        return conn 
-    
+        return True
 
-    async def _upload_resources(self):
 
-        if self.machine is None:
-            user, host = 'local_user', 'local_host'
-        else:
-            user, host = self.machine.split('@')
-        
-        resource_files = [
-            "concert_launcher_wrapper.bash",
-            "concert_launcher_print_ps_tree.py"
-        ]
-        
-        has_resource_files = True 
-        
-        for rf in resource_files:
-            logging.info(f'looking up /tmp/{rf} in {user}@{host}')
-            ret, _, _, = await remote.run_cmd(self.ssh, f'ls /tmp/{rf}', throw_on_failure=False)
-            if ret != 0:
-                logging.info(f'looking up /tmp/{rf} in {user}@{host} -> NOT FOUND')
-                has_resource_files = False 
-                break
+    async def upstream(self):
 
-        # copy needed files to remote
-        if not has_resource_files:
-            logging.info('uploading resources')
-            await remote.putfile(self.ssh, os.path.dirname(__file__) + "/resources/concert_launcher_wrapper.bash", '/tmp')
-            await remote.putfile(self.ssh, os.path.dirname(__file__) + "/resources/concert_launcher_print_ps_tree.py", '/tmp')
-            logging.info('uploading resources DONE')
+        """
+        A live connection to this machine, shared by the tunnels to the
+        machines behind it (it can carry channels of its own, too)
+        """
 
+        async with self.connect_lock:
 
-async def execute_process(process, cfg, params={}, variants=[], notify_event=None, level=0):
+            for pc in self.conns:
+                if pc.alive:
+                    return pc.conn
 
-    # parse config
-    e = ConfigParser(process=process, cfg=cfg, level=level, notify_ev_callback=notify_event)
+            pc = await self._reconnect()
 
-    # finalization fn
-    async def notify_completed(process, ssh):
+            async with self.cond:
+                self.conns.append(pc)
+                self.cond.notify_all()
 
-        # notify completion
-        async with run_completed_proc_cond:
-            run_completed_proc.add(process)
-            run_completed_proc_cond.notify_all()
-        
-        # remove marker file
-        await remote.run_cmd(ssh, f'rm -f /tmp/{process}.STARTING')
-    
-    # actual execution
-    try:
+            return pc.conn
 
-        # connect ssh
-        await e.connect()    
 
-        # shorthand
-        ssh = e.ssh
+    async def run(self, cmd, **kwargs):
 
-        return await _execute_process(process, cfg, e, params, variants, notify_event, level)
+        # a command whose channel could not be opened did not start, so
+        # it is safe to retry it (e.g. on a new connection)
+        for attempt in range(3):
 
-    except BaseException:
+            pc = await self._acquire()
 
-        raise
+            try:
+                return await pc.conn.run(cmd, **kwargs)
+            except asyncssh.ChannelOpenError as ex:
+                self._channel_open_failed(pc, ex)
+                if attempt == 2:
+                    raise
+            finally:
+                await self._release(pc)
 
-    finally:
 
-        await notify_completed(process, e.ssh)
+    async def create_process(self, cmd, **kwargs):
 
-    
-async def _execute_process(process: str, 
-                           cfg,
-                           config_parser: ConfigParser, 
-                           params, 
-                           variants, 
-                           notify_event, 
-                           level):
-
-    # shothands
-    e = config_parser
-    ssh = e.ssh
-
-    # clear proc cache
-    if level == 0:
-        run_completed_proc.clear()
-        run_pending_proc.clear()
-    
-    # await for process completion if pending
-    # i.e. the process was already started as a dependency of another
-    await e.notify_state(state='WaitingDependencies')
+        for attempt in range(3):
 
-    if process in run_pending_proc:
-        
-        logging.info(f'process {process} pending; waiting for completion..')
-        
-        def is_completed():
-            return process in run_completed_proc
-        
-        async with run_completed_proc_cond:
-            await run_completed_proc_cond.wait_for(is_completed)
+            pc = await self._acquire()
 
-        return
-    
-    # add to pending
-    run_pending_proc.add(process)
+            try:
+                proc = await pc.conn.create_process(cmd, **kwargs)
+            except asyncssh.ChannelOpenError as ex:
+                await self._release(pc)
+                self._channel_open_failed(pc, ex)
+                if attempt == 2:
+                    raise
+                continue
+            except BaseException:
+                await self._release(pc)
+                raise
 
-    # create marker file
-    # note: this will be removed by the caller function (finally block)
-    await remote.run_cmd(ssh, f'touch /tmp/{process}.STARTING')
+            # the channel is given back once the process is closed
+            async def release_on_close():
+                try:
+                    await proc.wait_closed()
+                finally:
+                    await self._release(pc)
 
-    # process dependencies
-    dep_coro_list = []
+            asyncio.ensure_future(release_on_close())
 
-    for dep in e.deps:
-        await e.print(f'depends on {dep}')
-        dep_coro_list.append(execute_process(dep, cfg, params, variants, notify_event, level+1))
+            return proc
 
-    if len(dep_coro_list) > 0:
-        logger.info('waiting for dependencies..')
-        await asyncio.gather(*dep_coro_list)
-        logger.info('..ok')
 
-    # non-persistent processes are just one shot commands
-    if not e.persistent:
-    
-        await e.print(f'running command')
-        
-        # parse cmdline
-        e.parse_cmd(params, variants)
-        
-        # run
-        exitcode, stdout, stderr = await remote.run_cmd(ssh, e.cmd, 
-                                                        interactive=True, 
-                                                        throw_on_failure=False)
-        # print stdout
-        for l in stdout.split('\n'):
-            await e.print(f'[stdout] {l}')
-        
-        # handle exit code
-        if exitcode != 0:
-            await e.print(f'failed (exit code {exitcode})')
-        else:
-            await e.print(f'success')
-        
-        return exitcode == 0
+    async def put(self, local_paths, remote_path, preserve=False):
 
-    # parse cmdline
-    e.parse_cmd(params, variants)
-        
-    # check already running
-    session_exists = await remote.tmux_session_alive(ssh, e.session, process)
-    
-    if session_exists:
-        await e.print(f'exists')
-    else:
-        await e.print(f'running process..')
-    
-        
-            
-        # run
-        await remote.tmux_spawn_new_session(ssh, e.session, process, e.cmd)
-        await e.print('..done')
+        """
+        Copy local files (a path or a list of paths) to remote_path (a
+        directory, if several files are given) over sftp, on a channel of
+        the budget; preserve keeps modification times and permissions
+        """
 
-    # ready check
-    if e.ready_check is not None:
+        for attempt in range(3):
 
-        while True:
-            
-            t0 = time.time()
+            pc = await self._acquire()
 
-            await e.print('checking for readiness')
-            await e.notify_state(state='WaitingReady')
+            try:
+                async with pc.conn.start_sftp_client() as sftp:
+                    return await sftp.put(local_paths, remote_path, preserve=preserve)
+            except asyncssh.ChannelOpenError as ex:
+                self._channel_open_failed(pc, ex)
+                if attempt == 2:
+                    raise
+            finally:
+                await self._release(pc)
 
-            retcode, _, _ = await remote.run_cmd(ssh, e.ready_check, interactive=False, throw_on_failure=False)
 
-            if not await remote.tmux_session_alive(ssh, e.session, process):
-                raise RuntimeError(f'process {e.session}:{process} no longer exists')
-            
-            if retcode == 0:
-                logger.info(f'ready check for process {process} returned 0')
-                break
+    def close(self):
+        if self.agent is not None:
+            self.agent.close()
+        for pc in self.conns:
+            pc.conn.close()
+        self.conns = []
 
-            to_sleep = 0.666 - (time.time() - t0)  # at least 1 sec
-            
-            await asyncio.sleep(to_sleep)
-    
-    # post_execute
 
+    def _channel_open_failed(self, pc: _PooledConnection, ex):
 
-    await e.print(f'ready')
-    await e.notify_state(state='Ready')
-    return True
+        if not pc.alive or pc.conn.is_closed():
+            logger.warning(f'connection to {self.machine} closed, reconnecting')
+            pc.observer.lost = True
+            return
 
+        # the server refused the channel (e.g. sshd MaxSessions): do not
+        # use more channels than we have now on this connection
+        pc.capacity = max(1, pc.active - 1)
+        logger.warning(f'{self.machine} refused a channel ({ex.reason}), capping connection to {pc.capacity} channels')
 
-async def kill(process, cfg, level=0, graceful=True, notify_event=None):
-    
-    e = ConfigParser(process=process, cfg=cfg, level=level, notify_ev_callback=notify_event)
 
-    try:
+    async def _acquire(self) -> _PooledConnection:
 
-        # parse config and connect ssh
-        await e.connect()
+        async with self.cond:
 
-        # actual execution
-        return await _kill(process, cfg, e, level, graceful, notify_event)
+            while True:
 
-    except BaseException as ex:
+                self.conns = [pc for pc in self.conns if pc.alive]
 
-        raise 
+                free = [pc for pc in self.conns if pc.active < pc.capacity]
 
-    finally:
+                if len(free) > 0:
+                    pc = min(free, key=lambda pc: pc.active)
+                    pc.active += 1
+                    return pc
 
-        # complete fn
-        async with kill_completed_proc_cond:
-            kill_completed_proc.add(process)
-            kill_completed_proc_cond.notify_all()
-        
-        # remove marker file
-        await remote.run_cmd(e.ssh, f'rm -f /tmp/{process}.KILLING')
+                if len(self.conns) + self.opening < self.max_connections:
+                    self.opening += 1
+                    break
 
+                await self.cond.wait()
 
-async def _kill(process, 
-                cfg,
-                config_parser: ConfigParser, 
-                level, 
-                graceful, 
-                notify_event):
+        # open a new connection (outside the lock)
+        try:
+            pc = await self._reconnect()
+        finally:
+            async with self.cond:
+                self.opening -= 1
+                self.cond.notify_all()
 
-    # shorthand
-    e = config_parser
+        async with self.cond:
+            pc.active += 1
+            self.conns.append(pc)
 
-    # clear proc cache
-    if level == 0:
-        kill_completed_proc.clear()
-        kill_pending_proc.clear()
+        return pc
 
-    # if process is none, kill all
-    if process is None:
-        
-        pprint = print_utils.ProgressReporter.get_print_fn('all', level=0)
 
-        pprint('will kill all processes')
+    async def _release(self, pc: _PooledConnection):
+        async with self.cond:
+            pc.active -= 1
+            self.cond.notify_all()
 
-        proc_coro_list = []
 
-        for process, pfield in cfg.items():
+    async def _reconnect(self) -> _PooledConnection:
 
-            if process == 'context':
-                continue
-            
-            proc_coro_list.append(kill(process, cfg, level=level+1, graceful=graceful, notify_event=notify_event))
+        delay = 0.5
 
-        await asyncio.gather(*proc_coro_list)
-        return True
-    
+        for attempt in range(self.reconnect_attempts):
 
-    # await for process completion if pending
-    if process in kill_pending_proc:
-        
-        logging.info(f'process {process} pending; waiting for completion..')
-        
-        def is_completed():
-            return process in kill_completed_proc
-        
-        async with kill_completed_proc_cond:
-            await kill_completed_proc_cond.wait_for(is_completed)
+            pc = await self._connect()
 
-        return True
-    
-    logger.info(f'kill {process}')
+            if pc is not None:
+                return pc
 
-    # add to pending
-    kill_pending_proc.add(process)
+            if attempt + 1 < self.reconnect_attempts:
+                logger.info(f'retrying connection to {self.machine} in {delay} s')
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, 8.0)
 
-    # create marker file
-    await remote.run_cmd(e.ssh, f'touch /tmp/{process}.KILLING')
-        
-    # look up dependant processes
-    proc_coro_list = []
+        raise ConnectionError(f'failed to connect to {self.machine}')
+
+
+    async def _connect(self) -> _PooledConnection:
+
+        machine = self.machine
 
-    for pname, pfield in cfg.items():
-        
-        if pname == process or pname == 'context':
-            continue
-        
         try:
-            deps = pfield['depends']
-        except:
-            logger.info(f'{pname} has no dependencies')
-            continue
+            options = dict()
+            if self.jump is not None:
+                options['tunnel'] = await self.jump.upstream()
+                logger.info(f'waiting for ssh connection to {machine} (via {self.jump.machine})')
+            else:
+                logger.info(f'waiting for ssh connection to {machine}')
+            conn, observer = await asyncio.wait_for(
+                asyncssh.create_connection(_ConnectionObserver,
+                                           host=self.host, username=self.username,
+                                           request_pty='force',
+                                           keepalive_interval=self.keepalive_interval,
+                                           keepalive_count_max=self.keepalive_count_max,
+                                           **options),
+                timeout=self.connect_timeout)
+            logger.info(f'created ssh connection to {machine}')
+            remote.Stats.connections += 1
+            return _PooledConnection(conn, observer, self.max_channels)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logging.error(f'failed to connect to {machine} (timed out after {self.connect_timeout} s)')
+        except asyncssh.ChannelOpenError as ex:
+            logging.error(f'asyncssh.ChannelOpenError: failed to connect to {machine} ({ex.reason})')
+        except BaseException as ex:
+            logging.error(f'{ex.__class__}: failed to connect to {machine} ({ex})')
 
-        if process in deps and pfield.get('persistent', True):
-            
-            await e.print(f'found dependant process {pname}')
-            proc_coro_list.append(kill(pname, cfg, level+1, graceful=graceful, notify_event=notify_event))
+        return None
 
-    # wait until all killed
-    if len(proc_coro_list) > 0:
-        await asyncio.gather(*proc_coro_list)
-        proc_coro_list.clear()
 
-    # non-persistent are just one shot commands,
-    # we use them as process groups and kill dependencies
-    if not e.persistent:
-        
-        for dep in e.deps:
-            proc_coro_list.append(kill(dep, cfg, level+1))
-        
-        # wait until all killed
-        if len(proc_coro_list) > 0:
-            await e.print('killing dependencies')
-            await asyncio.gather(*proc_coro_list)
-            proc_coro_list.clear()
-            
-        return True
+class ConnectionPool:
 
-    # get list of running windows
-    lsdict = await remote.tmux_ls(e.ssh, e.session)
+    """
+    Holds ssh connections (to avoid repeating them), and makes sure that
+    launcher resources are uploaded once per machine. Different machines
+    are connected in parallel, concurrent requests for the same machine
+    share a single connection attempt. Every machine gets a HostConnection,
+    configured by ssh_options (the context.ssh section of the config);
+    gateways (see remote.jump_host) get one as well, shared by all the
+    machines behind them.
+    """
 
-    # check if already dead or not running
-    if process not in lsdict.keys():
-        await e.print('not running')
-        return True
+    # key used for the local machine
+    LOCAL = None
 
-    if lsdict[process]['dead']:
-        await e.print('already dead')
-        return True
-    
-    # check if we need to force sigquit
-    if e.force_sigquit:
-        graceful = False
+    # files copied to /tmp on every machine
+    resource_files = [
+        "concert_launcher_wrapper.bash",
+        "concert_launcher_print_ps_tree.py",
+        "concert_launcher_signal.py",
+        "concert_launcher_state.py",
+        "concert_launcher_agent.py",
+        "concert_launcher_profile.py",
+        "concert_launcher_files.py",
+        "concert_launcher_headless.py",
+    ]
 
-    # perform actual killing
-    signame = 'SIGINT' if graceful else 'SIGKILL'
-    sigkey = 'C-c' if graceful else 'C-\\\ '
-        
-    await e.print(f'killing with {signame}')
+    def __init__(self, connect_timeout=None, command_timeout=None, ssh_options={}):
 
-    pid = lsdict[process]['pid']
+        # seconds (none = no limit)
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
 
-    # send CTRL+C
-    await remote.run_cmd(e.ssh, f'tmux send-keys -t {e.session}:{process} {sigkey} C-m Enter',
-                   interactive=False,
-                   throw_on_failure=True) 
-    
-    attempts = 0
-
-    # wait for exit, possibly escalate to CTRL+\
-    while await remote.tmux_session_alive(e.ssh, e.session, process):
-        await e.print('waiting for exit..')
-        await asyncio.sleep(1)
-        attempts += 1
-        if attempts > 5:
-            await e.print('killing with SIGKILL')
-            await remote.run_cmd(e.ssh, f'tmux send-keys -t {e.session}:{process} C-\\\ C-m Enter',
-                                 interactive=False,
-                                 throw_on_failure=True) 
-    await e.print('killed')
-    return True
+        # HostConnection options (channel budget, keepalive, reconnection)
+        self.ssh_options = dict(ssh_options)
 
+        # run a resident agent on every remote machine
+        self.use_agent = self.ssh_options.pop('agent', False)
 
-async def status(process, cfg, print_to_stdout=True):
+        # machine (or host name) -> gateway machine
+        self.jumps = self.ssh_options.pop('jump', {})
 
-    status_dict = {}  
+        # machine -> HostConnection, for machines and gateways
+        self.hosts : Dict[str, HostConnection] = dict()
 
-    proc_cfg = {}
+        # machine -> future resolving to the ssh connection (None = local)
+        self.connection_map : Dict[str, asyncio.Future] = dict()
 
-    for process, pfield in cfg.items():
+        # machine -> agent restart in progress
+        self.agent_restarts : Dict[str, asyncio.Future] = dict()
 
-        if process == 'context':
-            continue
 
-        e = ConfigParser(process=process, cfg=cfg, level=0)
+    async def get(self, machine, print_fn=None):
 
-        proc_cfg[process] = e
-        
-        if not await e.connect():
-            continue 
-        
-        try:
-            lsdict = await remote.tmux_ls(e.ssh, e.session)
-        except asyncssh.ChannelOpenError as ex:
-            logging.error(f'ERROR {e.machine} {ex}')
-            continue
+        fut = self.connection_map.get(machine, None)
 
-        if e.session in status_dict.keys():
-            status_dict[e.session].update(**lsdict)
-        else:
-            status_dict[e.session] = lsdict
+        if fut is None:
+            fut = asyncio.ensure_future(self._open(machine, print_fn))
+            self.connection_map[machine] = fut
 
-    if print_to_stdout:
-        print()
+        ok, ssh = await asyncio.shield(fut)
 
-    for s, sdict in status_dict.items():
+        # do not cache failures, next call will retry
+        if not ok and self.connection_map.get(machine, None) is fut:
+            del self.connection_map[machine]
 
-        for p, pdict in sdict.items():
-            
-            status = 'DEAD   ' if pdict['dead'] else 'RUNNING'
-            pid = pdict['pid']
-            ret = pdict['exitstatus']
-            e = proc_cfg[p]
-            machine = 'local' if e.machine is None else e.machine
+        # the agent exits with the connection it runs on: a new one is
+        # started once the host is reconnected
+        if ok and ssh is not None and ssh.agent is not None and not ssh.agent.alive:
+            await self._restart_agent(ssh, machine)
 
-            if print_to_stdout:
-                print(f'{p :<15}\t{s}\t{machine :<20}\t{status}\t{pid}\t{ret}')
+        return ok, ssh
 
-    return status_dict
 
+    def host_connection(self, machine, path=()) -> HostConnection:
 
+        """
+        The HostConnection of a machine (created on first use, not
+        connected), tunnelled through the one of its gateway, if any
+        """
 
-            
-async def pstree(process, cfg, level=0):
-    
-    tasks = []
+        ssh = self.hosts.get(machine, None)
 
-    status_dict = {}
+        if ssh is not None:
+            return ssh
 
-    for process, pfield in cfg.items():
+        if machine in path:
+            raise ConnectionError(f'jump host cycle: {" -> ".join(path + (machine,))}')
 
-        if process == 'context':
-            continue
+        gateway = remote.jump_host(self.jumps, machine)
 
-        e = ConfigParser(process=process, cfg=cfg, level=0)
-        
-        await e.connect()
+        jump = None if gateway is None else self.host_connection(gateway, path + (machine,))
 
-        ssh = e.ssh
+        ssh = HostConnection(machine, connect_timeout=self.connect_timeout, command_timeout=self.command_timeout,
+                             jump=jump, **self.ssh_options)
+
+        self.hosts[machine] = ssh
 
-        # get list of running windows
-        lsdict = await remote.tmux_ls(ssh, e.session)
+        return ssh
 
-        status_dict[e.session] = lsdict
+
+    def close(self):
+
+        for ssh in self.hosts.values():
+            ssh.close()
+
+        self.hosts.clear()
+
+        self.connection_map.clear()
+
+
+    async def _open(self, machine, print_fn):
+
+        if machine is None:
+            await self._upload_resources(None, machine)
+            return True, None
+
+        if print_fn is not None:
+            await print_fn(f'opening ssh connection to remote {machine}')
 
         try:
-            
-            # this fails if windows does not exist
-            pinfo = lsdict[process]
+            ssh = self.host_connection(machine)
+        except ConnectionError as ex:
+            logging.error(f'failed to connect to {machine} ({ex})')
+            return False, None
 
-            if pinfo['dead']:
-                await e.print('dead')
-                continue
-            
-            logging.info(f'adding task for process {process}')
-            
-            tasks.append(_pstree(e, pinfo['pid']))
+        if not await ssh.connect():
+            return False, None
 
-        except:
-            pass
-        
-    logging.info('awaiting results')
-        
-    res = await asyncio.gather(*tasks)
-    
-    for r in res:
-        await r()
+        await self._upload_resources(ssh, machine)
 
-    return status_dict
-    
-    
-async def _pstree(e: ConfigParser, pid):
-        
-    # get process tree
-    _, stdout, _ = await remote.run_cmd(
-                    e.ssh,
-                    f'python3 /tmp/concert_launcher_print_ps_tree.py {pid}')
-    
-    async def printer():
-        await e.print('process tree: ')
-        print('  ', stdout.replace('\n', '\n  '))
-    
-    return printer
+        if self.use_agent:
+            await self._start_agent(ssh, machine)
 
+        return True, ssh
 
-# class for printing each process stdout
-# with a nice prefix
-class Printer:
-    def __init__(self, process) -> None:
-        self.process = process
-    async def print(self,l):
-        print(f'[{self.process}]', l, end='')
 
-        
-def default_get_printer(process):
-    return Printer(process).print
+    async def _start_agent(self, ssh: HostConnection, machine):
 
+        # on failure, commands keep going through their own channels (and
+        # no restart is attempted)
+        agent = RemoteAgent(ssh)
 
-# watch proc stdout
-async def watch(process: str, cfg: Dict, printer_coro_factory=default_get_printer, num_lines='+1'):
+        try:
+            await agent.start(timeout=self.connect_timeout)
+            ssh.agent = agent
+        except asyncio.CancelledError:
+            raise
+        except BaseException as ex:
+            ssh.agent = None
+            logger.warning(f'could not start the agent on {machine} ({ex.__class__.__name__}: {ex}), using plain commands')
 
-    # process is none = watch all
-    if process is None:
 
-        tasks = []
+    async def _restart_agent(self, ssh: HostConnection, machine):
 
-        for process, _ in cfg.items():
+        # concurrent callers share the restart
+        fut = self.agent_restarts.get(machine, None)
 
-            if process == 'context':
-                continue
+        if fut is None or fut.done():
+            logger.info(f'agent on {machine} exited, restarting it')
+            fut = asyncio.ensure_future(self._start_agent(ssh, machine))
+            self.agent_restarts[machine] = fut
 
-            e = ConfigParser(process=process, cfg=cfg, level=0)
-            
-            if not await e.connect():
-                continue 
+        await asyncio.shield(fut)
+
+
+    async def _upload_resources(self, ssh, machine):
 
-            watch_coro = remote.watch_process(e.ssh, 
-                                              f'touch /tmp/{process}.stdout && tail -f -n {num_lines} /tmp/{process}.stdout', 
-                                              stdout_coro=printer_coro_factory(process))
+        if machine is None:
+            user, host = 'local_user', 'local_host'
+        else:
+            user, host = machine.split('@')
 
-            tasks.append(watch_coro)
+        # compare content hashes with a single command, so that resources
+        # left by other launcher versions are replaced
+        local_dir = os.path.join(os.path.dirname(__file__), 'resources')
 
-        await asyncio.gather(*tasks)
+        local_hash = dict()
 
-        return
+        for rf in self.resource_files:
+            with open(os.path.join(local_dir, rf), 'rb') as f:
+                local_hash[rf] = hashlib.sha1(f.read()).hexdigest()
 
+        logging.info(f'looking up resources in {user}@{host}')
 
-    e = ConfigParser(process, cfg, level=0)
+        _, stdout, _ = await remote.run_cmd(ssh, 'cd /tmp && sha1sum ' + ' '.join(self.resource_files) + ' 2>/dev/null',
+                                            throw_on_failure=False)
 
-    await e.connect()
+        remote_hash = dict()
 
-    await remote.watch_process(e.ssh, 
-                        f'tail -f -n {num_lines} /tmp/{process}.stdout', 
-                        stdout_coro=printer_coro_factory(process))
-    
-    
-async def wait_process(process, cfg, timeout=0):
-    
-    # connect
-    e = ConfigParser(process=process, cfg=cfg, level=0)
-    
-    if not await e.connect():
-        raise RuntimeError(f'failed to connect to {e.machine}')
-    
-    # coroutine for printing proc output to console
-    watch_coro = watch(process, cfg, num_lines=0)
-    
-    async def poll_status():
-        while True:
-            lsdict = await remote.tmux_ls(e.ssh, e.session)
-            proc_info = lsdict[process]
-            if proc_info['dead']:
-                exit(proc_info['exitstatus'])
-            await asyncio.sleep(1)
-    
-    # run both coroutines
-    await asyncio.gather(watch_coro, poll_status())
\ No newline at end of file
+        for l in stdout.split('\n'):
+            tokens = l.split()
+            if len(tokens) == 2:
+                remote_hash[tokens[1]] = tokens[0]
+
+        outdated = [rf for rf in self.resource_files if remote_hash.get(rf, None) != local_hash[rf]]
+
+        # copy needed files to remote
+        if len(outdated) > 0:
+            logging.info(f'uploading resources {outdated}')
+            await remote.putfile(ssh, [os.path.join(local_dir, rf) for rf in outdated], '/tmp')
+            logging.info('uploading resources DONE')
+
+
+class SpawnBatcher:
+
+    """
+    Collects the windows to be spawned on a host within a short time
+    window (e.g. all processes of a dependency level that become ready to
+    start together), and creates them with a single invocation of the
+    backend (e.g. one tmux command).
+    """
+
+    def __init__(self, ssh, process_backend: backend.ProcessBackend = None, delay=0.01):
+        self.ssh = ssh
+        self.backend = process_backend if process_backend is not None else backend.get()
+        self.delay = delay
+        self.queue = []
+        self.flush_task = None
+        self.lock = asyncio.Lock()
+
+
+    async def spawn(self, session, window, cmd, config_hash=None, sched=None, limits=None, container=None):
+
+        fut = asyncio.get_event_loop().create_future()
+
+        self.queue.append((dict(session=session, window=window, cmd=cmd, config_hash=config_hash,
+                                sched=sched, limits=limits, container=container), fut))
+
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush())
+
+        return await fut
+
+
+    async def _flush(self):
+
+        await asyncio.sleep(self.delay)
+
+        # requests arriving from now on go into the next batch
+        batch, self.queue = self.queue, []
+        self.flush_task = None
+
+        async with self.lock:
+
+            logger.info(f'spawning {len(batch)} windows')
+
+            try:
+                res = await self.backend.spawn(self.ssh, [w for w, _ in batch])
+            except asyncio.CancelledError:
+                # the requests are cancelled with us
+                for _, fut in batch:
+                    fut.cancel()
+                raise
+            except BaseException as ex:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(ex)
+                return
+
+            # note: requests might have been cancelled meanwhile
+            for w, fut in batch:
+                if not fut.done():
+                    fut.set_result(res[(w['session'], w['window'])])
+
+
+class StateStore:
+
+    """
+    Launcher state records of a host (see resources/concert_launcher_state.py),
+    e.g. processes being started or killed. Updates arriving within a short
+    time window are written with a single remote call, and the leases of the
+    records held by this launcher are renewed periodically, so that records
+    left behind by a crashed launcher expire by themselves.
+    """
+
+    # lease duration (seconds)
+    lease = 30.0
+
+    def __init__(self, ssh, delay=0.01):
+        self.ssh = ssh
+        self.delay = delay
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.to_set = dict()
+        self.to_release = set()
+        self.waiters = []
+        self.flush_task = None
+        self.renew_task = None
+        self.held = set()
+        self.lock = asyncio.Lock()
+
+
+    async def acquire(self, session, window, state, config_hash=None):
+        key = remote.state_key(session, window)
+        self.to_release.discard(key)
+        self.to_set[key] = dict(state=state, config_hash=config_hash, lease=self.lease)
+        await self._update()
+
+
+    async def release(self, session, window):
+        key = remote.state_key(session, window)
+        self.to_set.pop(key, None)
+        self.to_release.add(key)
+        await self._update()
+
+
+    async def _update(self):
+
+        fut = asyncio.get_event_loop().create_future()
+
+        self.waiters.append(fut)
+
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush())
+
+        return await fut
+
+
+    async def _flush(self):
+
+        await asyncio.sleep(self.delay)
+
+        # updates arriving from now on go into the next batch
+        to_set, self.to_set = self.to_set, dict()
+        to_release, self.to_release = self.to_release, set()
+        waiters, self.waiters = self.waiters, []
+        self.flush_task = None
+
+        async with self.lock:
+
+            try:
+                await remote.state_update(self.ssh, self.owner,
+                                          records=to_set,
+                                          release=list(to_release))
+            except asyncio.CancelledError:
+                # the waiters are cancelled with us
+                for fut in waiters:
+                    fut.cancel()
+                raise
+            except BaseException as ex:
+                for fut in waiters:
+                    if not fut.done():
+                        fut.set_exception(ex)
+                return
+
+            self.held |= set(to_set.keys())
+            self.held -= to_release
+
+            if len(self.held) > 0 and self.renew_task is None:
+                self.renew_task = asyncio.ensure_future(self._renew())
+
+            # note: waiters might have been cancelled meanwhile
+            for fut in waiters:
+                if not fut.done():
+                    fut.set_result(True)
+
+
+    async def _renew(self):
+
+        try:
+
+            while len(self.held) > 0:
+
+                await asyncio.sleep(self.lease / 3)
+
+                if len(self.held) == 0:
+                    break
+
+                async with self.lock:
+                    try:
+                        await remote.state_update(self.ssh, self.owner, renew=list(self.held))
+                    except Exception as ex:
+                        logger.warning(f'failed to renew state leases ({ex})')
+
+        finally:
+            self.renew_task = None
+
+
+    def close(self):
+        if self.renew_task is not None:
+            self.renew_task.cancel()
+
+
+class ConfigParser:
+    
+    # kill escalation used when none (or a malformed one) is configured
+    default_kill = dict(signals=['SIGINT', 'SIGQUIT'], grace=5.0, final='SIGKILL')
+
+    def __init__(self, process, cfg, notify_ev_callback=None, level=0, pool: ConnectionPool = None,
+                 bus: events.EventBus = None, op_id=None) -> None:
+
+        # master cfg
+        self.cfg = cfg
+        
+        # connection pool (a private one if not provided)
+        self.pool = pool if pool is not None else ConnectionPool()
+
+        # print with intentation to reflect dependency tree
+        self.print_fn = print_utils.ProgressReporter.get_print_fn(process, level)
+        self.notify_ev_callback = notify_ev_callback
+        
+        # event bus (if given, events are published there instead of
+        # awaiting the callback) and id of the operation we belong to
+        self.bus = bus
+        self.op_id = op_id
+        self.t0 = time.time()
+
+        # not used atm
+        self.verbose = config.ConfigOptions.verbose
+        
+        # parse config
+        pfield = cfg[process]
+        self.pfield = pfield
+
+        # cmd needs calling parse_cmd()
+        self.cmd = None 
+        
+        # ssh connection needs calling connect()
+        self.ssh = None
+
+        # parse remote machine (none = local machine)
+        self.machine = pfield.get('machine', None)
+
+        if self.machine == 'local':
+            self.machine = None
+
+        # container to run in (see container.py)
+        self.docker = pfield.get('docker', None)
+        
+        # cmd that returns 0 if proc is ready
+        self.ready_check = pfield.get('ready_check', None)
+        
+        # max time to become ready (seconds, overrides the context timeout)
+        self.ready_timeout = pfield.get('ready_timeout', None)
+
+        # not persistent means one shot command (does not stay alive)
+        self.persistent = pfield.get('persistent', True)
+        
+        # cpu affinity, scheduling policy, nice and io class (see sched.py)
+        self.sched = pfield.get('sched', None)
+
+        # memory, cpu and pids limits (see limits.py)
+        self.limits = pfield.get('limits', None)
+
+        # session name for this proc (used to group procs into tmux sessions)
+        self.session = pfield.get('session', cfg['context']['session'])
+        
+        # how the process is run (see backend.py)
+        self.backend = backend.get(pfield.get('backend', cfg['context'].get('backend', None)))
+
+        # list of dependencies
+        self.deps = pfield.get('depends', [])
+
+        # parse variants
+        self.variants = []
+        
+        if 'variants' in pfield.keys():
+            for v in pfield['variants'].keys():
+                var = Variant(v, pfield['variants'])
+                self.variants.append(var)
+
+        # save name
+        self.name = process
+
+        # force sigquit
+        self.force_sigquit = pfield.get('force_sigquit', False)
+
+        # kill escalation (process settings override context ones)
+        kill_cfg = dict(cfg['context'].get('kill', {}))
+        kill_cfg.update(pfield.get('kill', {}))
+
+        # signals sent in order, each followed by a grace period (seconds)
+        self.kill_signals = kill_cfg.get('signals', self.default_kill['signals'])
+        self.kill_grace = kill_cfg.get('grace', self.default_kill['grace'])
+
+        # signal sent when the ladder is exhausted (none to disable)
+        self.kill_final = kill_cfg.get('final', self.default_kill['final'])
+
+
+    def event(self, kind, **kwargs) -> events.LauncherEvent:
+        return events.LauncherEvent(kind, self.name,
+                                    host='local' if self.machine is None else self.machine,
+                                    op=self.op_id,
+                                    **kwargs)
+
+
+    async def print(self, text, **kwargs):
+        if self.bus is not None:
+            self.bus.publish(self.event(events.LauncherEvent.MESSAGE, message=text))
+        elif self.notify_ev_callback is not None:
+            await self.notify_ev_callback(self.name, text)
+        self.print_fn(text)
+
+
+    async def notify_state(self, state, exit_code=None):
+        if self.bus is not None:
+            self.bus.publish(self.event(events.LauncherEvent.STATE, state=state,
+                                        exit_code=exit_code,
+                                        duration=time.time() - self.t0))
+        elif self.notify_ev_callback is not None:
+            await self.notify_ev_callback(self.name, f'state is {state}')
+
+
+    def parse_cmd(self, user_params, user_variants):
+
+        # start with global params + user params
+        params = self.cfg['context'].get('params', {})
+        params = dict(params)
+        params.update(**user_params)
+            
+        # parse variants to update cmd and params
+        cmd = self.pfield['cmd']
+
+        for v in self.variants:
+            v : Variant = v
+            for vuser in user_variants:
+                if vuser not in v.choices:
+                    continue
+                if v.cmd[vuser] is not None:
+                    cmd = v.cmd[vuser].replace('{cmd}', cmd)
+                params.update(**v.params[vuser])
+
+        # parse params
+        try:
+            self.cmd = cmd.format(**params)
+        except KeyError as e:
+            logger.error(f'{e}: specify missing params inside cfg.context.params or with --params key:=value')
+            raise e
+
+        # escape bash special chars
+        # note: commands in a container are escaped the same way, the
+        # docker exec is added by the launcher wrapper (ready checks run on
+        # a container shell, see container.py)
+        self.cmd = self.cmd.replace('$', '\\$')
+        self.cmd = self.cmd.replace('"', '\\"')
+
+
+    def kill_ladder(self, graceful=True):
+
+        # (raises ValueError on malformed settings, see plan.validate_kill)
+        errors = plan.validate_kill(dict(signals=self.kill_signals, grace=self.kill_grace, final=self.kill_final))
+
+        if len(errors) > 0:
+            raise ValueError('; '.join(errors))
+
+        # non graceful kill goes straight to the final signal
+        if not graceful:
+            return [], self.kill_final or 'SIGKILL'
+
+        signals = ['SIGQUIT'] if self.force_sigquit else self.kill_signals
+
+        # grace can be given per step
+        if isinstance(self.kill_grace, list):
+            grace = self.kill_grace + [self.kill_grace[-1]] * len(signals)
+        else:
+            grace = [self.kill_grace] * len(signals)
+
+        ladder = [[s, float(g)] for s, g in zip(signals, grace)]
+
+        return ladder, self.kill_final
+
+
+    def config_hash(self):
+
+        # hash of the fully resolved launch configuration (needs parse_cmd())
+        launch_cfg = {
+            'cmd': self.cmd,
+            'machine': self.machine,
+            'docker': self.docker,
+            'session': self.session,
+        }
+
+        # note: processes without sched/limits settings keep their hash
+        if self.sched is not None:
+            launch_cfg['sched'] = self.sched
+
+        if self.limits is not None:
+            launch_cfg['limits'] = self.limits
+
+        return hashlib.sha1(json.dumps(launch_cfg, sort_keys=True).encode()).hexdigest()[:16]
+
+
+    async def connect(self):
+
+        ok, self.ssh = await self.pool.get(self.machine, print_fn=self.print)
+
+        return ok
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+
+    """
+    An operation did not complete within its budget. Stragglers are the
+    processes that were still pending (and have been cancelled), completed
+    the ones that were done.
+    """
+
+    def __init__(self, what, timeout, stragglers: List[str], completed: List[str]):
+        super().__init__(f'{what} timed out after {timeout} s (pending: {", ".join(stragglers) or "none"})')
+        self.timeout = timeout
+        self.stragglers = stragglers
+        self.completed = completed
+
+
+class Operation:
+
+    """
+    State of a single top level run/kill call. Each process is handled
+    at most once per operation; the launcher-wide in-flight table makes
+    concurrent operations share the work on common processes.
+    """
+
+    # operation ids, as reported in events
+    ids = itertools.count(1)
+
+    def __init__(self, params={}, variants=[], graceful=True):
+
+        self.id = next(Operation.ids)
+
+        self.params = params
+        self.variants = variants
+        self.graceful = graceful
+
+        # process name -> future for its completion within this operation
+        self.futures : Dict[str, asyncio.Future] = dict()
+
+        # tasks started by this operation (cancelled with it)
+        self.owned : List[asyncio.Future] = []
+
+
+class Launcher:
+
+    """
+    Process launcher bound to a config. Owns the ssh connection pool and
+    the table of in-flight run/kill operations, so that many concurrent
+    calls (e.g. from a GUI) can share the same instance.
+    """
+
+    # seconds given to legacy callbacks to deliver the events of a
+    # finished operation
+    callback_drain = 1.0
+
+    def __init__(self, cfg, notify_event=None, timeouts: config.Timeouts = None, base_dir=None):
+
+        # cfg can be a path to a yaml file
+        if isinstance(cfg, str):
+            base_dir = base_dir or os.path.dirname(os.path.abspath(cfg))
+            with open(cfg, 'r') as f:
+                cfg = yaml.safe_load(f)
+
+        # relative paths in the config (e.g. files to sync) start here
+        self.base_dir = base_dir or os.getcwd()
+
+        # replica templates are expanded into their members (see plan.py)
+        self.cfg = plan.expand_replicas(cfg)
+
+        # legacy notify_event(process, text) callback, fed from the bus
+        self.notify_event = notify_event
+
+        # structured events of all operations
+        self.bus = events.EventBus()
+
+        # deadlines (context 'timeouts' field, unless given)
+        self.timeouts = timeouts if timeouts is not None else config.Timeouts.from_cfg(cfg)
+
+        self.pool = ConnectionPool(connect_timeout=self.timeouts.connect,
+                                   command_timeout=self.timeouts.command,
+                                   ssh_options=cfg['context'].get('ssh', {}))
+
+        # in-flight operations: process -> future
+        self.run_inflight : Dict[str, asyncio.Future] = dict()
+        self.kill_inflight : Dict[str, asyncio.Future] = dict()
+
+        # (machine, backend) -> batcher for window creation
+        self.spawners : Dict[tuple, SpawnBatcher] = dict()
+
+        # machine -> state records of processes being started/killed
+        self.state_stores : Dict[str, StateStore] = dict()
+
+        # (machine, container) -> shell running the ready checks
+        self.container_shells : Dict[tuple, container.ContainerShell] = dict()
+
+        # machine -> file sync (see files.py), sharing the local hash cache
+        self.file_syncs : Dict[str, files.FileSync] = dict()
+        self.hash_cache = None
+
+
+    def get_processes(self) -> List[str]:
+        return plan.get_processes(self.cfg)
+
+
+    def select(self, processes=None, sessions=None, machines=None, tags=None) -> List[str]:
+        return plan.select_processes(self.cfg, processes=processes, sessions=sessions, machines=machines, tags=tags)
+
+
+    def config_parser(self, process, level=0, op: Operation = None) -> ConfigParser:
+        return ConfigParser(process=process, cfg=self.cfg, level=level, pool=self.pool,
+                            bus=self.bus, op_id=None if op is None else op.id)
+
+
+    async def _with_callback(self, op: Operation, notify_event, coro):
+
+        # legacy callbacks get the events of this operation through a
+        # subscription, so that a slow callback never stalls the launcher
+        notify_event = notify_event if notify_event is not None else self.notify_event
+
+        if notify_event is None:
+            return await coro
+
+        # (including processes this operation waits on, which are
+        # handled by a concurrent one)
+        sub = self.bus.subscribe(filter_fn=lambda ev: ev.op == op.id or ev.process in op.futures.keys())
+
+        forward_task = asyncio.ensure_future(events.forward_to_callback(sub, notify_event))
+
+        try:
+            return await coro
+        finally:
+            # the events queued so far are delivered, unless the callback
+            # cannot keep up (it must not hold up the caller)
+            sub.close()
+            try:
+                await asyncio.wait([forward_task], timeout=self.callback_drain)
+            finally:
+                if not forward_task.done():
+                    logger.warning('event callback too slow, dropping its pending events')
+                    forward_task.cancel()
+
+
+    async def _with_deadline(self, op: Operation, coro, timeout, what, notify=True):
+
+        # the operation runs in its own task, so that it can be cancelled
+        # together with the work it started, on deadline or when we are
+        # cancelled ourselves (e.g. ctrl+c); stragglers are reported as
+        # timed out, unless notify is false (e.g. status reads)
+        task = asyncio.ensure_future(coro)
+
+        try:
+            done, _ = await asyncio.wait([task], timeout=timeout)
+        except asyncio.CancelledError:
+            await self._cancel_op(op, task)
+            raise
+
+        if task in done:
+            return task.result()
+
+        stragglers = [p for p, f in op.futures.items() if not f.done()]
+
+        completed = [p for p, f in op.futures.items()
+                     if f.done() and not f.cancelled() and f.exception() is None]
+
+        await self._cancel_op(op, task)
+
+        for p in stragglers if notify else []:
+            await self.config_parser(p, op=op).notify_state(state='TimedOut')
+
+        raise DeadlineExceeded(what, timeout, stragglers, completed)
+
+
+    async def _cancel_op(self, op: Operation, task):
+
+        to_cancel = [task] + [f for f in op.owned if not f.done()]
+
+        for f in to_cancel:
+            f.cancel()
+
+        # let cleanup (e.g. state records release) run
+        await asyncio.wait(to_cancel)
+
+
+    def close(self):
+        for store in self.state_stores.values():
+            store.close()
+        for shell in self.container_shells.values():
+            shell.close()
+        self.pool.close()
+
+
+    def spawner(self, e: ConfigParser) -> SpawnBatcher:
+        spawner = self.spawners.get((e.machine, e.backend.name), None)
+        if spawner is None or spawner.ssh is not e.ssh:
+            spawner = SpawnBatcher(e.ssh, e.backend)
+            self.spawners[(e.machine, e.backend.name)] = spawner
+        return spawner
+
+
+    def container_shell(self, e: ConfigParser) -> container.ContainerShell:
+        shell = self.container_shells.get((e.machine, e.docker), None)
+        if shell is None or shell.ssh is not e.ssh:
+            if shell is not None:
+                shell.close()
+            shell = container.ContainerShell(e.ssh, e.docker)
+            self.container_shells[(e.machine, e.docker)] = shell
+        return shell
+
+
+    def file_sync(self, e: ConfigParser) -> files.FileSync:
+        if self.hash_cache is None:
+            self.hash_cache = files.HashCache()
+        sync = self.file_syncs.get(e.machine, None)
+        if sync is None or sync.ssh is not e.ssh:
+            sync = files.FileSync(e.ssh, self.hash_cache)
+            self.file_syncs[e.machine] = sync
+        return sync
+
+
+    def state_store(self, e: ConfigParser) -> StateStore:
+        store = self.state_stores.get(e.machine, None)
+        if store is None or store.ssh is not e.ssh:
+            store = StateStore(e.ssh)
+            self.state_stores[e.machine] = store
+        return store
+
+
+    async def _dedup(self, process, op: Operation, inflight: Dict, coro_fn):
+
+        # already handled by this operation (e.g. as a dependency of another process)
+        if process in op.futures.keys():
+            logging.info(f'process {process} pending; waiting for completion..')
+            return await asyncio.shield(op.futures[process])
+
+        # being handled by a concurrent operation
+        fut = inflight.get(process, None)
+    
+        if fut is not None:
+            logging.info(f'process {process} in-flight; waiting for completion..')
+        else:
+            fut = asyncio.ensure_future(coro_fn())
+            op.owned.append(fut)
+            inflight[process] = fut
+            fut.add_done_callback(lambda f: inflight.pop(process, None) if inflight.get(process) is f else None)
+
+        op.futures[process] = fut
+
+        return await asyncio.shield(fut)
+
+
+    async def execute_process(self, process, params={}, variants=[], notify_event=None, timeout=None):
+
+        """
+        Run process and its dependencies. Timeout (seconds) overrides the
+        run budget of the launcher; when it expires, the pending processes
+        are cancelled and DeadlineExceeded is raised.
+        """
+
+        # process can be a list of targets, which are started within a
+        # single operation (shared dependencies are started once)
+        if not isinstance(process, str):
+            return await self.execute_processes(process, params=params, variants=variants,
+                                                notify_event=notify_event, timeout=timeout)
+
+        return await self.execute_processes([process], params=params, variants=variants,
+                                            notify_event=notify_event, timeout=timeout)
+
+
+    async def execute_processes(self, processes: List[str], params={}, variants=[], notify_event=None, timeout=None):
+
+        # replica groups start all their members
+        processes = plan.resolve_names(self.cfg, processes)
+
+        op = Operation(params=params, variants=variants)
+
+        timeout = timeout if timeout is not None else self.timeouts.run
+
+        async def run_all():
+            self._prewarm(processes, op)
+            try:
+                res = await asyncio.gather(*[self._execute_process_op(p, op, level=0) for p in processes])
+            finally:
+                # local file hashes computed by the syncs of this run
+                if self.hash_cache is not None:
+                    self.hash_cache.save()
+            return all(res)
+
+        return await self._with_callback(op, notify_event,
+                                         self._with_deadline(op, run_all(), timeout, 'run'))
+
+
+    def _prewarm(self, processes: List[str], op: Operation):
+
+        """
+        Start connecting to all the machines the given processes and their
+        dependencies run on (resources upload and agent included), and the
+        shells of the containers with ready checks, in the background: the
+        handshakes of machines deep in the dependency graph overlap with the
+        start of the first levels, instead of adding up along the chain
+        """
+
+        by_machine = dict()
+
+        for p in plan.get_dependency_closure(self.cfg, processes):
+            e = self.config_parser(p, op=op)
+            by_machine.setdefault(e.machine, []).append(e)
+
+        async def warm(elist: List[ConfigParser]):
+
+            # note: failures are reported by the processes themselves
+            try:
+
+                if not await elist[0].connect():
+                    return
+
+                shells = dict()
+
+                for e in elist:
+                    if e.persistent and e.docker is not None and e.ready_check is not None:
+                        if not await e.connect():
+                            return
+                        shells.setdefault(e.docker, self.container_shell(e))
+
+                await asyncio.gather(*[shell.start() for shell in shells.values()])
+
+            except asyncio.CancelledError:
+                raise
+            except BaseException as ex:
+                logger.info(f'prewarming {elist[0].machine} failed ({ex.__class__.__name__}: {ex})')
+
+        for elist in by_machine.values():
+            op.owned.append(asyncio.ensure_future(warm(elist)))
+
+
+    async def _execute_process_op(self, process, op: Operation, level):
+
+        e = self.config_parser(process, level=level, op=op)
+
+        await e.notify_state(state='WaitingDependencies')
+
+        async def coro():
+            return await self._execute_process_guarded(process, e, op, level)
+    
+        return await self._dedup(process, op, self.run_inflight, coro)
+
+
+    async def _execute_process_guarded(self, process, e: ConfigParser, op: Operation, level):
+
+        # connect ssh (on failure there is no connection to run on, the
+        # process must not end up running locally)
+        if not await e.connect():
+            await e.print(f'failed to connect to {e.machine}')
+            await e.notify_state(state='Failed')
+            raise ConnectionError(f'failed to connect to {e.machine}')
+
+        # actual execution
+        try:
+
+            # parse cmdline
+            e.parse_cmd(op.params, op.variants)
+
+            # record the process as starting until we are done with it
+            store = self.state_store(e)
+
+            await store.acquire(e.session, process, 'starting', e.config_hash())
+
+            try:
+                return await self._execute_process(process, e, op, level)
+            finally:
+                await store.release(e.session, process)
+
+        except Exception:
+
+            await e.notify_state(state='Error')
+            raise
+
+
+    async def _execute_process(self, process: str,
+                               config_parser: ConfigParser,
+                               op: Operation,
+                               level):
+
+        # shothands
+        e = config_parser
+        ssh = e.ssh
+
+        # declared files are synced while dependencies start, unless the
+        # window is running already (it is not spawned again)
+        file_entries = files.get_entries(self.cfg, process, self.base_dir)
+
+        async def sync_files():
+            if e.persistent:
+                winfo = (await e.backend.list_windows(ssh, [e.session]))[e.session].get(process, None)
+                if winfo is not None and not winfo['dead']:
+                    return None
+            return await self.file_sync(e).sync(file_entries)
+
+        sync_task = None
+
+        if len(file_entries) > 0:
+            sync_task = asyncio.ensure_future(sync_files())
+
+        # process dependencies
+        dep_coro_list = []
+
+        for dep in e.deps:
+            await e.print(f'depends on {dep}')
+            dep_coro_list.append(self._execute_process_op(dep, op, level+1))
+
+        try:
+
+            if len(dep_coro_list) > 0:
+                logger.info('waiting for dependencies..')
+                await asyncio.gather(*dep_coro_list)
+                logger.info('..ok')
+
+            stats = None if sync_task is None else await sync_task
+
+            if stats is not None:
+                if stats['uploaded'] == 0:
+                    await e.print(f'files up to date ({stats["files"]} files)')
+                else:
+                    await e.print(f'synced {stats["uploaded"]} of {stats["files"]} files ({stats["bytes"] / 1024:.1f} KiB)')
+
+        finally:
+            if sync_task is not None and not sync_task.done():
+                sync_task.cancel()
+
+        # non-persistent processes are just one shot commands
+        if not e.persistent:
+
+            await e.print(f'running command')
+            await e.notify_state(state='Running')
+
+            # run
+            # note: bounded by the run budget rather than the command timeout
+            if e.docker is not None:
+                exitcode, stdout, stderr = await remote.run_cmd(ssh, container.exec_cmd(e.docker, e.cmd),
+                                                                timeout=0,
+                                                                throw_on_failure=False)
+            else:
+                exitcode, stdout, stderr = await remote.run_cmd(ssh, e.cmd,
+                                                                timeout=0,
+                                                                interactive=True,
+                                                                throw_on_failure=False)
+            # print stdout
+            for l in stdout.split('\n'):
+                await e.print(f'[stdout] {l}')
+
+            # handle exit code
+            if exitcode != 0:
+                await e.print(f'failed (exit code {exitcode})')
+                await e.notify_state(state='Failed', exit_code=exitcode)
+            else:
+                await e.print(f'success')
+                await e.notify_state(state='Completed', exit_code=exitcode)
+        
+            return exitcode == 0
+        
+        config_hash = e.config_hash()
+
+        # run unless already running (windows of processes that are
+        # started together on this host are created in one go)
+        res = await self.spawner(e).spawn(e.session, process, e.cmd, config_hash,
+                                                  sched=e.sched, limits=e.limits, container=e.docker)
+
+        if res['status'] != 'exists':
+            await e.print(f'running process..')
+            await e.print('..done')
+        elif res['config_hash'] not in (None, config_hash):
+            await e.print(f'exists (config changed since launch, use sync to restart)')
+        else:
+            await e.print(f'exists')
+
+        await e.notify_state(state='Running')
+
+        # ready check
+        if e.ready_check is not None:
+
+            ready_timeout = e.ready_timeout if e.ready_timeout is not None else self.timeouts.ready
+
+            deadline = None if ready_timeout is None else time.time() + ready_timeout
+
+            while True:
+
+                t0 = time.time()
+
+                if deadline is not None and t0 > deadline:
+                    await e.print(f'not ready after {ready_timeout} s')
+                    raise asyncio.TimeoutError(f'process {process} not ready after {ready_timeout} s')
+
+                await e.print('checking for readiness')
+                await e.notify_state(state='WaitingReady')
+
+                retcode = await self._check_ready(e)
+
+                if not await e.backend.alive(ssh, e.session, process):
+                    await self._report_oom(e)
+                    raise RuntimeError(f'process {e.session}:{process} no longer exists')
+
+                if retcode == 0:
+                    logger.info(f'ready check for process {process} returned 0')
+                    break
+
+                to_sleep = 0.666 - (time.time() - t0)  # at least 1 sec
+
+                await asyncio.sleep(to_sleep)
+
+        # post_execute
+
+        await e.print(f'ready')
+        await e.notify_state(state='Ready')
+        return True
+
+
+    async def _check_ready(self, e: ConfigParser):
+
+        # exit code of the ready check of e, a hung check counts as not
+        # ready (note: the local machine has no connection carrying the
+        # command timeout, it is given explicitly)
+        timeout = self.timeouts.command or None
+
+        try:
+            if e.docker is not None:
+                return await self.container_shell(e).run(e.ready_check, timeout=timeout)
+            retcode, _, _ = await remote.run_cmd(e.ssh, e.ready_check, timeout=timeout,
+                                                 interactive=False, throw_on_failure=False)
+            return retcode
+        except asyncio.TimeoutError as ex:
+            logger.warning(ex)
+            return -1
+
+
+    def plan(self, processes: List[str], params={}, variants=[]) -> Dict:
+
+        """
+        Resolve the run of the given processes locally (no connection is
+        made), and return a dict with
+          - errors: list of config errors (missing dependencies, cycles,
+                    unknown variants, missing params, ...)
+          - levels: list of start levels (in order), each one a dict
+                    machine -> list of dict(name, session, persistent,
+                    cmd, ready_check, docker, backend)
+        """
+
+        processes = plan.resolve_names(self.cfg, processes)
+
+        errors = plan.validate_graph(self.cfg, processes)
+
+        graph_broken = len(errors) > 0
+
+        # params and variants are resolved for every process that can be
+        # parsed, even when the graph is broken
+        parsers = dict()
+
+        for p in plan.get_dependency_closure(self.cfg, processes):
+            try:
+                parsers[p] = self.config_parser(p)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                # malformed definition (reported by validate_graph)
+                continue
+
+        # variants must be defined by some of the processes to run
+        choices = set()
+
+        for e in parsers.values():
+            for v in e.variants:
+                choices.update(v.choices)
+
+        for v in variants:
+            if v not in choices:
+                errors.append(f'unknown variant {v}')
+
+        for p, e in parsers.items():
+            try:
+                e.parse_cmd(params, variants)
+            except KeyError as ex:
+                errors.append(f'{p}: missing param {ex.args[0]}')
+            except (IndexError, ValueError) as ex:
+                errors.append(f'{p}: malformed cmd ({ex})')
+
+        # no schedule for a broken graph
+        if graph_broken:
+            return dict(errors=errors, levels=[])
+
+        levels = plan.get_run_levels(self.cfg, processes)
+
+        schedule = []
+
+        for level_procs in levels:
+
+            hosts = dict()
+
+            for p in level_procs:
+
+                e = parsers[p]
+
+                hosts.setdefault(plan.get_machine(self.cfg, p), []).append(dict(
+                    name=p,
+                    session=e.session,
+                    persistent=e.persistent,
+                    cmd=e.cmd,
+                    ready_check=e.ready_check,
+                    docker=e.docker,
+                    backend=e.backend.name,
+                ))
+
+            schedule.append(hosts)
+
+        return dict(errors=errors, levels=schedule)
+
+
+    async def sync(self, processes: List[str] = None, params={}, variants=[], notify_event=None):
+
+        """
+        Bring the given processes (default: all) and their dependencies up
+        to date with the config: running processes whose config hash changed
+        since launch are restarted together with their dependants, anything
+        that is not running is started, everything else is left untouched.
+        """
+
+        if processes is None:
+            processes = self.get_processes()
+
+        processes = plan.resolve_names(self.cfg, processes)
+
+        pprint = print_utils.ProgressReporter.get_print_fn('sync', level=0)
+
+        # running processes before sync
+        alive = {p: pinfo for p, pinfo in (await self._ls_processes(self.get_processes())).items()
+                 if not pinfo['dead']}
+
+        # persistent processes among targets and deps
+        closure = [p for p in plan.get_dependency_closure(self.cfg, processes)
+                   if self.cfg[p].get('persistent', True)]
+
+        # running processes (among the above) whose config changed
+        changed = []
+
+        for p in closure:
+
+            if p not in alive.keys():
+                continue
+
+            e = self.config_parser(p, level=0)
+
+            e.parse_cmd(params, variants)
+
+            if alive[p]['config_hash'] != e.config_hash():
+                pprint(f'{p} config changed')
+                changed.append(p)
+
+        if len(changed) == 0:
+            pprint('no config changes')
+        else:
+            await self.kill(changed, notify_event=notify_event)
+
+        # start whatever is not running, including dependants that
+        # were stopped by the kill
+        alive_after = await self._ls_processes(list(set(closure) | set(alive.keys())))
+
+        to_run = [p for p in closure if p not in alive_after.keys() or alive_after[p]['dead']]
+
+        to_run += [p for p in alive.keys() if p not in to_run and (p not in alive_after.keys() or alive_after[p]['dead'])]
+
+        if len(to_run) == 0:
+            pprint('all processes up to date')
+            return True
+
+        return await self.execute_processes(to_run, params=params, variants=variants, notify_event=notify_event)
+
+
+    async def _ls_processes(self, processes: List[str]):
+
+        """
+        Return the window info of the given processes (missing windows are
+        omitted), with a single ls per machine, session and backend
+        """
+
+        groups = dict()
+
+        for p in processes:
+            e = self.config_parser(p, level=0)
+            groups.setdefault((e.machine, e.session, e.backend.name), []).append(e)
+
+        async def ls_group(elist: List[ConfigParser]):
+            e = elist[0]
+            if not await e.connect():
+                return {}
+            lsdict = await e.backend.ls(e.ssh, e.session)
+            return {ei.name: lsdict[ei.name] for ei in elist if ei.name in lsdict.keys()}
+
+        ret = dict()
+
+        for res in await asyncio.gather(*[ls_group(elist) for elist in groups.values()]):
+            ret.update(res)
+
+        return ret
+
+
+    async def kill(self, process=None, graceful=True, notify_event=None, timeout=None):
+        
+        op = Operation(graceful=graceful)
+
+        timeout = timeout if timeout is not None else self.timeouts.kill
+
+        return await self._with_callback(op, notify_event,
+                                         self._with_deadline(op, self._kill_op(process, op), timeout, 'kill'))
+
+
+    async def _kill_op(self, process, op: Operation):
+
+        # if process is none, kill all
+        if process is None:
+
+            pprint = print_utils.ProgressReporter.get_print_fn('all', level=0)
+
+            pprint('will kill all processes')
+
+            processes = self.get_processes()
+
+        # a list of targets is killed within a single operation
+        elif not isinstance(process, str):
+
+            processes = plan.resolve_names(self.cfg, process)
+
+        else:
+
+            processes = plan.resolve_names(self.cfg, [process])
+
+        # non-persistent are just one shot commands,
+        # we use them as process groups and kill dependencies
+        for p in processes:
+            if not plan.is_persistent(self.cfg, p) and len(self.cfg[p].get('depends', [])) > 0:
+                await self.config_parser(p, level=0, op=op).print('killing dependencies')
+
+        # kill dependants first, one level at a time; within a level,
+        # processes are killed in parallel with one command per host
+        levels = plan.get_kill_levels(self.cfg, processes)
+
+        for i, level_procs in enumerate(levels):
+            await self._kill_level(level_procs, op, level=len(levels) - 1 - i)
+
+        return True
+
+
+    async def _kill_level(self, processes: List[str], op: Operation, level):
+
+        # processes being killed by a concurrent operation are just waited for
+        inflight = []
+
+        futures = dict()
+
+        for p in processes:
+
+            if p in self.kill_inflight.keys():
+                logging.info(f'process {p} in-flight; waiting for completion..')
+                inflight.append(self.kill_inflight[p])
+                op.futures[p] = self.kill_inflight[p]
+                continue
+
+            fut = asyncio.get_event_loop().create_future()
+            futures[p] = fut
+            op.futures[p] = fut
+            self.kill_inflight[p] = fut
+
+        # group by host
+        groups = dict()
+
+        for p in futures.keys():
+            e = self.config_parser(p, level=level, op=op)
+            groups.setdefault(e.machine, []).append(e)
+
+        try:
+
+            res = await asyncio.gather(*[self._kill_host(elist, op) for elist in groups.values()],
+                                       return_exceptions=True)
+
+            for r in res:
+                if isinstance(r, BaseException):
+                    raise r
+
+        finally:
+
+            for p, fut in futures.items():
+                self.kill_inflight.pop(p, None)
+                if not fut.done():
+                    fut.set_result(True)
+
+        if len(inflight) > 0:
+            await asyncio.gather(*[asyncio.shield(f) for f in inflight])
+
+        return True
+
+
+    async def _kill_host(self, elist: List[ConfigParser], op: Operation):
+
+        # all processes run on the same machine
+        for e in elist:
+            if not await e.connect():
+                for ei in elist:
+                    await ei.print(f'failed to connect to {ei.machine}')
+                    await ei.notify_state(state='KillFailed')
+                raise ConnectionError(f'failed to connect to {e.machine}')
+
+        # record the processes as being killed until done (one
+        # state update per host)
+        store = self.state_store(elist[0])
+
+        await asyncio.gather(*[store.acquire(e.session, e.name, 'killing') for e in elist])
+
+        try:
+
+            return await self._kill(elist, op)
+
+        finally:
+
+            await asyncio.gather(*[store.release(e.session, e.name) for e in elist])
+
+
+    async def _kill(self, elist: List[ConfigParser], op: Operation):
+
+        ssh = elist[0].ssh
+
+        # get list of running windows (one call per session and backend)
+        keys = list(dict.fromkeys((e.session, e.backend.name) for e in elist))
+
+        lsdicts = await asyncio.gather(*[backend.get(b).ls(ssh, s) for s, b in keys])
+
+        lsdict = dict(zip(keys, lsdicts))
+
+        # stopped on purpose, so that a supervisor does not restart them
+        stopped = dict()
+
+        for e in elist:
+            if e.name in lsdict[(e.session, e.backend.name)].keys():
+                stopped.setdefault(e.backend.name, []).append((e.session, e.name))
+
+        await asyncio.gather(*[backend.get(b).mark_stopped(ssh, windows) for b, windows in stopped.items()])
+
+        targets = []
+
+        for e in elist:
+
+            logger.info(f'kill {e.name}')
+
+            pinfo = lsdict[(e.session, e.backend.name)].get(e.name, None)
+
+            # check if already dead or not running
+            if pinfo is None:
+                await e.print('not running')
+                await e.notify_state(state='NotRunning')
+                continue
+
+            if pinfo['dead']:
+                await e.print('already dead')
+                await e.notify_state(state='Dead', exit_code=pinfo['exitstatus'])
+                continue
+
+            try:
+                ladder, final = e.kill_ladder(graceful=op.graceful)
+            except ValueError as ex:
+                # the process must go anyway
+                await e.print(f'malformed kill settings ({ex}), using the default ones')
+                e.kill_signals, e.kill_grace, e.kill_final = (e.default_kill[k] for k in ('signals', 'grace', 'final'))
+                ladder, final = e.kill_ladder(graceful=op.graceful)
+
+            signame = ladder[0][0] if len(ladder) > 0 else final
+
+            await e.print(f'killing with {signame}')
+            await e.notify_state(state='Killing')
+
+            target = {
+                'name': e.name,
+                'pid': pinfo['pid'],
+                'ladder': ladder,
+                'final': final,
+            }
+
+            # the exec in the container is signalled, rather than the
+            # docker client (see container.py)
+            if e.docker is not None:
+                target['container'] = e.docker
+                target['marker'] = container.marker_value(e.session, e.name)
+
+            targets.append(target)
+
+        # signal all process groups, escalate, and wait for exit
+        res = await remote.signal_process_groups(ssh, targets)
+
+        for e in elist:
+
+            if e.name not in res.keys():
+                continue
+
+            r = res[e.name]
+
+            if len(r['signals']) > 1:
+                await e.print(f'escalated to {r["signals"][-1]}')
+
+            if r['exited']:
+                await e.print(f'killed ({r["elapsed"]:.2f} s)')
+                await e.notify_state(state='Killed')
+            else:
+                await e.print(f'failed to kill (sent {", ".join(r["signals"])})')
+                await e.notify_state(state='KillFailed')
+
+        return True
+    
+
+    async def _ls_sessions(self, elist: List[ConfigParser], op: Operation = None) -> Dict:
+
+        """
+        Dict session -> window -> info of the sessions of the given
+        processes, with one ls per machine, session and backend (e.g. one
+        tmux call for all the replicas of a group), machines in parallel;
+        unreachable machines are left out. The processes are pending in op
+        until their ls is done.
+        """
+
+        groups = dict()
+
+        for e in elist:
+            groups.setdefault((e.machine, e.session, e.backend.name), []).append(e)
+
+        async def ls_group(elist: List[ConfigParser]):
+
+            e = elist[0]
+
+            if not await e.connect():
+                return None
+
+            # (the host connection is shared)
+            for ei in elist[1:]:
+                if not await ei.connect():
+                    return None
+
+            try:
+                return await e.backend.ls(e.ssh, e.session)
+            except asyncssh.ChannelOpenError as ex:
+                logging.error(f'ERROR {e.machine} {ex}')
+                return None
+
+        tasks = [asyncio.ensure_future(ls_group(elist)) for elist in groups.values()]
+
+        if op is not None:
+            for task, elist in zip(tasks, groups.values()):
+                op.futures.update((e.name, task) for e in elist)
+
+        lsdicts = await asyncio.gather(*tasks)
+
+        status_dict = {}
+
+        for elist, lsdict in zip(groups.values(), lsdicts):
+
+            e = elist[0]
+
+            if lsdict is None:
+                continue
+
+            if e.session in status_dict.keys():
+                status_dict[e.session].update(**lsdict)
+            else:
+                status_dict[e.session] = lsdict
+
+        return status_dict
+
+
+    async def status(self, process=None, print_to_stdout=True, timeout=None):
+
+        """
+        Read (and print) the state of all processes. Timeout (seconds)
+        overrides the status budget of the launcher; when it expires,
+        DeadlineExceeded is raised, with the processes whose host did not
+        answer as stragglers.
+        """
+
+        op = Operation()
+
+        timeout = timeout if timeout is not None else self.timeouts.status
+
+        return await self._with_deadline(op, self._status_op(print_to_stdout, op), timeout, 'status', notify=False)
+
+
+    async def _status_op(self, print_to_stdout, op: Operation):
+
+        proc_cfg = {}
+
+        for process in self.get_processes():
+            proc_cfg[process] = self.config_parser(process, level=0, op=op)
+
+        status_dict = await self._ls_sessions(proc_cfg.values(), op)
+
+        await asyncio.gather(self._check_sched(status_dict, proc_cfg),
+                             self._check_limits(status_dict, proc_cfg),
+                             self._check_containers(status_dict, proc_cfg))
+
+        if print_to_stdout:
+            print()
+
+        for s, sdict in status_dict.items():
+
+            for p, pdict in sdict.items():
+
+                status = 'DEAD   ' if pdict['dead'] else 'RUNNING'
+                pid = pdict['pid']
+                ret = pdict['exitstatus']
+                e = proc_cfg[p]
+                machine = 'local' if e.machine is None else e.machine
+
+                if print_to_stdout:
+                    print(f'{p :<15}\t{s}\t{machine :<20}\t{status}\t{pid}\t{ret}')
+                    for d in pdict.get('sched_drift', []):
+                        print(f'{"":<15}\tsched drift: {d}')
+                    if 'usage' in pdict.keys():
+                        print(f'{"":<15}\tlimits: {limits.format_usage(e.limits, pdict["usage"])}')
+                    if pdict.get('container', None) is not None:
+                        print(f'{"":<15}\t{e.docker}: {container.format_stats(pdict["container"])}')
+                    if pdict['dead'] and pdict['oom_kills'] > 0:
+                        print(f'{"":<15}\tkilled by the oom killer')
+
+                if pdict['dead'] and pdict['oom_kills'] > 0:
+                    await e.notify_state(state='OOMKilled', exit_code=ret)
+
+        return status_dict
+
+
+    async def _check_limits(self, status_dict, proc_cfg):
+
+        """
+        Read the cgroup usage of running processes with limits, with one
+        request per host; it is added to the status entries as 'usage'
+        """
+
+        by_host = dict()
+
+        for sdict in status_dict.values():
+            for p, pdict in sdict.items():
+                e = proc_cfg.get(p, None)
+                if e is None or e.limits is None or pdict['dead']:
+                    continue
+                by_host.setdefault(e.machine, []).append((e, pdict))
+
+        async def check_host(entries):
+
+            ssh = entries[0][0].ssh
+
+            try:
+                usage = await remote.cgroup_usage(ssh, [pdict['pid'] for _, pdict in entries])
+            except (RuntimeError, ValueError) as ex:
+                logger.warning(f'could not read cgroup usage ({ex})')
+                return
+
+            for e, pdict in entries:
+                pdict['usage'] = usage.get(pdict['pid'], None)
+
+        await asyncio.gather(*[check_host(entries) for entries in by_host.values()])
+
+
+    async def _check_containers(self, status_dict, proc_cfg):
+
+        """
+        Read the state and usage of the containers of running processes,
+        with one request per host; they are added to the status entries as
+        'container'
+        """
+
+        by_host = dict()
+
+        for sdict in status_dict.values():
+            for p, pdict in sdict.items():
+                e = proc_cfg.get(p, None)
+                if e is None or e.docker is None or pdict['dead']:
+                    continue
+                by_host.setdefault(e.machine, []).append((e, pdict))
+
+        async def check_host(entries):
+
+            ssh = entries[0][0].ssh
+
+            try:
+                stats = await remote.container_stats(ssh, [e.docker for e, _ in entries])
+            except (RuntimeError, asyncio.TimeoutError) as ex:
+                logger.warning(f'could not read container stats ({ex})')
+                return
+
+            for e, pdict in entries:
+                pdict['container'] = stats.get(e.docker, None)
+
+        await asyncio.gather(*[check_host(entries) for entries in by_host.values()])
+
+
+    async def _report_oom(self, e: ConfigParser):
+
+        # tell whether a process that exited was killed by the oom killer
+        try:
+            winfo = (await e.backend.ls(e.ssh, e.session)).get(e.name, None)
+        except RuntimeError:
+            return
+
+        if winfo is not None and winfo['oom_kills'] > 0:
+            await e.print('killed by the oom killer')
+            await e.notify_state(state='OOMKilled', exit_code=winfo['exitstatus'])
+
+
+    async def _check_sched(self, status_dict, proc_cfg):
+
+        """
+        Compare the scheduling settings of running processes with their
+        config, with one request per host; differences are added to the
+        status entries as 'sched_drift'
+        """
+
+        by_host = dict()
+
+        for sdict in status_dict.values():
+            for p, pdict in sdict.items():
+                e = proc_cfg.get(p, None)
+                if e is None or e.sched is None or pdict['dead']:
+                    continue
+                by_host.setdefault(e.machine, []).append((e, pdict))
+
+        async def check_host(entries):
+
+            ssh = entries[0][0].ssh
+
+            try:
+                info = await remote.sched_info(ssh, [pdict['pid'] for _, pdict in entries])
+            except (RuntimeError, ValueError) as ex:
+                logger.warning(f'could not read scheduling settings ({ex})')
+                return
+
+            for e, pdict in entries:
+                pdict['sched_drift'] = sched.drift(e.sched, info.get(pdict['pid'], []))
+
+        await asyncio.gather(*[check_host(entries) for entries in by_host.values()])
+
+
+    async def pstree(self, process=None, timeout=None):
+
+        # bounded by the status budget, like status()
+        op = Operation()
+
+        timeout = timeout if timeout is not None else self.timeouts.status
+
+        return await self._with_deadline(op, self._pstree_op(op), timeout, 'pstree', notify=False)
+
+
+    async def _pstree_op(self, op: Operation):
+
+        tasks = []
+
+        elist = [self.config_parser(p, level=0, op=op) for p in self.get_processes()]
+
+        status_dict = await self._ls_sessions(elist, op)
+
+        for e in elist:
+
+            pinfo = status_dict.get(e.session, {}).get(e.name, None)
+
+            # window does not exist
+            if pinfo is None:
+                continue
+
+            if pinfo['dead']:
+                await e.print('dead')
+                continue
+            
+            logging.info(f'adding task for process {e.name}')
+            
+            tasks.append(_pstree(e, pinfo['pid']))
+
+        logging.info('awaiting results')
+        
+        res = await asyncio.gather(*tasks)
+        
+        for r in res:
+            await r()
+    
+        return status_dict
+
+
+    async def profile(self, processes: List[str], duration=10, rate=100, profiler='auto',
+                      fmt='collapsed', output_dir='.'):
+
+        """
+        Profile the process trees of the given (running) processes at the
+        same time, on their hosts, for duration seconds; profiles are saved
+        to output_dir (see profiling.py). Return a dict process -> file path
+        (None if nothing was sampled).
+        """
+
+        entries = [self.config_parser(p) for p in processes]
+
+        # pane pids (one ls per host, session and backend)
+        panes = dict()
+
+        for e in entries:
+
+            if not await e.connect():
+                await e.print(f'failed to connect to {e.machine}')
+                continue
+
+            panes.setdefault((e.machine, e.session, e.backend.name), []).append(e)
+
+        lsdicts = await asyncio.gather(*[elist[0].backend.ls(elist[0].ssh, session)
+                                         for (_, session, _), elist in panes.items()])
+
+        async def profile_one(e: ConfigParser, pinfo):
+
+            if pinfo is None or pinfo['dead']:
+                await e.print('not running')
+                return None
+
+            await e.print(f'profiling for {duration} s')
+
+            res = await remote.profile(e.ssh, pinfo['pid'], duration=duration, rate=rate, profiler=profiler)
+
+            for err in res['errors']:
+                await e.print(f'profiler error: {err}')
+
+            targets = ', '.join(f'{t["name"]} ({t["profiler"]})' for t in res['targets'])
+
+            if res['samples'] == 0:
+                await e.print(f'no samples ({targets or "no target"})')
+                return None
+
+            path = profiling.save(res['collapsed'], output_dir, e.name, fmt=fmt, rate=rate)
+
+            await e.print(f'{res["samples"]} samples of {targets} -> {path}')
+
+            return path
+
+        tasks = []
+
+        for elist, lsdict in zip(panes.values(), lsdicts):
+            for e in elist:
+                tasks.append(profile_one(e, lsdict.get(e.name, None)))
+
+        paths = await asyncio.gather(*tasks)
+
+        return dict(zip([e.name for elist in panes.values() for e in elist], paths))
+
+
+    # watch proc stdout
+    async def watch(self, process: str = None, printer_coro_factory=None, num_lines='+1', timeout=None):
+
+        """
+        Print the output of process (None = all processes) as it comes.
+        Timeout (seconds) overrides the watch budget of the launcher; when
+        it expires, the watch is stopped and DeadlineExceeded is raised.
+        """
+
+        op = Operation()
+
+        timeout = timeout if timeout is not None else self.timeouts.watch
+
+        return await self._with_deadline(op, self._watch_op(process, printer_coro_factory, num_lines, op),
+                                         timeout, 'watch', notify=False)
+
+
+    async def _watch_op(self, process, printer_coro_factory, num_lines, op: Operation):
+
+        if printer_coro_factory is None:
+            printer_coro_factory = default_get_printer
+
+        # process is none = watch all
+        if process is None:
+
+            tasks = []
+
+            for process in self.get_processes():
+
+                e = self.config_parser(process, level=0, op=op)
+
+                if not await e.connect():
+                    continue
+
+                watch_coro = remote.watch_process(e.ssh,
+                                                  f'touch /tmp/{process}.stdout && tail -f -n {num_lines} /tmp/{process}.stdout',
+                                                  stdout_coro=printer_coro_factory(process))
+
+                tasks.append(asyncio.ensure_future(watch_coro))
+
+                op.owned.append(tasks[-1])
+                op.futures[process] = tasks[-1]
+
+            await asyncio.gather(*tasks)
+
+            return
+
+        e = self.config_parser(process, level=0, op=op)
+
+        if not await e.connect():
+            raise ConnectionError(f'failed to connect to {e.machine}')
+
+        task = asyncio.ensure_future(remote.watch_process(e.ssh,
+                                                          f'tail -f -n {num_lines} /tmp/{process}.stdout',
+                                                          stdout_coro=printer_coro_factory(process)))
+
+        op.owned.append(task)
+        op.futures[process] = task
+
+        await task
+
+
+    async def wait_process(self, process, timeout=0):
+
+        # connect
+        e = self.config_parser(process, level=0)
+
+        if not await e.connect():
+            raise RuntimeError(f'failed to connect to {e.machine}')
+
+        # coroutine for printing proc output to console
+        watch_coro = self.watch(process, num_lines=0)
+
+        async def poll_status():
+            while True:
+                lsdict = await e.backend.ls(e.ssh, e.session)
+                proc_info = lsdict[process]
+                if proc_info['dead']:
+                    exit(proc_info['exitstatus'])
+                await asyncio.sleep(1)
+
+        # run both coroutines
+        await asyncio.gather(watch_coro, poll_status())
+
+
+# the README documents the launcher as Executor
+Executor = Launcher
+
+
+async def _pstree(e: ConfigParser, pid):
+        
+    # get process tree
+    stdout = await remote.ps_tree(e.ssh, pid)
+    
+    async def printer():
+        await e.print('process tree: ')
+        print('  ', stdout.replace('\n', '\n  '))
+    
+    return printer
+
+
+# class for printing each process stdout
+# with a nice prefix
+class Printer:
+    def __init__(self, process) -> None:
+        self.process = process
+    async def print(self,l):
+        print(f'[{self.process}]', l, end='')
+
+        
+def default_get_printer(process):
+    return Printer(process).print
+
+
+# module level api: each call uses a fresh launcher, so that calls
+# do not share state; use a Launcher to share connections between calls
+
+async def execute_process(process, cfg, params={}, variants=[], notify_event=None, level=0):
+    launcher = Launcher(cfg, notify_event=notify_event)
+    try:
+        return await launcher.execute_process(process, params=params, variants=variants)
+    finally:
+        launcher.close()
+
+
+async def kill(process, cfg, level=0, graceful=True, notify_event=None):
+    launcher = Launcher(cfg, notify_event=notify_event)
+    try:
+        return await launcher.kill(process, graceful=graceful)
+    finally:
+        launcher.close()
+
+
+async def status(process, cfg, print_to_stdout=True):
+    launcher = Launcher(cfg)
+    try:
+        return await launcher.status(process, print_to_stdout=print_to_stdout)
+    finally:
+        launcher.close()
+
+
+async def pstree(process, cfg, level=0):
+    launcher = Launcher(cfg)
+    try:
+        return await launcher.pstree(process)
+    finally:
+        launcher.close()
+
+
+async def watch(process: str, cfg: Dict, printer_coro_factory=default_get_printer, num_lines='+1'):
+    launcher = Launcher(cfg)
+    try:
+        return await launcher.watch(process, printer_coro_factory=printer_coro_factory, num_lines=num_lines)
+    finally:
+        launcher.close()
+
+    
+async def wait_process(process, cfg, timeout=0):
+    launcher = Launcher(cfg)
+    try:
+        return await launcher.wait_process(process, timeout=timeout)
+    finally:
+        launcher.close()
@@ -0,0 +1,360 @@
+from typing import List, Dict
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import shlex
+import threading
+import zlib
+
+from concert_launcher import remote
+
+logger = logging.getLogger(__name__)
+
+# files synced to the machines before processes start: the 'files' field of
+# a process, and context.files for all the processes of a machine, e.g.
+#
+#   context:
+#     files:
+#       user@robot-pc1:              # machine ('local' for this machine)
+#         - src: calib/robot1        # local file or directory (relative to the config file)
+#           dst: ~/calib             # destination (the directory contents go there)
+#
+#   arm_control:
+#     files:
+#       - src: config/arm.yaml
+#         dst: /tmp/arm.yaml
+#
+# files are compared by content (sha1): unchanged entries cost a single
+# remote command (one for all the entries of a process), changed files are
+# uploaded in parallel over the host connection; extra files at the
+# destination are left alone (and not even read). Local hashes are cached by
+# size and mtime. Entries going to the same destination on a machine must
+# have the same source.
+
+cache_path = os.path.expanduser('~/.cache/concert_launcher/file_hashes.json')
+
+
+def validate(entries) -> List[str]:
+
+    if not isinstance(entries, list):
+        return ['files must be a list of {src, dst} mappings']
+
+    errors = []
+
+    for entry in entries:
+        if not isinstance(entry, dict) or set(entry.keys()) != {'src', 'dst'}:
+            errors.append(f'files: invalid entry {entry} (expected src and dst)')
+
+    return errors
+
+
+def check_destinations(cfg: Dict, processes: List[str]) -> List[str]:
+
+    """
+    Entries of the given processes (context ones included) that go to the
+    same destination of a machine from different sources (they would
+    overwrite each other); malformed entries are skipped (see validate)
+    """
+
+    errors = []
+
+    context_files = cfg.get('context', {}).get('files', {})
+
+    # (machine, dst) -> (src, where it comes from)
+    sources = dict()
+
+    for p in processes:
+
+        pfield = cfg[p] if isinstance(cfg[p], dict) else {}
+
+        machine = pfield.get('machine', None) or 'local'
+
+        entries = []
+
+        if isinstance(context_files, dict) and isinstance(context_files.get(machine, []), list):
+            entries += [(f'context.files.{machine}', e) for e in context_files.get(machine, [])]
+
+        if isinstance(pfield.get('files', []), list):
+            entries += [(p, e) for e in pfield.get('files', [])]
+
+        for owner, e in entries:
+
+            if not isinstance(e, dict) or set(e.keys()) != {'src', 'dst'}:
+                continue
+
+            key = (machine, posixpath.normpath(str(e['dst'])))
+            src = os.path.normpath(str(e['src']))
+
+            other, other_owner = sources.setdefault(key, (src, owner))
+
+            if other != src:
+                err = f'{owner}: files.dst {e["dst"]} is also the destination of {other} ({other_owner})'
+                if err not in errors:
+                    errors.append(err)
+
+    return errors
+
+
+def get_entries(cfg: Dict, process: str, base_dir: str) -> List[Dict]:
+
+    """
+    Entries to sync before process starts (machine ones first), with
+    absolute src paths
+    """
+
+    machine = cfg[process].get('machine', None) or 'local'
+
+    entries = cfg['context'].get('files', {}).get(machine, []) + cfg[process].get('files', [])
+
+    return [dict(src=os.path.join(base_dir, os.path.expanduser(e['src'])), dst=e['dst']) for e in entries]
+
+
+def tree_hash(files: Dict[str, str]) -> str:
+    # note: must match resources/concert_launcher_files.py
+    h = hashlib.sha1()
+    for rel in sorted(files.keys()):
+        h.update(f'{rel}\0{files[rel]}\n'.encode())
+    return h.hexdigest()
+
+
+def encode_paths(paths: List[str]) -> str:
+    # note: must match resources/concert_launcher_files.py (paths are sent
+    # compressed, so that large trees fit in the command line)
+    return base64.b64encode(zlib.compress(json.dumps(sorted(paths)).encode())).decode()
+
+
+class HashCache:
+
+    """
+    Content hashes of local files, keyed by path and valid as long as size
+    and mtime do not change, persisted in cache_path. Hashes are computed
+    in worker threads (see get_manifest), save() can run meanwhile.
+    """
+
+    def __init__(self, path=cache_path):
+
+        self.path = path
+        self.dirty = False
+        self.lock = threading.Lock()
+
+        # src -> future resolving to its manifest, while being computed
+        self.inflight : Dict[str, asyncio.Future] = dict()
+
+        try:
+            with open(path, 'r') as f:
+                self.hashes = json.load(f)
+        except (OSError, ValueError):
+            self.hashes = dict()
+
+
+    def hash(self, path) -> str:
+
+        st = os.stat(path)
+
+        with self.lock:
+            cached = self.hashes.get(path, None)
+
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+
+        h = hashlib.sha1()
+
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+
+        with self.lock:
+            self.hashes[path] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+            self.dirty = True
+
+        return h.hexdigest()
+
+
+    def manifest(self, src) -> Dict[str, str]:
+
+        """
+        Dict relative path -> sha1 of the files below src ('' if src is a
+        file)
+        """
+
+        if os.path.isfile(src):
+            return {'': self.hash(src)}
+
+        if not os.path.isdir(src):
+            raise FileNotFoundError(f'{src} does not exist')
+
+        ret = dict()
+
+        for root, _, names in os.walk(src):
+            for name in names:
+                full = os.path.join(root, name)
+                if os.path.isfile(full):
+                    ret[os.path.relpath(full, src)] = self.hash(full)
+
+        return ret
+
+
+    async def get_manifest(self, src) -> Dict[str, str]:
+
+        """
+        manifest(src) off the event loop; concurrent requests for the same
+        src share the computation
+        """
+
+        fut = self.inflight.get(src, None)
+
+        if fut is None:
+
+            fut = asyncio.get_event_loop().run_in_executor(None, self.manifest, src)
+
+            self.inflight[src] = fut
+
+            def done(_):
+                if self.inflight.get(src, None) is fut:
+                    del self.inflight[src]
+
+            fut.add_done_callback(done)
+
+        return await asyncio.shield(fut)
+
+
+    def save(self):
+
+        with self.lock:
+            if not self.dirty:
+                return
+            hashes = dict(self.hashes)
+            self.dirty = False
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        tmp = f'{self.path}.{os.getpid()}'
+
+        with open(tmp, 'w') as f:
+            json.dump(hashes, f)
+
+        os.replace(tmp, self.path)
+
+
+class FileSync:
+
+    """
+    Syncs file entries to a machine (ssh None = local machine); concurrent
+    requests for the same destination share the same transfer, requests for
+    the same destination from another source are refused (ValueError)
+    """
+
+    def __init__(self, ssh, cache: HashCache):
+        self.ssh = ssh
+        self.cache = cache
+        self.inflight : Dict[str, asyncio.Future] = dict()
+        # dst -> src, of the destinations in flight
+        self.sources : Dict[str, str] = dict()
+
+
+    async def sync(self, entries: List[Dict]) -> Dict:
+
+        """
+        Make sure the destinations match the sources; returns a dict with
+        the number of files checked and uploaded, and the bytes uploaded
+        """
+
+        sources = dict(self.sources)
+
+        for e in entries:
+            src = sources.setdefault(e['dst'], e['src'])
+            if src != e['src']:
+                raise ValueError(f'files: {e["src"]} and {src} have the same destination {e["dst"]}')
+
+        todo = list({e['dst']: e for e in entries if e['dst'] not in self.inflight.keys()}.values())
+
+        if len(todo) > 0:
+
+            fut = asyncio.ensure_future(self._sync(todo))
+
+            for e in todo:
+                self.inflight[e['dst']] = fut
+                self.sources[e['dst']] = e['src']
+
+            def done(_):
+                for e in todo:
+                    if self.inflight.get(e['dst'], None) is fut:
+                        del self.inflight[e['dst']]
+                        del self.sources[e['dst']]
+
+            fut.add_done_callback(done)
+
+        futs = list(dict.fromkeys(self.inflight[e['dst']] for e in entries))
+
+        stats = dict(files=0, uploaded=0, bytes=0)
+
+        for res in await asyncio.shield(asyncio.gather(*futs)):
+            for k in stats.keys():
+                stats[k] += res[k]
+
+        return stats
+
+
+    async def _sync(self, entries: List[Dict]) -> Dict:
+
+        # local hashes (cached, off the event loop; the cache is saved by
+        # the owner once all syncs are done)
+        manifests = await asyncio.gather(*[self.cache.get_manifest(e['src']) for e in entries])
+
+        # one remote command compares all the trees (the files of the
+        # source only)
+        req = [dict(dst=e['dst'], hash=tree_hash(m), paths=encode_paths(m.keys())) for e, m in zip(entries, manifests)]
+
+        _, stdout, _ = await remote.run_cmd(self.ssh, f'python3 /tmp/concert_launcher_files.py {shlex.quote(json.dumps(req))}')
+
+        results = json.loads(stdout)
+
+        # (local path, remote path) of the files that differ
+        uploads = []
+
+        for e, local, res in zip(entries, manifests, results):
+
+            if res['match']:
+                continue
+
+            for rel, h in local.items():
+
+                if res['files'].get(rel, None) == h:
+                    continue
+
+                if rel == '':
+                    uploads.append((e['src'], res['dst']))
+                else:
+                    uploads.append((os.path.join(e['src'], rel), posixpath.join(res['dst'], *rel.split(os.sep))))
+
+        stats = dict(files=sum(len(m) for m in manifests), uploaded=len(uploads),
+                     bytes=sum(os.path.getsize(l) for l, _ in uploads))
+
+        if len(uploads) == 0:
+            return stats
+
+        dirs = sorted(set(posixpath.dirname(r) for _, r in uploads))
+
+        await remote.run_cmd(self.ssh, 'mkdir -p ' + ' '.join(shlex.quote(d) for d in dirs))
+
+        # files going to the same directory under the same name share an
+        # sftp session, directories are uploaded in parallel
+        batches = dict()
+        single = []
+
+        for l, r in uploads:
+            if os.path.basename(l) == posixpath.basename(r):
+                batches.setdefault(posixpath.dirname(r), []).append(l)
+            else:
+                single.append((l, r))
+
+        await asyncio.gather(*[remote.putfile(self.ssh, paths, d, preserve=True) for d, paths in batches.items()],
+                             *[remote.putfile(self.ssh, l, r, preserve=True) for l, r in single])
+
+        logger.info(f'uploaded {len(uploads)} files ({stats["bytes"]} bytes)')
+
+        return stats
@@ -0,0 +1,179 @@
+from typing import List, Dict
+import re
+import time
+
+# resource limits of a process (the 'limits' field), e.g.
+#
+#   limits:
+#     memory_max: 2G       # hard limit, the oom killer runs above it
+#     memory_high: 1.5G    # throttling (reclaim) above it
+#     cpu_quota: 200%      # cpu time, 100% = one cpu
+#     cpu_weight: 100      # share under contention (1-10000, default 100)
+#     pids_max: 200        # max number of tasks
+#
+# they are applied by running the tmux pane (i.e. the launcher wrapper) in
+# its own transient systemd scope (systemd-run --user --scope), i.e. its own
+# cgroup, which the whole pane process tree belongs to
+
+fields = ['memory_max', 'memory_high', 'cpu_quota', 'cpu_weight', 'pids_max']
+
+# systemd properties
+properties = {
+    'memory_max': 'MemoryMax',
+    'memory_high': 'MemoryHigh',
+    'cpu_quota': 'CPUQuota',
+    'cpu_weight': 'CPUWeight',
+    'pids_max': 'TasksMax',
+}
+
+# scope names start with this (the wrapper looks for it)
+scope_prefix = 'concert_launcher-'
+
+size_units = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(size) -> int:
+
+    """
+    Bytes from an int or a systemd style size ('512M', '1.5G'); None
+    for 'infinity'
+    """
+
+    if isinstance(size, int):
+        return size
+
+    if str(size) == 'infinity':
+        return None
+
+    m = re.fullmatch(r'(\d+(?:\.\d+)?)([KMGT]?)', str(size).strip())
+
+    if m is None:
+        raise ValueError(f'invalid size {size}')
+
+    return int(float(m.group(1)) * size_units[m.group(2)])
+
+
+def format_size(size) -> str:
+
+    if size is None:
+        return 'max'
+
+    for unit in ['T', 'G', 'M', 'K']:
+        if size >= size_units[unit]:
+            return f'{size / size_units[unit]:.1f}{unit}'
+
+    return f'{size}'
+
+
+def parse_percent(quota) -> float:
+    return float(str(quota).strip().rstrip('%'))
+
+
+def validate(limits: Dict) -> List[str]:
+
+    """
+    Return the list of errors in a limits field
+    """
+
+    if not isinstance(limits, dict):
+        return ['limits must be a mapping']
+
+    errors = []
+
+    for k in limits.keys():
+        if k not in fields:
+            errors.append(f'unknown limits field {k}')
+
+    for k in ('memory_max', 'memory_high'):
+        if k in limits.keys():
+            try:
+                parse_size(limits[k])
+            except ValueError:
+                errors.append(f'invalid limits.{k} {limits[k]} (bytes, or a number with K, M, G or T suffix)')
+
+    if 'cpu_quota' in limits.keys():
+        try:
+            if parse_percent(limits['cpu_quota']) <= 0:
+                raise ValueError()
+        except ValueError:
+            errors.append(f'invalid limits.cpu_quota {limits["cpu_quota"]} (percentage, 100% = one cpu)')
+
+    if 'cpu_weight' in limits.keys() and limits['cpu_weight'] not in range(1, 10001):
+        errors.append('limits.cpu_weight must be an integer in [1, 10000]')
+
+    if 'pids_max' in limits.keys() and limits['pids_max'] != 'infinity' and \
+            (not isinstance(limits['pids_max'], int) or limits['pids_max'] < 1):
+        errors.append('limits.pids_max must be a positive integer')
+
+    return errors
+
+
+def scope_name(session: str, window: str) -> str:
+
+    # unique per spawn, as the scope of a previous run might still be
+    # around for a moment
+    name = re.sub(r'[^A-Za-z0-9_.\-]', '_', f'{session}-{window}')
+
+    return f'{scope_prefix}{name}-{int(time.time() * 1000) % 1000000000}'
+
+
+def prefix(limits: Dict, session: str, window: str) -> str:
+
+    """
+    Command prefix running the command in its own scope with the given
+    limits (empty if none)
+    """
+
+    if limits is None:
+        return ''
+
+    tokens = ['systemd-run --user --scope --quiet --collect', f'--unit={scope_name(session, window)}']
+
+    for k in fields:
+
+        if k not in limits.keys():
+            continue
+
+        v = limits[k]
+
+        if k == 'cpu_quota':
+            v = f'{parse_percent(v):g}%'
+
+        tokens.append(f'-p {properties[k]}={v}')
+
+    return ' '.join(tokens) + ' '
+
+
+def format_usage(limits: Dict, usage: Dict) -> str:
+
+    """
+    One line summary of the usage of a scope (as returned by the agent
+    'cgroup' request) against its limits
+    """
+
+    if usage is None:
+        return 'no cgroup information'
+
+    ret = []
+
+    # note: controllers might not be available (values are None then)
+    if usage['memory_current'] is not None:
+        mem = f'mem {format_size(usage["memory_current"])}/{format_size(usage["memory_max"])}'
+        if usage['memory_high'] is not None:
+            mem += f' (high {format_size(usage["memory_high"])})'
+        ret.append(mem)
+
+    if usage['cpu'] is not None:
+        cpu_max = usage['cpu_max']
+        ret.append(f'cpu {usage["cpu"]:.0f}%/{"max" if cpu_max is None else f"{cpu_max:.0f}%"}')
+
+    if usage['pids_current'] is not None:
+        ret.append(f'pids {usage["pids_current"]}/{"max" if usage["pids_max"] is None else usage["pids_max"]}')
+
+    if usage.get('oom_kills', 0) > 0:
+        ret.append(f'oom kills {usage["oom_kills"]}')
+
+    if not usage['scope'].startswith(scope_prefix):
+        ret.append(f'not in its own scope ({usage["scope"]})')
+
+    return '  '.join(ret)
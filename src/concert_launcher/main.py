@@ -1,15 +1,22 @@
 import argparse
 import argcomplete
+import argcomplete.completers
 import logging
 import time
 import os
 import yaml
 from typing import List, Dict
 import asyncio
+import signal
 
 from concert_launcher import config
 from concert_launcher import executor
 from concert_launcher import monitoring_session
+from concert_launcher import plan
+from concert_launcher import events
+from concert_launcher import supervisor
+from concert_launcher import doctor
+from concert_launcher import profiling
 
 async def do_main():
 
@@ -23,12 +30,31 @@ async def do_main():
     process_choices = None
     
     try:
-        dfl_config = yaml.safe_load(open(dfl_config_path, 'r'))
-        process_choices = [pname for pname in dfl_config.keys() if pname != 'context']
+        dfl_config = plan.expand_replicas(yaml.safe_load(open(dfl_config_path, 'r')))
+        process_choices = plan.get_processes(dfl_config) + list(dfl_config['context'].get('replica_groups', {}).keys())
     except:
         pass
         
 
+    # process selection args (union with process names)
+    def add_selection_args(subparser):
+        subparser.add_argument('--session', '-s', nargs='+', default=[], help='select all processes in the given sessions')
+        subparser.add_argument('--machine', '-M', nargs='+', default=[], help='select all processes on the given machines (\'local\' for the local machine)')
+        subparser.add_argument('--tag', '-T', nargs='+', default=[], help='select all processes with the given tags')
+
+    # deadlines (override the 'timeouts' field of the context)
+    def add_timeout_args(subparser, ready=False, budget=None):
+        subparser.add_argument('--connect-timeout', dest='connect_timeout', default=None, type=float, help='ssh connection timeout (seconds)')
+        subparser.add_argument('--command-timeout', dest='command_timeout', default=None, type=float, help='remote command timeout (seconds)')
+        if ready:
+            subparser.add_argument('--ready-timeout', dest='ready_timeout', default=None, type=float, help='max time for a process to become ready (seconds)')
+        if budget is not None:
+            subparser.add_argument('--timeout', dest='op_timeout', default=None, type=float, help=f'max duration of the whole {budget} operation (seconds)')
+
+    # structured event stream
+    def add_events_args(subparser):
+        subparser.add_argument('--events-socket', dest='events_socket', default=None, type=str, help='serve launcher events as json lines on this unix socket')
+
     # cmd line args
     parser = argparse.ArgumentParser(description='A minimal YAML and TMUX based process launcher')
 
@@ -39,7 +65,7 @@ async def do_main():
     # run
     run = command.add_parser('run', help='run the specified process and its dependencies')
     
-    run.add_argument('process', choices=process_choices, help='process name to run')
+    run.add_argument('process', nargs='*', help='process names to run').completer = argcomplete.completers.ChoicesCompleter(process_choices or [])
     
     run.add_argument('--watch', '-w', action='store_true', help='wait for process to finish before returning')
     
@@ -49,21 +75,119 @@ async def do_main():
 
     run.add_argument('--config', '-c', default=dfl_config_path, type=str, help='path config file')
 
+    add_selection_args(run)
+
+    add_events_args(run)
+
+    add_timeout_args(run, ready=True, budget='run')
+
     run.add_argument('--monitor', '-m', action='store_true', help='spawn a local tmux monitoring session')
 
+    run.add_argument('--supervise', '-S', action='store_true', help='keep running, and restart the processes that die according to their restart policy')
+
+    run.add_argument('--plan', '--dry-run', dest='plan', action='store_true', help='validate the config and print the execution plan, without running anything')
+
     run.add_argument('--log-level', '-l', dest='log_level', default='WARNING', 
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help='set the logging level')
 
+    # sync
+    sync = command.add_parser('sync', help='restart processes whose config changed since launch (and their dependants), start missing ones')
+
+    sync.add_argument('process', nargs='*', help='process names to sync (default: all)').completer = argcomplete.completers.ChoicesCompleter(process_choices or [])
+
+    sync.add_argument('--params', '-p', nargs='+', help='parameters for process execution (key:=value)')
+
+    sync.add_argument('--variants', '-v', nargs='+', help='variants for process execution (procname:=varname)')
+
+    sync.add_argument('--config', '-c', default=dfl_config_path, type=str, help='path config file')
+
+    add_selection_args(sync)
+
+    add_events_args(sync)
+
+    add_timeout_args(sync, ready=True, budget='run')
+
+    sync.add_argument('--log-level', '-l', dest='log_level', default='WARNING', 
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='set the logging level')
+
+    # supervise
+    sup = command.add_parser('supervise', help='restart processes that die according to their restart policy, detect crash loops')
+
+    sup.add_argument('process', nargs='*', help='process names to supervise (default: all)').completer = argcomplete.completers.ChoicesCompleter(process_choices or [])
+
+    sup.add_argument('--period', default=1.0, type=float, help='seconds between checks')
+
+    sup.add_argument('--config', '-c', default=dfl_config_path, type=str, help='path config file')
+
+    add_selection_args(sup)
+
+    add_events_args(sup)
+
+    add_timeout_args(sup, ready=True)
+
+    sup.add_argument('--log-level', '-l', dest='log_level', default='WARNING', 
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='set the logging level')
+
+    # doctor
+    doc = command.add_parser('doctor', aliases=['bench-hosts'], help='measure ssh, shell, tmux, sftp and ready check latencies on every machine, and point to the dominant cost')
+
+    doc.add_argument('process', nargs='*', help='check the machines of these processes (default: all)').completer = argcomplete.completers.ChoicesCompleter(process_choices or [])
+
+    doc.add_argument('--samples', '-n', default=5, type=int, help='samples per measurement')
+
+    doc.add_argument('--sftp-size', dest='sftp_size', default=1024, type=int, help='size of the sftp test upload (KiB)')
+
+    doc.add_argument('--config', '-c', default=dfl_config_path, type=str, help='path config file')
+
+    add_selection_args(doc)
+
+    add_timeout_args(doc)
+
+    doc.add_argument('--log-level', '-l', dest='log_level', default='WARNING', 
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='set the logging level')
+
+    # profile
+    prof = command.add_parser('profile', help='profile running processes on their hosts (py-spy for python, perf for native code)')
+
+    prof.add_argument('process', nargs='+', help='process names to profile (at the same time)').completer = argcomplete.completers.ChoicesCompleter(process_choices or [])
+
+    prof.add_argument('--duration', '-d', default=10, type=float, help='sampling time (seconds)')
+
+    prof.add_argument('--rate', '-r', default=100, type=int, help='samples per second')
+
+    prof.add_argument('--profiler', '-P', default='auto', choices=profiling.profilers, help='sampling profiler (auto: py-spy for python processes, perf otherwise)')
+
+    prof.add_argument('--format', '-f', dest='format', default='collapsed', choices=profiling.formats, help='output format (collapsed stacks, or speedscope json)')
+
+    prof.add_argument('--output', '-o', default='.', type=str, help='output directory (one file per process)')
+
+    prof.add_argument('--config', '-c', default=dfl_config_path, type=str, help='path config file')
+
+    add_timeout_args(prof)
+
+    prof.add_argument('--log-level', '-l', dest='log_level', default='WARNING', 
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='set the logging level')
+
     # kill
     kill = command.add_parser('kill', help='kill the specified process and its dependant packages')
 
-    kill.add_argument('process', choices=process_choices, nargs='?', default=None, help='process name to run')
+    kill.add_argument('process', nargs='*', help='process names to kill').completer = argcomplete.completers.ChoicesCompleter(process_choices or [])
 
     kill.add_argument('--all', '-a', action='store_true', help='kill all processes')
 
     kill.add_argument('--config', '-c', default=dfl_config_path, type=str, help='path config file')
 
+    add_selection_args(kill)
+
+    add_events_args(kill)
+
+    add_timeout_args(kill, budget='kill')
+
     kill.add_argument('--log-level', '-l', dest='log_level', default='WARNING', 
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help='set the logging level')
@@ -77,6 +201,8 @@ async def do_main():
 
     status.add_argument('--config', '-c', default=dfl_config_path, type=str, help='path config file')
 
+    add_timeout_args(status, budget='status')
+
     status.add_argument('--log-level', '-l', dest='log_level', default='WARNING', 
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help='set the logging level')
@@ -101,6 +227,8 @@ async def do_main():
 
     watch.add_argument('--num-lines', '-n', default='+1', type=str, help='number of output lines to display once started')
 
+    add_timeout_args(watch, budget='watch')
+
     watch.add_argument('--log-level', '-l', dest='log_level', default='WARNING', 
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help='set the logging level')
@@ -126,15 +254,52 @@ async def do_main():
 
     cfg = yaml.safe_load(open(config_path))
     
+    # replica templates are expanded into their members
+    cfg = plan.expand_replicas(cfg)
+    
     session = cfg['context']['session']
 
+    # deadlines
+    op_timeout = getattr(args, 'op_timeout', None)
+
+    timeouts = config.Timeouts.from_cfg(cfg,
+                                        connect=getattr(args, 'connect_timeout', None),
+                                        command=getattr(args, 'command_timeout', None),
+                                        ready=getattr(args, 'ready_timeout', None),
+                                        run=op_timeout if args.command in ('run', 'sync') else None,
+                                        kill=op_timeout if args.command == 'kill' else None,
+                                        status=op_timeout if args.command == 'status' else None,
+                                        watch=op_timeout if args.command == 'watch' else None)
+
+    logger.info(f'timeouts: {timeouts}')
+
+    # one launcher instance shares connections across all operations
+    launcher = executor.Launcher(cfg, timeouts=timeouts, base_dir=os.path.dirname(config_path))
+
+    # event stream for external consumers (e.g. a gui)
+    exporter = None
+
+    if getattr(args, 'events_socket', None) is not None:
+        exporter = events.JsonLinesExporter(launcher.bus, args.events_socket)
+        await exporter.start()
+
+    def select_processes():
+        try:
+            return plan.select_processes(cfg, processes=args.process, sessions=args.session,
+                                         machines=args.machine, tags=args.tag)
+        except KeyError as e:
+            parser.error(e.args[0])
+
     def spawn_monitor():
         if args.command == 'mon' and args.replace:
             os.execvpe('bash', ['bash', '-ic', f'tmux attach -t {session}_mon'], env=os.environ)
         else:
             os.system(f'x-terminal-emulator -x "tmux a -t {session}_mon; bash"')
 
-    if args.command == 'run':
+    def has_selection():
+        return len(args.process + args.session + args.machine + args.tag) > 0
+
+    if args.command in ('run', 'sync'):
 
         # fill param dict
         params = {}
@@ -158,27 +323,79 @@ async def do_main():
 
         logger.info(f'variants list is : {variants}')
 
+    if args.command == 'sync':
+
+        # no process and no selector given = sync all
+        processes = select_processes() if has_selection() else None
+
+        await launcher.sync(processes, params=params, variants=variants)
+
+    if args.command == 'run':
+
+        # processes to run
+        processes = select_processes()
+
+        if len(processes) == 0:
+            parser.error('no process selected')
+
+        # local check only
+        if args.plan:
+            schedule = launcher.plan(processes, params=params, variants=variants)
+            print(plan.format_schedule(schedule))
+            exit(1 if len(schedule['errors']) > 0 else 0)
+
         # create local viewer
         if args.monitor:
 
-            await monitoring_session.create_monitoring_session(process=args.process, cfg=cfg)
+            await monitoring_session.create_monitoring_session(process=None, cfg=cfg)
             
             spawn_monitor()
 
         # run processes
-        await executor.execute_process(process=args.process, cfg=cfg, params=params, variants=variants)
+        await launcher.execute_processes(processes, params=params, variants=variants)
         
         # handle watch
         if args.watch:
-            await executor.wait_process(process=args.process, cfg=cfg)
+            await asyncio.gather(*[launcher.wait_process(p) for p in processes])
+
+        # keep the processes (and their dependencies) alive
+        if args.supervise:
+            await supervisor.Supervisor(launcher, plan.get_dependency_closure(cfg, processes),
+                                        params=params, variants=variants).run()
+
+    if args.command == 'supervise':
+
+        # no process and no selector given = supervise all
+        processes = select_processes() if has_selection() else None
+
+        await supervisor.Supervisor(launcher, processes, period=args.period).run()
+
+    if args.command in ('doctor', 'bench-hosts'):
+
+        processes = select_processes() if has_selection() else None
+
+        reports = await doctor.diagnose(launcher, processes, samples=args.samples, sftp_size=1024 * args.sftp_size)
+
+        print(doctor.format_report(reports))
+
+    if args.command == 'profile':
+
+        try:
+            processes = plan.select_processes(cfg, processes=args.process)
+        except KeyError as e:
+            parser.error(e.args[0])
+
+        await launcher.profile(processes, duration=args.duration, rate=args.rate, profiler=args.profiler,
+                               fmt=args.format, output_dir=args.output)
 
     if args.command == 'kill':
 
-        proc_to_kill = None if args.all else args.process
+        # no process and no selector given = kill all
+        proc_to_kill = select_processes() if has_selection() and not args.all else None
         
         logger.info(f'will kill proc {proc_to_kill}')
 
-        await executor.kill(process=proc_to_kill, cfg=cfg)
+        await launcher.kill(proc_to_kill)
 
     if args.command == 'status':
 
@@ -187,18 +404,18 @@ async def do_main():
             while True:
                 t0 = time.time()
                 if args.pstree:
-                    await executor.pstree(None, cfg=cfg)
+                    await launcher.pstree()
                 else:
-                    await executor.status(None, cfg=cfg)
+                    await launcher.status()
                 print('')
                 await asyncio.sleep(0.666 - (time.time() - t0))
 
         else:
             
             if args.pstree:
-                    await executor.pstree(None, cfg=cfg)
+                    await launcher.pstree()
             else:
-                await executor.status(None, cfg=cfg)
+                await launcher.status()
 
     if args.command == 'mon':
 
@@ -208,12 +425,30 @@ async def do_main():
 
     if args.command == 'watch':
 
-        await executor.watch(process=args.process, cfg=cfg, num_lines=args.num_lines)
+        await launcher.watch(args.process, num_lines=args.num_lines)
+        
+    if exporter is not None:
+        await exporter.close()
         
     
 def main():
 
-    asyncio.get_event_loop().run_until_complete(do_main())
+    loop = asyncio.get_event_loop()
+
+    task = asyncio.ensure_future(do_main())
+
+    # ctrl+c cancels the running operations, which clean up after themselves
+    loop.add_signal_handler(signal.SIGINT, task.cancel)
+
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        print('interrupted')
+        exit(130)
+    except asyncio.TimeoutError as e:
+        # e.g. executor.DeadlineExceeded, with the list of stragglers
+        print(e)
+        exit(1)
     
 
 if __name__ == '__main__':
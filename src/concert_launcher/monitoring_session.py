@@ -1,161 +1,306 @@
-from typing import Dict
+from typing import Dict, List
 import logging
-from . import remote
-import asyncssh, asyncio
+import math
+import tempfile
 import os
+import shlex
+from . import remote
+import asyncio
 from .executor import ConfigParser
 
-ssh = None
-
 logger = logging.getLogger(__name__)
 
-num_cols = 3
-pane_to_split = 0
-num_rows = 1
-num_panes = 0
 
-pkg_already_processed = set()
+def tmux_quote(s: str):
+    # quote a string for the tmux config syntax
+    if "'" not in s:
+        return f"'{s}'"
+    s = s.replace('\\', '\\\\').replace('"', '\\"').replace('$', '\\$')
+    return f'"{s}"'
 
-lock = asyncio.Lock()
 
-async def create_monitoring_session(process: str, cfg: Dict, level=0):
+class MonitoringSession:
+
+    """
+    Builds the local tmux monitoring session, one pane per process.
+    The layout is computed up front (one window per session, paged when
+    there are more than max_panes processes, panes tiled as a grid) and
+    applied with a single generated tmux script, which rebuilds the
+    session from scratch when re-run.
+    """
+
+    # max number of panes per window (more panes go to another page)
+    max_panes = 9
+
+    def __init__(self, cfg: Dict):
+
+        self.cfg = cfg
+
+        self.tmux_session = cfg['context']['session'] + '_mon'
+
+        self.max_panes = cfg['context'].get('monitor', {}).get('max_panes', self.max_panes)
+
+        # directory for the host watcher script and the pane fifos
+        self.state_dir = os.path.join(remote.ssh_control_dir(), self.tmux_session)
+
+        # machine (or host name) -> gateway machine
+        self.jumps = cfg['context'].get('ssh', {}).get('jump', {})
+
+
+    def ssh_opts(self, machine):
+        return remote.ssh_control_opts(remote.jump_host(self.jumps, machine))
+
+
+    def fifo(self, e: ConfigParser):
+        # fifo the pane of a process blocks on until its session exists
+        machine = 'local' if e.machine is None else e.machine
+        return os.path.join(self.state_dir, f'{machine}.{e.name}.fifo')
+
+
+    def pane_cmd(self, e: ConfigParser):
+
+        process = e.name
+
+        # headless processes have no window to attach to, their output is
+        # followed instead (see backend.py)
+        if e.backend.name != 'tmux':
+            tail = f'tail -F -n +1 /tmp/{process}.stdout'
+            return tail if e.machine is None else f"ssh {self.ssh_opts(e.machine)} {e.machine} -tt '{tail}'"
+
+        # define monitoring command (wait for session -> attach): panes
+        # block on their fifo, written by the host watcher
+        wait = f"echo waiting for session {process} to exist..; read _ < {self.fifo(e)}"
+
+        if e.machine is None:
+            return f"{wait}; unset TMUX; tmux a -t {process}:{process}"
+
+        # remote panes attach through the shared master connection
+        return f"{wait}; ssh {self.ssh_opts(e.machine)} {e.machine} -tt 'unset TMUX; tmux a -t {process}:{process}'"
+
+
+    def watcher_script(self, targets: Dict[str, List[str]]):
+
+        """
+        Script waiting for the sessions of the given processes on each
+        machine (None = local machine), which wakes up their panes as
+        sessions appear: a single command per host (one ssh session for
+        remote ones, running a loop on the host) that exits once all the
+        targets exist, rather than one poll per pane
+        """
+
+        lines = [
+            '#!/bin/bash',
+            '',
+            '# wake up the panes of the sessions read from stdin ($1 = machine)',
+            'wake() {',
+            '    while read -r s; do',
+            f'        f="{self.state_dir}/$1.$s.fifo"',
+            '        [ -p "$f" ] && { echo > "$f"; rm -f "$f"; } &',
+            '    done',
+            '}',
+            '',
+        ]
+
+        for m, processes in targets.items():
+
+            # prints every target session once it exists, exits when all do
+            loop = (f"left='{' '.join(processes)}'; "
+                    "while [ -n \"$left\" ]; do "
+                    "s=$(tmux list-windows -a -F '#{session_name}:#{window_name}' 2>/dev/null); rest=; "
+                    "for t in $left; do "
+                    "if printf '%s\\n' \"$s\" | grep -qxF \"$t:$t\"; then echo \"$t\"; else rest=\"$rest $t\"; fi; "
+                    "done; left=$rest; [ -n \"$left\" ] && sleep 1; "
+                    "done; true")
+
+            if m is None:
+                cmd, name = f'sh -c {shlex.quote(loop)}', 'local'
+            else:
+                cmd, name = f'ssh {self.ssh_opts(m)} {m} {shlex.quote(loop)}', m
+
+            # (retried if the connection drops)
+            lines.append(f'until {cmd} | wake {name}; [ "${{PIPESTATUS[0]}}" = 0 ]; do sleep 1; done &')
+
+        lines += ['', 'wait', '', '# all the sessions exist', 'tmux kill-window -t "$TMUX_PANE"']
+
+        return '\n'.join(lines) + '\n'
+
+
+    def compute_layout(self, processes: List[str]) -> Dict[str, List[ConfigParser]]:
+
+        """
+        Return a dict window name -> processes shown in that window
+        """
 
-    session_names = set()
+        # group persistent processes by session
+        sessions = dict()
 
-    if level == 0:
-        
-        for pname, pfield in cfg.items():
-            if 'session' in pfield.keys():
-                session_names.add(pfield['session'])
+        for p in processes:
 
-        logging.info('found session names: %s' % session_names)
+            e = ConfigParser(process=p, cfg=self.cfg, level=1)
 
-        for s in session_names:
+            # if not persistent, skip
+            if not e.persistent:
+                continue
 
-            global num_cols 
-            global pane_to_split 
-            global num_rows 
-            global num_panes 
+            sessions.setdefault(e.session, []).append(e)
 
-            num_cols = 3
-            pane_to_split = 0
-            num_rows = 1
-            num_panes = 0
+        # split into pages
+        layout = dict()
 
-            logging.info('processing session %s' % s)
+        for s, elist in sessions.items():
 
-            for pname, pfield in cfg.items():
+            num_pages = math.ceil(len(elist) / self.max_panes)
 
-                if pname == 'context':
-                    continue
-                
-                ps = pfield.get('session', cfg['context']['session'])
-                
-                if ps != s:
-                    continue
+            for i in range(num_pages):
+                wname = s if i == 0 else f'{s}_{i+1}'
+                layout[wname] = elist[i*self.max_panes:(i+1)*self.max_panes]
 
-                logging.info('processing process %s' % pname)
+        return layout
 
-                await create_monitoring_session(pname, cfg, level=1)
 
-        return
+    def generate_script(self, layout: Dict[str, List[ConfigParser]]):
 
-    e = ConfigParser(process=process, cfg=cfg, level=level)
+        tmux_session = self.tmux_session
 
-    await e.connect()
+        lines = []
 
-    # do process
-    async with lock:
-        await _create_monitoring_session_non_reentrant(e, process, level, cfg['context']['session'] + '_mon')
+        for i, (wname, elist) in enumerate(layout.items()):
 
+            target = f'{tmux_session}:{wname}'
 
-async def _create_monitoring_session_non_reentrant(e: ConfigParser, process: str, level, tmux_session):
+            # first pane creates the window (and the session); a large
+            # virtual size avoids running out of space while splitting
+            first_cmd = tmux_quote(self.pane_cmd(elist[0]))
 
-    # dont repeat twice
-    if process in pkg_already_processed:
-        return
-        
-    pkg_already_processed.add(process)
+            if i == 0:
+                lines += [
+                    f'new-session -d -x 400 -y 200 -s {tmux_session} -n {wname} {first_cmd}',
+                    f'set -t {tmux_session} status-style bg=magenta',
+                    f'set -t {tmux_session} mouse on',
+                    f'set -t {tmux_session} aggressive-resize on',
+                    f'set -t {tmux_session} remain-on-exit on',
+                ]
+            else:
+                lines.append(f'new-window -d -t {tmux_session} -n {wname} {first_cmd}')
 
-    # if not persistent, exit
-    if not e.persistent:
-        return
+            lines += [
+                f'set -w -t {target} pane-border-status top',
+                f'set -w -t {target} pane-border-format " #{{pane_title}} "',
+                f'select-pane -t {target} -T {elist[0].name}',
+            ]
 
-    # define monitoring command (connect ssh -> wait for session -> attach)
-    cmd = f"while ! tmux has-session -t {process}:{process}; do echo waiting for session {process} to exist..; sleep 1; done; unset TMUX; tmux a -t {process}:{process}"
-    
-    if e.machine is not None:
-        cmd = f"ssh {e.machine} -tt '{cmd}'"
-    
-    # on first time, ssh connection to local pc (tbd: support remote maybe)
-    # and session creation
-    global num_rows
-    global num_panes
-    global pane_to_split
+            # each split makes the new pane the active one, so that
+            # titles can be set without relying on pane indices
+            for e in elist[1:]:
+                lines += [
+                    f'split-window -t {target} {tmux_quote(self.pane_cmd(e))}',
+                    f'select-pane -t {target} -T {e.name}',
+                    f'select-layout -t {target} tiled',
+                ]
 
-    print(f'adding session {process} to monitor')
+            # grid layout (single row for up to three panes)
+            layout_name = 'even-horizontal' if len(elist) <= 3 else 'tiled'
 
-    if num_panes == 0:  
-    
-        ret, _, _ = await remote.run_cmd(ssh,
-                        f'tmux has-session -t {tmux_session}',
-                        throw_on_failure=False)
-        if ret != 0:
+            lines.append(f'select-layout -t {target} {layout_name}')
+
+        # host watcher
+        if len(self.get_targets(layout)) > 0:
+            watcher = os.path.join(self.state_dir, 'watch_hosts.bash')
+            lines.append(f'new-window -d -t {tmux_session} -n _hosts {tmux_quote("bash " + watcher)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+    def get_machines(self, layout: Dict[str, List[ConfigParser]]):
+        machines = [e.machine for elist in layout.values() for e in elist if e.machine is not None]
+        return list(dict.fromkeys(machines))
+
+
+    def get_targets(self, layout: Dict[str, List[ConfigParser]]) -> Dict[str, List[ConfigParser]]:
+        # machine -> processes whose pane waits for their tmux session
+        targets = dict()
+        for elist in layout.values():
+            for e in elist:
+                if e.backend.name == 'tmux':
+                    targets.setdefault(e.machine, []).append(e)
+        return targets
+
+
+    async def start_masters(self, machines: List[str]):
+
+        # gateways first, as the masters of the machines behind them are
+        # tunnelled through theirs
+        started = dict()
+
+        def start(m):
+            if m not in started.keys():
+                started[m] = asyncio.ensure_future(start_after_gateway(m))
+            return started[m]
+
+        async def start_after_gateway(m):
+            gateway = remote.jump_host(self.jumps, m)
+            if gateway is not None:
+                await start(gateway)
+            await remote.ssh_start_master(m, jump=gateway)
+
+        await asyncio.gather(*[start(m) for m in machines])
+
+
+    async def create(self, processes: List[str] = None):
+
+        if processes is None:
+            processes = [p for p in self.cfg.keys() if p != 'context']
+
+        layout = self.compute_layout(processes)
+
+        if len(layout) == 0:
+            print('no process to monitor')
+            return
+
+        for wname, elist in layout.items():
+            logger.info(f'window {wname}: {[e.name for e in elist]}')
+
+        # one shared master connection per machine
+        machines = self.get_machines(layout)
+
+        if len(machines) > 0:
+            await self.start_masters(machines)
+
+        # fresh fifos for the panes (stale ones are from a previous run)
+        os.makedirs(self.state_dir, mode=0o700, exist_ok=True)
+
+        targets = self.get_targets(layout)
+
+        for elist in targets.values():
+            for e in elist:
+                if os.path.exists(self.fifo(e)):
+                    os.remove(self.fifo(e))
+                os.mkfifo(self.fifo(e), 0o600)
+
+        with open(os.path.join(self.state_dir, 'watch_hosts.bash'), 'w') as f:
+            f.write(self.watcher_script({m: [e.name for e in elist] for m, elist in targets.items()}))
+
+        script = self.generate_script(layout)
+
+        logger.debug(f'monitoring session script:\n{script}')
+
+        with tempfile.NamedTemporaryFile('w', prefix='concert_launcher_mon_', suffix='.tmux', delete=False) as f:
+            f.write(script)
+
+        try:
             # kill and re-create monitor session
-            await remote.run_cmd(ssh, 
-                        f'tmux kill-session -t {tmux_session} || tmux new-session -d -s {tmux_session} -n {e.session} "{cmd}"')
-            
-            await remote.run_cmd(ssh, 
-                                 f'tmux set -t {tmux_session} status-style bg=magenta')
-
-        else:
-            await remote.run_cmd(ssh, 
-                        f'tmux kill-window -t {tmux_session}:{e.session}; tmux new-window -d -t {tmux_session} -n {e.session} "{cmd}"',
-                        throw_on_failure=False)
-        
-        num_panes = 1
-        
-        await remote.run_cmd(ssh, 
-                f"tmux set -t {tmux_session} mouse on")   
-        
-        
-        await remote.run_cmd(ssh, 
-                f"tmux set -t {tmux_session} aggressive-resize on")   
-        
-        await remote.run_cmd(ssh, 
-                f"tmux set -t {tmux_session} remain-on-exit on")
-        
-        print(f'moniting session created (tmux a -t {tmux_session})')
-        
-        return
-
-    
-    # create pane by splitting the window
-        
-    logging.info(f"level = {level}  num_rows =  {num_rows}  num_cols = {num_cols}  num_panes = {num_panes}  pane_to_split = {pane_to_split}")
-
-    split_type = '-h' if num_rows == 1 else '-v'
-        
-    await remote.run_cmd(ssh,
-                   f'tmux split-window {split_type} -t {tmux_session}:{e.session}.{pane_to_split} "{cmd}"',
-                   interactive=False,
-                   throw_on_failure=False)
-    
-    pane_to_split += num_rows
-
-    num_panes += 1
-
-    if num_panes == num_cols*num_rows:
-        pane_to_split = num_rows - 1
-        num_rows += 1
-
-    # redraw layout
-    layout = 'even-horizontal' if num_rows == 1 else 'tiled'
-    await remote.run_cmd(ssh,
-                   f'tmux select-layout -t {tmux_session}:{e.session} {layout}',
-                   interactive=False,
-                   throw_on_failure=False)
-    
-    # return session name
-    return tmux_session
-    
\ No newline at end of file
+            await remote.run_cmd(None,
+                                 f'tmux kill-session -t {self.tmux_session} 2>/dev/null; tmux start-server \\; source-file {f.name}')
+        finally:
+            os.remove(f.name)
+
+        print(f'moniting session created (tmux a -t {self.tmux_session})')
+
+
+async def create_monitoring_session(process: str, cfg: Dict, level=0):
+
+    mon = MonitoringSession(cfg)
+
+    await mon.create()
+
+    return mon.tmux_session
@@ -0,0 +1,592 @@
+from typing import List, Dict
+import copy
+import itertools
+import logging
+import signal
+from . import sched, limits, restart, files, backend
+
+logger = logging.getLogger(__name__)
+
+
+# processes with a 'replicas' or 'matrix' field are templates, expanded into
+# one process per replica (named <process>_<i>), e.g.
+#
+#   camera:
+#     replicas: 3                    # or a list of param dicts, one per replica
+#     machine: [user@pc1, user@pc2]  # members are spread over the list
+#     cmd: camera_node --device /dev/video{replica}
+#
+#   driver:
+#     matrix:                        # one replica per combination
+#       side: [left, right]
+#       joint: [hip, knee]
+#     cmd: driver --side {side} --joint {joint}
+#
+# {replica} (the index) and the replica params are substituted in all the
+# string fields of the member (cmd, ready_check, machine, depends, ...);
+# depending on the template name means depending on all its members
+
+replica_fields = ['replicas', 'matrix']
+
+
+def get_replica_params(pfield: Dict) -> List[Dict]:
+
+    """
+    The params of every replica of a template (raises ValueError if the
+    replicas/matrix field is malformed)
+    """
+
+    if 'replicas' in pfield.keys() and 'matrix' in pfield.keys():
+        raise ValueError('replicas and matrix are mutually exclusive')
+
+    if 'matrix' in pfield.keys():
+
+        matrix = pfield['matrix']
+
+        if not isinstance(matrix, dict) or len(matrix) == 0 or \
+                not all(isinstance(v, list) and len(v) > 0 for v in matrix.values()):
+            raise ValueError('matrix must be a mapping param -> non empty list of values')
+
+        params = [dict(zip(matrix.keys(), values)) for values in itertools.product(*matrix.values())]
+
+    else:
+
+        replicas = pfield['replicas']
+
+        if isinstance(replicas, bool):
+            raise ValueError('replicas must be a positive int or a list of param mappings')
+        elif isinstance(replicas, int) and replicas > 0:
+            params = [dict() for _ in range(replicas)]
+        elif isinstance(replicas, list) and len(replicas) > 0 and all(isinstance(r, dict) for r in replicas):
+            params = [dict(r) for r in replicas]
+        else:
+            raise ValueError('replicas must be a positive int or a list of param mappings')
+
+    for i, rparams in enumerate(params):
+        rparams['replica'] = i
+
+    return params
+
+
+def _substitute(value, params: Dict):
+    # {param} -> value in all strings (other braces are left alone)
+    if isinstance(value, str):
+        for k, v in params.items():
+            value = value.replace(f'{{{k}}}', str(v))
+        return value
+    if isinstance(value, list):
+        return [_substitute(v, params) for v in value]
+    if isinstance(value, dict):
+        return {k: _substitute(v, params) for k, v in value.items()}
+    return value
+
+
+def expand_replicas(cfg: Dict) -> Dict:
+
+    """
+    Return a copy of cfg with templates expanded into their members (in
+    place of the template, in config order), and group dependencies
+    replaced by the member lists; context.replica_groups maps every
+    template to its members. Malformed templates are kept as they are (see
+    validate_graph). Expanding an expanded config is a no-op.
+    """
+
+    groups = dict(cfg.get('context', {}).get('replica_groups', {}))
+
+    templates = 0
+
+    expanded = dict()
+
+    for p, pfield in cfg.items():
+
+        if p == 'context' or not isinstance(pfield, dict) or \
+                not any(f in pfield.keys() for f in replica_fields):
+            expanded[p] = pfield
+            continue
+
+        try:
+            params = get_replica_params(pfield)
+        except ValueError:
+            expanded[p] = pfield
+            continue
+
+        members = [f'{p}_{i}' for i in range(len(params))]
+
+        if any(m in cfg.keys() for m in members):
+            expanded[p] = pfield
+            continue
+
+        template = {k: v for k, v in pfield.items() if k not in replica_fields}
+
+        machines = template.pop('machine', None)
+
+        for m, rparams in zip(members, params):
+
+            member = _substitute(copy.deepcopy(template), rparams)
+
+            # spread over the given machines
+            if isinstance(machines, list):
+                member['machine'] = _substitute(machines[rparams['replica'] % len(machines)], rparams)
+            elif machines is not None:
+                member['machine'] = _substitute(machines, rparams)
+
+            expanded[m] = member
+
+        groups[p] = members
+
+        templates += 1
+
+    if templates == 0:
+        return cfg
+
+    # dependencies on a whole group
+    for p, pfield in expanded.items():
+        if p == 'context' or not isinstance(pfield, dict) or 'depends' not in pfield.keys():
+            continue
+        depends = []
+        for dep in pfield['depends']:
+            depends += groups.get(dep, [dep])
+        expanded[p] = dict(pfield, depends=depends)
+
+    expanded['context'] = dict(cfg.get('context', {}), replica_groups=groups)
+
+    return expanded
+
+
+def resolve_names(cfg: Dict, names: List[str]) -> List[str]:
+    # replica group names -> their members
+    groups = cfg.get('context', {}).get('replica_groups', {})
+    ret = []
+    for n in names:
+        ret += groups.get(n, [n])
+    return ret
+
+
+def get_processes(cfg: Dict) -> List[str]:
+    return [p for p in cfg.keys() if p != 'context']
+
+
+def get_machine(cfg: Dict, process: str) -> str:
+    machine = cfg[process].get('machine', None)
+    return 'local' if machine is None else machine
+
+
+def get_session(cfg: Dict, process: str) -> str:
+    return cfg[process].get('session', cfg['context']['session'])
+
+
+def get_tags(cfg: Dict, process: str) -> List[str]:
+    tags = cfg[process].get('tags', [])
+    return [tags] if isinstance(tags, str) else list(tags)
+
+
+def select_processes(cfg: Dict,
+                     processes: List[str] = None,
+                     sessions: List[str] = None,
+                     machines: List[str] = None,
+                     tags: List[str] = None) -> List[str]:
+    """
+    Return the union of the processes given by name (replica groups stand
+    for their members) and of those matching any of the given sessions,
+    machines or tags, in config order.
+    """
+
+    processes = processes or []
+    sessions = sessions or []
+    machines = machines or []
+    tags = tags or []
+
+    all_processes = get_processes(cfg)
+
+    processes = resolve_names(cfg, processes)
+
+    for p in processes:
+        if p not in all_processes:
+            raise KeyError(f'unknown process {p}')
+
+    selected = []
+
+    for p in all_processes:
+
+        if p in processes or \
+                get_session(cfg, p) in sessions or \
+                get_machine(cfg, p) in machines or \
+                any(t in tags for t in get_tags(cfg, p)):
+            selected.append(p)
+
+    logger.info(f'selected processes: {selected}')
+
+    return selected
+
+
+def get_dependency_closure(cfg: Dict, processes: List[str]) -> List[str]:
+    """
+    Return the given processes plus all their (transitive) dependencies;
+    unknown processes are left out (see validate_graph)
+    """
+
+    closure = []
+
+    def visit(p):
+        if p in closure or p == 'context' or not isinstance(cfg.get(p, None), dict):
+            return
+        closure.append(p)
+        for dep in cfg[p].get('depends', []):
+            visit(dep)
+
+    for p in processes:
+        visit(p)
+
+    return closure
+
+
+def get_dependants(cfg: Dict, process: str) -> List[str]:
+    return [p for p in get_processes(cfg) if process in cfg[p].get('depends', [])]
+
+
+def is_persistent(cfg: Dict, process: str) -> bool:
+    return cfg[process].get('persistent', True)
+
+
+def get_kill_levels(cfg: Dict, processes: List[str]) -> List[List[str]]:
+    """
+    Return the processes that must be killed together with the given ones,
+    split into levels that are to be killed in order. This includes
+    persistent dependants, and the dependencies of non-persistent processes
+    (which act as process groups). Each process comes after all its
+    dependants, so processes within a level can be killed in parallel.
+    Only persistent processes are returned; processes on (or depending on)
+    a dependency cycle cannot be ordered, and make up the last level.
+    """
+
+    kill_set = []
+
+    def visit(p):
+        if p in kill_set:
+            return
+        kill_set.append(p)
+        for d in get_dependants(cfg, p):
+            if is_persistent(cfg, d):
+                visit(d)
+        if not is_persistent(cfg, p):
+            for dep in cfg[p].get('depends', []):
+                visit(dep)
+
+    for p in processes:
+        visit(p)
+
+    persistent = [p for p in kill_set if is_persistent(cfg, p)]
+
+    # level = length of the longest chain of dependants to be killed first
+    depth = dict()
+
+    def get_depth(p, visiting=()):
+        if p in visiting:
+            raise ValueError(f'dependency cycle through process {p}')
+        if p not in depth.keys():
+            dependants = [d for d in get_dependants(cfg, p) if d in persistent]
+            depth[p] = 1 + max([get_depth(d, visiting + (p,)) for d in dependants], default=-1)
+        return depth[p]
+
+    levels = []
+
+    cyclic = []
+
+    for p in persistent:
+        try:
+            l = get_depth(p)
+        except ValueError:
+            cyclic.append(p)
+            continue
+        while len(levels) <= l:
+            levels.append([])
+        levels[l].append(p)
+
+    # a broken config can still be torn down (their dependants, if any,
+    # are killed first)
+    if len(cyclic) > 0:
+        logger.warning(f'dependency cycle among {", ".join(cyclic)}, killing them together')
+        levels.append(cyclic)
+
+    return levels
+
+
+def validate_kill(kill_cfg: Dict) -> List[str]:
+
+    """
+    Check a kill escalation config (signals, grace, final), return the
+    list of errors found
+    """
+
+    if not isinstance(kill_cfg, dict):
+        return ['kill must be a mapping']
+
+    errors = []
+
+    signals = kill_cfg.get('signals', [])
+
+    if not isinstance(signals, list):
+        errors.append(f'kill.signals must be a list of signal names (got {signals})')
+        signals = []
+
+    final = kill_cfg.get('final', None)
+
+    for s in signals + [final]:
+        if s is not None and (not isinstance(s, str) or s not in signal.Signals.__members__.keys()):
+            errors.append(f'unknown kill signal {s}')
+
+    grace = kill_cfg.get('grace', 5.0)
+
+    for g in (grace if isinstance(grace, list) else [grace]):
+        if isinstance(g, bool) or not isinstance(g, (int, float)) or g < 0:
+            errors.append(f'kill.grace must be a non negative number, or a list of them (got {grace})')
+            break
+
+    if isinstance(grace, list) and len(grace) == 0:
+        errors.append('kill.grace must not be an empty list')
+
+    return errors
+
+
+def validate_graph(cfg: Dict, processes: List[str]) -> List[str]:
+    """
+    Check the processes reachable from the given ones for missing
+    dependencies, dependency cycles and malformed fields, and that real time
+    processes do not share pinned cpus with other processes on the same
+    machine; return the list of errors found
+    """
+
+    errors = []
+
+    all_processes = get_processes(cfg)
+
+    if 'session' not in cfg.get('context', {}).keys():
+        errors.append('context.session is missing')
+
+    if 'restart' in cfg.get('context', {}).keys():
+        errors.extend(f'context: {err}' for err in restart.validate(cfg['context']['restart']))
+
+    errors.extend(check_jumps(cfg.get('context', {}).get('ssh', {}).get('jump', {})))
+
+    if 'backend' in cfg.get('context', {}).keys():
+        errors.extend(f'context: {err}' for err in backend.validate(cfg['context']['backend']))
+
+    context_files = cfg.get('context', {}).get('files', {})
+
+    if not isinstance(context_files, dict):
+        errors.append('context.files must be a mapping (machine -> files)')
+    else:
+        for machine, entries in context_files.items():
+            errors.extend(f'context.files.{machine}: {err}' for err in files.validate(entries))
+
+    visited = []
+
+    def visit(p, path):
+
+        if p in path:
+            cycle = path[path.index(p):] + [p]
+            errors.append(f'dependency cycle: {" -> ".join(cycle)}')
+            return
+
+        if p in visited:
+            return
+
+        visited.append(p)
+
+        pfield = cfg[p]
+
+        if not isinstance(pfield, dict):
+            errors.append(f'{p}: process definition must be a mapping')
+            return
+
+        if 'cmd' not in pfield.keys():
+            errors.append(f'{p}: cmd is missing')
+
+        # templates left unexpanded (see expand_replicas)
+        if any(f in pfield.keys() for f in replica_fields):
+            try:
+                members = [f'{p}_{i}' for i in range(len(get_replica_params(pfield)))]
+                clashes = [m for m in members if m in all_processes]
+                errors.append(f'{p}: replica names clash with process {", ".join(clashes)}' if len(clashes) > 0
+                              else f'{p}: replicas were not expanded')
+            except ValueError as ex:
+                errors.append(f'{p}: {ex}')
+
+        machine = pfield.get('machine', None)
+
+        if machine not in (None, 'local') and len(str(machine).split('@')) != 2:
+            errors.append(f'{p}: machine must be given as user@host (got {machine})')
+
+        for field in ('ready_timeout',):
+            if field in pfield.keys() and not isinstance(pfield[field], (int, float)):
+                errors.append(f'{p}: {field} must be a number')
+
+        context_kill = cfg.get('context', {}).get('kill', {})
+
+        if not isinstance(context_kill, dict) or not isinstance(pfield.get('kill', {}), dict):
+            errors.append(f'{p}: kill must be a mapping')
+        else:
+            errors.extend(f'{p}: {err}' for err in validate_kill(dict(context_kill, **pfield.get('kill', {}))))
+
+        if 'sched' in pfield.keys():
+            errors.extend(f'{p}: {err}' for err in sched.validate(pfield['sched']))
+
+        if 'limits' in pfield.keys():
+            errors.extend(f'{p}: {err}' for err in limits.validate(pfield['limits']))
+
+        if 'restart' in pfield.keys():
+            errors.extend(f'{p}: {err}' for err in restart.validate(pfield['restart']))
+
+        if 'files' in pfield.keys():
+            errors.extend(f'{p}: {err}' for err in files.validate(pfield['files']))
+
+        if 'backend' in pfield.keys():
+            errors.extend(f'{p}: {err}' for err in backend.validate(pfield['backend']))
+
+        deps = pfield.get('depends', [])
+
+        for dep in deps:
+            if dep not in all_processes:
+                errors.append(f'{p}: depends on unknown process {dep}')
+            else:
+                visit(dep, path + [p])
+
+    for p in resolve_names(cfg, processes):
+        if p not in all_processes:
+            errors.append(f'unknown process {p}')
+        else:
+            visit(p, [])
+
+    errors.extend(check_isolation(cfg, visited))
+
+    errors.extend(files.check_destinations(cfg, visited))
+
+    return errors
+
+
+def check_jumps(jumps: Dict) -> List[str]:
+    """
+    Gateways (context.ssh.jump, machine or host name -> gateway machine)
+    must be given as user@host, and must not form cycles
+    """
+
+    if not isinstance(jumps, dict):
+        return ['context.ssh.jump must be a mapping (machine or host -> gateway user@host)']
+
+    errors = []
+
+    for machine, gateway in jumps.items():
+
+        if len(str(gateway).split('@')) != 2:
+            errors.append(f'context.ssh.jump: gateway of {machine} must be given as user@host (got {gateway})')
+            continue
+
+        # follow the chain of gateways
+        path = [machine]
+
+        while gateway is not None:
+
+            if gateway in path or str(gateway).split('@')[-1] in path:
+                errors.append(f'context.ssh.jump: gateway cycle {" -> ".join(path + [gateway])}')
+                break
+
+            path.append(gateway)
+
+            gateway = jumps.get(gateway, jumps.get(str(gateway).split('@')[-1], None))
+
+    return errors
+
+
+def check_isolation(cfg: Dict, processes: List[str]) -> List[str]:
+    """
+    Real time processes (fifo/rr policy) must not share their pinned cpus
+    with best effort processes pinned on the same machine (processes that
+    are not pinned are not checked)
+    """
+
+    errors = []
+
+    pinned = []
+
+    for p in processes:
+        psched = cfg[p].get('sched', None) if isinstance(cfg[p], dict) else None
+        if not isinstance(psched, dict) or 'cpus' not in psched.keys():
+            continue
+        try:
+            cpus = set(sched.parse_cpus(psched['cpus']))
+        except ValueError:
+            continue
+        pinned.append((p, get_machine(cfg, p), cpus, sched.is_realtime(psched)))
+
+    for p, machine, cpus, rt in pinned:
+        if not rt:
+            continue
+        for q, qmachine, qcpus, qrt in pinned:
+            shared = cpus & qcpus
+            if qrt or qmachine != machine or len(shared) == 0:
+                continue
+            errors.append(f'{p}: real time process shares cpus {sched.format_cpus(shared)} with best effort process {q} on {machine}')
+
+    return errors
+
+
+def get_run_levels(cfg: Dict, processes: List[str]) -> List[List[str]]:
+    """
+    Return the given processes plus their dependencies, split into levels
+    that start in order: each process comes after all its dependencies
+    (the graph must be valid, see validate_graph)
+    """
+
+    depth = dict()
+
+    def get_depth(p, visiting=()):
+        if p in visiting:
+            raise ValueError(f'dependency cycle through process {p}')
+        if p not in depth.keys():
+            deps = cfg[p].get('depends', [])
+            depth[p] = 1 + max([get_depth(d, visiting + (p,)) for d in deps], default=-1)
+        return depth[p]
+
+    levels = []
+
+    for p in get_dependency_closure(cfg, processes):
+        l = get_depth(p)
+        while len(levels) <= l:
+            levels.append([])
+        levels[l].append(p)
+
+    return levels
+
+
+def format_schedule(schedule: Dict) -> str:
+    """
+    Human readable version of a run schedule (see Launcher.plan)
+    """
+
+    lines = []
+
+    for i, hosts in enumerate(schedule['levels']):
+
+        lines.append(f'level {i}')
+
+        for machine, entries in hosts.items():
+
+            lines.append(f'  {machine}')
+
+            for e in entries:
+                kind = '' if e['persistent'] else ' (one shot)'
+                if e.get('docker', None) is not None:
+                    kind += f' (in {e["docker"]})'
+                if e.get('backend', 'tmux') != 'tmux':
+                    kind += f' ({e["backend"]})'
+                lines.append(f'    {e["name"]} [{e["session"]}]{kind}: {e["cmd"]}')
+                if e['ready_check'] is not None:
+                    lines.append(f'      ready check: {e["ready_check"]}')
+
+    if len(schedule['errors']) > 0:
+        lines.append(f'errors ({len(schedule["errors"])}):')
+        lines += [f'  {err}' for err in schedule['errors']]
+    else:
+        lines.append('no errors')
+
+    return '\n'.join(lines)
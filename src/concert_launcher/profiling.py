@@ -0,0 +1,101 @@
+from typing import List, Dict, Tuple
+import json
+import os
+
+# on demand profiling of managed processes: the sampling runs on the target
+# host (see resources/concert_launcher_profile.py), which sends back
+# collapsed stacks; these are saved as they are (flamegraph.pl, inferno,
+# speedscope all read them), or converted to the speedscope json format
+
+formats = ['collapsed', 'speedscope']
+
+profilers = ['auto', 'py-spy', 'perf']
+
+extensions = {
+    'collapsed': '.collapsed',
+    'speedscope': '.speedscope.json',
+}
+
+
+def parse_collapsed(collapsed: str) -> List[Tuple[List[str], int]]:
+
+    """
+    List of (frames, count) from collapsed stacks ("frame;frame count"
+    lines, root first)
+    """
+
+    ret = []
+
+    for l in collapsed.split('\n'):
+
+        stack, _, count = l.strip().rpartition(' ')
+
+        if len(stack) == 0:
+            continue
+
+        ret.append((stack.split(';'), int(count)))
+
+    return ret
+
+
+def to_speedscope(collapsed: str, name: str, rate: int) -> Dict:
+
+    """
+    Speedscope file (sampled profile, weights in seconds) from collapsed
+    stacks sampled at rate Hz
+    """
+
+    frames = []
+    index = dict()
+
+    samples = []
+    weights = []
+
+    for stack, count in parse_collapsed(collapsed):
+
+        sample = []
+
+        for f in stack:
+            if f not in index.keys():
+                index[f] = len(frames)
+                frames.append({'name': f})
+            sample.append(index[f])
+
+        samples.append(sample)
+        weights.append(count / rate)
+
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+        'name': name,
+        'exporter': 'concert_launcher',
+    }
+
+
+def save(collapsed: str, output_dir: str, process: str, fmt='collapsed', rate=100) -> str:
+
+    """
+    Write the profile of a process to output_dir in the given format,
+    return the file path
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    path = os.path.join(output_dir, process + extensions[fmt])
+
+    with open(path, 'w') as f:
+        if fmt == 'speedscope':
+            json.dump(to_speedscope(collapsed, process, rate), f)
+        else:
+            f.write(collapsed + '\n')
+
+    return path
@@ -1,20 +1,173 @@
 import logging
 import shutil
-from . import config
+import os
+import tempfile
+import shlex
+import json
+import signal
+from . import config, sched, limits, container
+from .agent import AgentError
 import asyncssh, asyncio
 
 # logger
 logger = logging.getLogger(__name__)
 
-async def putfile(remote: asyncssh.SSHClientConnection, 
-                  local_path: str, 
-                  remote_path: str):
+
+class Stats:
+
+    """
+    Counters of remote activity (used by the benchmarks)
+    """
+
+    # commands run, i.e. round trips
+    commands = 0
+
+    # ssh channels opened
+    channels = 0
+
+    # ssh connections opened
+    connections = 0
+
+    @staticmethod
+    def reset():
+        Stats.commands = 0
+        Stats.channels = 0
+        Stats.connections = 0
+
+    @staticmethod
+    def snapshot():
+        return dict(commands=Stats.commands, channels=Stats.channels, connections=Stats.connections)
+
+
+async def putfile(remote, 
+                  local_path, 
+                  remote_path: str,
+                  preserve=False):
     
+    """
+    Copy a local file (or a list of files) to remote_path (a directory
+    for several files), over sftp on the host connection; preserve keeps
+    modification times and permissions
+    """
+
+    local_paths = [local_path] if isinstance(local_path, str) else list(local_path)
+
     if remote is None:
-        shutil.copy(local_path, remote_path)
+        for path in local_paths:
+            (shutil.copy2 if preserve else shutil.copy)(path, remote_path)
     else:
-        await run_cmd(None, f'scp {local_path} {remote._username}@{remote._host}:{remote_path}', 
-                      interactive=False, throw_on_failure=True)
+        Stats.commands += 1
+        Stats.channels += 1
+        await remote.put(local_path, remote_path, preserve=preserve)
+
+
+def jump_host(jumps: dict, machine: str):
+
+    """
+    Gateway machine (user@host) that machine is reached through, None if
+    it is reached directly; jumps maps machines (user@host), or host names,
+    to their gateway (the context.ssh.jump field)
+    """
+
+    if machine is None:
+        return None
+
+    if machine in jumps.keys():
+        return jumps[machine]
+
+    return jumps.get(machine.split('@')[-1], None)
+
+
+def ssh_control_dir():
+    return os.path.join(tempfile.gettempdir(), f'concert_launcher_{os.getuid()}')
+
+
+def ssh_control_opts(jump: str = None):
+
+    # options for openssh clients to share a multiplexed master connection
+    opts = f'-o ControlMaster=auto -o ControlPath={ssh_control_dir()}/%C -o ControlPersist=600'
+
+    if jump is None:
+        return opts
+
+    # hosts behind a gateway are reached through the master connection of
+    # the gateway (note: %C is escaped, as ProxyCommand expands its tokens)
+    return opts + f" -o 'ProxyCommand=ssh {opts.replace('%C', '%%C')} -W %h:%p {jump}'"
+
+
+async def ssh_start_master(machine: str, jump: str = None):
+
+    """
+    Start a background master connection to machine (unless one is already
+    running), which is then shared by all ssh clients using ssh_control_opts();
+    for machines behind a gateway (jump), the master connection of the
+    gateway must be running already
+    """
+
+    os.makedirs(ssh_control_dir(), mode=0o700, exist_ok=True)
+
+    opts = ssh_control_opts(jump)
+
+    ret, _, _ = await run_cmd(None, f'ssh {opts} -O check {machine}', throw_on_failure=False)
+
+    if ret == 0:
+        return True
+
+    # note: the master keeps running in background, so its output must
+    # not be captured
+    ret, _, _ = await run_cmd(None, f'ssh {opts} -o BatchMode=yes -fN {machine} > /dev/null 2>&1', throw_on_failure=False)
+
+    if ret != 0:
+        logger.warning(f'could not start ssh master connection to {machine}')
+
+    return ret == 0
+
+
+def _timeout(timeout, remote=None):
+    # None = default command timeout of the connection (see
+    # HostConnection.command_timeout), 0 = no timeout
+    if timeout is None:
+        timeout = getattr(remote, 'command_timeout', None)
+    if timeout is None:
+        timeout = config.ConfigOptions.command_timeout
+    return None if timeout == 0 else timeout
+
+
+def _agent(remote):
+    # the resident agent of the host (see agent.py), if running
+    agent = getattr(remote, 'agent', None)
+    return agent if agent is not None and agent.alive else None
+
+
+def _agent_lost(agent, ex):
+    # requests go through plain commands until the agent is restarted (on
+    # the next connect, see ConnectionPool.get)
+    logger.warning(f'{ex}, using plain commands')
+    agent.close()
+
+
+async def _agent_call(remote, op, timeout=None, **args):
+
+    Stats.commands += 1
+
+    agent = _agent(remote)
+
+    timeout = _timeout(timeout, remote)
+
+    try:
+        return await asyncio.wait_for(agent.call(op, **args), timeout=timeout)
+    except asyncio.TimeoutError:
+        raise asyncio.TimeoutError(f'agent request {op} timed out after {timeout} s')
+    except AgentError as ex:
+        _agent_lost(agent, ex)
+
+    # the same request, served by a one shot agent
+    req = shlex.quote(json.dumps(dict(op=op, args=args)))
+
+    _, stdout, _ = await run_cmd(remote, f'python3 /tmp/concert_launcher_agent.py --once {req}',
+                                 timeout=0 if timeout is None else timeout)
+
+    return json.loads(stdout)
 
 
 async def run_cmd(remote: asyncssh.SSHClientConnection, 
@@ -23,8 +176,22 @@ async def run_cmd(remote: asyncssh.SSHClientConnection,
                   interactive=False, 
                   throw_on_failure=True):
     
+    """
+    Run cmd on remote (None = local machine), and return (exit code, stdout,
+    stderr). Timeout is in seconds (None = the command timeout of remote, or
+    config.ConfigOptions.command_timeout, 0 = no timeout); asyncio.TimeoutError is raised when it expires.
+    Non-interactive commands go through the resident agent of the host, if
+    any.
+    """
+    
     verbose = config.ConfigOptions.verbose
 
+    timeout = _timeout(timeout, remote)
+
+    # note: interactive commands are user commands, which get a tty on
+    # their own channel
+    agent = None if interactive else _agent(remote)
+
     if interactive:
         cmd_real = f"bash -ic '{cmd}'"
     else:
@@ -32,19 +199,49 @@ async def run_cmd(remote: asyncssh.SSHClientConnection,
     
     logger.info(f'running {cmd_real}')
 
+    Stats.commands += 1
+
     if remote is None:
+        # (in a session of its own, so that it can be killed as a whole)
         proc = await asyncio.create_subprocess_shell(cmd_real, 
                     stdin=asyncio.subprocess.DEVNULL,
                     stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE)
-        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True)
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(f'command {cmd} timed out after {timeout} s')
+        finally:
+            # do not leave the command behind on timeout or cancellation
+            if proc.returncode is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
         stdout, stderr = stdout.decode(), stderr.decode()
         retcode = proc.returncode
     else:
-        res = await remote.run(cmd_real, check=False, timeout=timeout)
-        retcode = res.returncode
-        stdout = res.stdout
-        stderr = res.stderr
+        res = None
+        if agent is not None:
+            try:
+                res = await asyncio.wait_for(agent.call('exec', cmd=cmd_real), timeout=timeout)
+            except asyncio.TimeoutError:
+                raise asyncio.TimeoutError(f'command {cmd} timed out after {timeout} s')
+            except AgentError as ex:
+                # run on a channel of its own instead
+                _agent_lost(agent, ex)
+        if res is None:
+            Stats.channels += 1
+            try:
+                ret = await remote.run(cmd_real, check=False, timeout=timeout)
+            except asyncssh.TimeoutError:
+                raise asyncio.TimeoutError(f'command {cmd} timed out after {timeout} s')
+            res = dict(retcode=ret.returncode, stdout=ret.stdout, stderr=ret.stderr)
+        retcode = res['retcode']
+        stdout = res['stdout']
+        stderr = res['stderr']
 
     logger.debug(f'{cmd} exitcode: {retcode}')
 
@@ -64,6 +261,20 @@ async def watch_process(remote: asyncssh.SSHClientConnection,
                         interactive=False, 
                         throw_on_failure=True):
     
+    agent = _agent(remote)
+
+    if agent is not None:
+        Stats.commands += 1
+        try:
+            await agent.stream('watch', stdout_coro, cmd=cmd)
+            return
+        except AgentError as ex:
+            # watched again on a channel of its own (lines printed so far
+            # may show up again)
+            _agent_lost(agent, ex)
+
+    Stats.commands += 1
+
     if remote is None: 
         proc = await asyncio.create_subprocess_shell(cmd,
                 stdout=asyncio.subprocess.PIPE,
@@ -71,68 +282,372 @@ async def watch_process(remote: asyncssh.SSHClientConnection,
                 stdin=asyncio.subprocess.PIPE)
         decode = True
     else:
+        Stats.channels += 1
         proc = await remote.create_process(cmd)
         decode = False
     
-    while True:
-        try:
-            l = await proc.stdout.readline()
-        except BaseException as e:
-            print(f'exception ({e}) while running {cmd} -> skipping line')
-            continue
+    try:
             
-        if decode:
+        while True:
             try:
-                l = l.decode('ascii')
+                l = await proc.stdout.readline()
+            except asyncio.CancelledError:
+                raise
             except BaseException as e:
-                print(f'exception ({e}) while decoding line from {cmd} -> skipping line')
+                print(f'exception ({e}) while running {cmd} -> skipping line')
                 continue
-        if len(l) == 0:
-            return
-        await stdout_coro(l)
-
-
-async def tmux_ls(remote: asyncssh.SSHClientConnection, session: str):
-    
-    list_w_cmd = "tmux list-w -t %s -F '#{session_name} #{window_name} #{pane_pid} #{pane_dead} #{pane_dead_status}'" % session
+                
+            if decode:
+                try:
+                    l = l.decode('ascii')
+                except BaseException as e:
+                    print(f'exception ({e}) while decoding line from {cmd} -> skipping line')
+                    continue
+            if len(l) == 0:
+                return
+            await stdout_coro(l)
+
+    finally:
+
+        # stop the command when we are done (e.g. on cancellation)
+        if remote is None:
+            if proc.returncode is None:
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+        else:
+            proc.close()
+
+
+def _list_windows_cmd(sessions: list):
+
+    fmt = "'#{session_name} #{window_name} #{pane_pid} #{pane_dead} #{?@concert_exit,#{@concert_exit},#{?pane_dead_status,#{pane_dead_status},-}} #{?@concert_hash,#{@concert_hash},-} #{?@concert_oom,#{@concert_oom},0} #{?@concert_stopped,1,0}'"
+
+    if len(sessions) == 1:
+        return f"tmux list-w -t {sessions[0]} -F {fmt}"
+    else:
+        return f"tmux list-w -a -F {fmt}"
     
-    retcode, stdout, _ = await run_cmd(remote, list_w_cmd, throw_on_failure=False)
+
+def _parse_list_windows(retcode, stdout, sessions: list):
     
+    ret = {s: dict() for s in sessions}
+
     if retcode == 1:
-        return {}
+        return ret
     
     if retcode != 0:
         raise RuntimeError(f'tmux list-w returned unexpected exit code {retcode}')
     
     logger.info(f'tmux ls got stdout: {stdout}')
     
-    ret = dict()
-
     for l in stdout.split('\n'):
         
         tokens = l.strip().split(' ')
 
         if len(tokens) == 4:
+            tokens.append('-')
+
+        if len(tokens) == 5:
+            tokens.append('-')
+        
+        if len(tokens) == 6:
+            tokens.append(0)
+        
+        if len(tokens) == 7:
             tokens.append(0)
         
-        sname, wname, pid, dead, dead_status = tokens
+        sname, wname, pid, dead, dead_status, config_hash, oom_kills, stopped = tokens
         
-        if sname != session:
+        if sname not in ret.keys():
             continue
 
-        ret[wname] = {
+        ret[sname][wname] = {
             'pid': int(pid),
             'dead': int(dead) == 1,
-            'exitstatus': int(dead_status),
-            'run_pending': (await run_cmd(remote, f'ls /tmp/{wname}.STARTING', throw_on_failure=False))[0] == 0,
-            'kill_pending': (await run_cmd(remote, f'ls /tmp/{wname}.KILLING', throw_on_failure=False))[0] == 0,
+            'exitstatus': 0 if dead_status == '-' else int(dead_status),
+            # exit status of the wrapper, or of the pane: the latter can be
+            # missing (e.g. the wrapper was killed by a signal)
+            'exitstatus_known': dead_status != '-',
+            'config_hash': None if config_hash == '-' else config_hash,
+            # set by the wrapper (see limits.py)
+            'oom_kills': int(oom_kills),
+            # killed by the launcher (see tmux_mark_stopped)
+            'stopped': int(stopped) == 1,
         }
 
-    logger.info(f'tmux ls returns: {ret}')
+    return ret
+
+
+async def tmux_list_windows(remote: asyncssh.SSHClientConnection, sessions: list):
+
+    """
+    Return a dict session -> window name -> window info for the given
+    sessions, with a single tmux call
+    """
+
+    retcode, stdout, _ = await run_cmd(remote, _list_windows_cmd(sessions), throw_on_failure=False)
+
+    return _parse_list_windows(retcode, stdout, sessions)
+
+
+async def tmux_mark_stopped(remote: asyncssh.SSHClientConnection, windows: list):
+
+    """
+    Mark the given (session, window) pairs as stopped on purpose, with a
+    single tmux call, so that the supervisor does not restart them; the mark
+    is cleared when the window is respawned
+    """
+
+    if len(windows) == 0:
+        return
+
+    tmux_cmds = [f"set -w -t {session}:{window} @concert_stopped 1" for session, window in windows]
+
+    await run_tmux_chain(remote, tmux_cmds, throw_on_failure=False)
+
+
+# max length of a chained tmux command (tmux rejects commands longer than
+# its message size, 16 KiB)
+tmux_max_chain = 12000
+
+
+async def run_tmux_chain(remote: asyncssh.SSHClientConnection, tmux_cmds: list, throw_on_failure=True):
+
+    """
+    Run tmux commands in order, chained into as few tmux invocations as
+    the command length allows
+    """
+
+    chains = [[]]
+    length = 0
+
+    for c in tmux_cmds:
+        if len(chains[-1]) > 0 and length + len(c) + 4 > tmux_max_chain:
+            chains.append([])
+            length = 0
+        chains[-1].append(c)
+        length += len(c) + 4
+
+    for chain in chains:
+        if len(chain) > 0:
+            await run_cmd(remote, 'tmux ' + ' \\; '.join(chain), throw_on_failure=throw_on_failure)
+
+
+def state_key(session: str, window: str):
+    return f'{session}:{window}'
+
+
+def _state_cmd(request: dict):
+    return f'python3 /tmp/concert_launcher_state.py {shlex.quote(json.dumps(request))}'
+
+
+async def state_update(remote: asyncssh.SSHClientConnection, owner: str, records={}, renew=[], release=[]):
+
+    """
+    Update the launcher state records of a host (see
+    resources/concert_launcher_state.py), and return all its records
+    """
+
+    req = dict(owner=owner, set=records, renew=renew, release=release)
+
+    if _agent(remote) is not None:
+        return await _agent_call(remote, 'state', req=req)
+
+    _, stdout, _ = await run_cmd(remote, _state_cmd(req))
+
+    return json.loads(stdout)
+
+
+async def tmux_ls(remote: asyncssh.SSHClientConnection, session: str):
+    
+    """
+    Return a dict window name -> window info for the given session; the
+    launcher state record of each window (or None) is read in the same
+    round trip
+    """
+
+    return await ls_windows(remote, session, _list_windows_cmd, _parse_list_windows)
+
+
+async def ls_windows(remote: asyncssh.SSHClientConnection, session: str, list_cmd, parse_fn):
+
+    """
+    Window info of a session, as listed by list_cmd([session]) and parsed
+    by parse_fn(retcode, stdout, [session]), merged with the launcher state
+    records read in the same round trip
+    """
+
+    separator = '__concert_launcher_state__'
+
+    if _agent(remote) is not None:
+
+        # two pipelined requests
+        (ls_retcode, ls_stdout, _), records = await asyncio.gather(
+            run_cmd(remote, list_cmd([session]), throw_on_failure=False),
+            _agent_call(remote, 'state', req=dict()))
+
+    else:
+
+        retcode, stdout, _ = await run_cmd(remote,
+                                           f'{list_cmd([session])}; echo "{separator} $?"; {_state_cmd(dict())}',
+                                           throw_on_failure=False)
+
+        if retcode != 0:
+            raise RuntimeError(f'failed to read the launcher state (exit code {retcode})')
+
+        ls_stdout, _, state_stdout = stdout.partition(separator)
+
+        ls_retcode, _, records = state_stdout.strip().partition('\n')
+
+        records = json.loads(records)
+
+    ret = parse_fn(int(ls_retcode), ls_stdout.strip(), [session])[session]
+
+    for wname, winfo in ret.items():
+        record = records.get(state_key(session, wname), None)
+        winfo['state'] = record
+        winfo['run_pending'] = record is not None and record['state'] == 'starting'
+        winfo['kill_pending'] = record is not None and record['state'] == 'killing'
+
+    logger.info(f'ls returns: {ret}')
 
     return ret
 
 
+async def signal_process_groups(remote: asyncssh.SSHClientConnection, targets: list):
+
+    """
+    Signal the commands running under the given pane pids with a single remote
+    command, escalating along each target's ladder until it exits (see
+    resources/concert_launcher_signal.py for the target format).
+    Returns a dict name -> {exited, signals, elapsed}.
+    """
+
+    if len(targets) == 0:
+        return {}
+
+    # note: the escalation ladder can take long, this is bounded by the
+    # kill operation budget rather than by the command timeout
+    if _agent(remote) is not None:
+        return await _agent_call(remote, 'signal', timeout=0, targets=targets)
+
+    _, stdout, _ = await run_cmd(remote,
+                                 f'python3 /tmp/concert_launcher_signal.py {shlex.quote(json.dumps(targets))}',
+                                 timeout=0)
+
+    return json.loads(stdout)
+
+
+async def ps_tree(remote: asyncssh.SSHClientConnection, pid: int):
+
+    """
+    Return the process tree below pid as text (see
+    resources/concert_launcher_print_ps_tree.py)
+    """
+
+    if _agent(remote) is not None:
+        return await _agent_call(remote, 'pstree', pid=pid)
+
+    _, stdout, _ = await run_cmd(remote, f'python3 /tmp/concert_launcher_print_ps_tree.py {pid}')
+
+    return stdout
+
+
+async def profile(remote: asyncssh.SSHClientConnection, pid: int, duration=10, rate=100, profiler='auto'):
+
+    """
+    Sample the processes below pid for duration seconds, and return a dict
+    with targets, collapsed stacks, samples and errors (see
+    resources/concert_launcher_profile.py)
+    """
+
+    req = shlex.quote(json.dumps(dict(pid=pid, duration=duration, rate=rate, profiler=profiler)))
+
+    # the command timeout applies on top of the sampling time
+    timeout = _timeout(None, remote)
+
+    _, stdout, _ = await run_cmd(remote, f'python3 /tmp/concert_launcher_profile.py {req}',
+                                 timeout=0 if timeout is None else timeout + duration)
+
+    return json.loads(stdout)
+
+
+async def process_metrics(remote: asyncssh.SSHClientConnection, pids: list):
+
+    """
+    Return a dict pid -> {cpu, rss, num_procs}, summed over the process
+    tree below each pid (cpu in percent, rss in bytes)
+    """
+
+    args = dict(pids=list(pids))
+
+    if _agent(remote) is not None:
+        ret = await _agent_call(remote, 'metrics', **args)
+    else:
+        req = shlex.quote(json.dumps(dict(op='metrics', args=args)))
+        _, stdout, _ = await run_cmd(remote, f'python3 /tmp/concert_launcher_agent.py --once {req}')
+        ret = json.loads(stdout)
+
+    return {int(pid): m for pid, m in ret.items()}
+
+
+async def sched_info(remote: asyncssh.SSHClientConnection, pids: list):
+
+    """
+    Return a dict pid -> list of the scheduling settings (cpus, nice,
+    policy, priority, io_class, io_priority) of every process in the tree
+    below pid
+    """
+
+    args = dict(pids=list(pids))
+
+    if _agent(remote) is not None:
+        ret = await _agent_call(remote, 'sched', **args)
+    else:
+        req = shlex.quote(json.dumps(dict(op='sched', args=args)))
+        _, stdout, _ = await run_cmd(remote, f'python3 /tmp/concert_launcher_agent.py --once {req}')
+        ret = json.loads(stdout)
+
+    return {int(pid): procs for pid, procs in ret.items()}
+
+
+async def cgroup_usage(remote: asyncssh.SSHClientConnection, pids: list):
+
+    """
+    Return a dict pid -> usage and limits of the cgroup of pid (see the
+    agent 'cgroup' request), or None if pid does not exist
+    """
+
+    args = dict(pids=list(pids))
+
+    if _agent(remote) is not None:
+        ret = await _agent_call(remote, 'cgroup', **args)
+    else:
+        req = shlex.quote(json.dumps(dict(op='cgroup', args=args)))
+        _, stdout, _ = await run_cmd(remote, f'python3 /tmp/concert_launcher_agent.py --once {req}')
+        ret = json.loads(stdout)
+
+    return {int(pid): usage for pid, usage in ret.items()}
+
+
+async def container_stats(remote: asyncssh.SSHClientConnection, containers: list):
+
+    """
+    Return a dict container -> state and usage (see container.parse_stats)
+    of the given containers, read with a single command
+    """
+
+    containers = list(dict.fromkeys(containers))
+
+    if len(containers) == 0:
+        return {}
+
+    _, stdout, _ = await run_cmd(remote, container.stats_cmd(containers), throw_on_failure=False)
+
+    return container.parse_stats(stdout, containers)
+
 
 async def tmux_has_session(remote: asyncssh.SSHClientConnection, session: str, window: str):
 
@@ -171,67 +686,132 @@ async def tmux_session_alive(remote: asyncssh.SSHClientConnection, session: str,
 
 tmux_spawn_new_session_lock = asyncio.Lock()
 
-async def tmux_spawn_new_session(remote: asyncssh.SSHClientConnection, session: str, window: str, cmd: str):
+async def tmux_spawn_new_session(remote: asyncssh.SSHClientConnection, session: str, window: str, cmd: str, config_hash: str = None, sched: dict = None, limits: dict = None, container: str = None):
 
     async with tmux_spawn_new_session_lock:
         logger.debug(f'>>>>>>>>>>> BEGIN _tmux_spawn_new_session {session}:{window}')
-        ret = await _tmux_spawn_new_session(remote, session, window, cmd)
+        ret = await tmux_spawn_windows(remote, [dict(session=session, window=window, cmd=cmd, config_hash=config_hash, sched=sched, limits=limits, container=container)])
         logger.debug(f'<<<<<<<<<<< END   _tmux_spawn_new_session {session}:{window}')
-        return ret
 
+    if ret[(session, window)]['status'] == 'exists':
+        raise RuntimeError(f'window {window} exists and is not dead')
 
-async def _tmux_spawn_new_session(remote: asyncssh.SSHClientConnection, session: str, window: str, cmd: str):
 
-    lsdict = await tmux_ls(remote, session)
+def tmux_arg(arg: str) -> str:
+    # tmux takes an argument ending with ';' as a command separator (chained
+    # or not), and turns a trailing '\;' into ';'
+    return arg[:-1] + '\\;' if arg.endswith(';') else arg
 
-    if len(lsdict) == 0:
-        
-        cmds = [
-            f"tmux new-session -d -s {session} -n {window} /tmp/concert_launcher_wrapper.bash {window} '{cmd}'",
-            f"tmux new-session -d -t {session} -s {window}",
-            f"tmux set -t {session} aggressive-resize on",
-            f"tmux set -t {session} mouse on",
-            f"tmux set -t {session} remain-on-exit on",
-            f"tmux set -t {session} history-limit 10000",
-            f"tmux set -t {window} mouse on",
-            f"tmux set -t {window} remain-on-exit on",
-            f"tmux set -t {window} history-limit 10000",
-        ]
-        
-        cmd_union = ' && '.join(cmds)
 
-        await run_cmd(remote, cmd_union)
-        
-    elif window not in lsdict.keys():
-        
-        cmds = [
-            f"tmux new-session -d -t {session} -s {window}",
-            f"tmux set -t {window} mouse on",
-            f"tmux set -t {window} remain-on-exit on",
-            f"tmux set -t {window} history-limit 10000",
-            f"tmux new-window -d -a -t {window} -n {window} /tmp/concert_launcher_wrapper.bash {window} '{cmd}'",
-            f"tmux set -t {window} aggressive-resize on",
-        ]
+def wrapper_cmd(w: dict, tmux=False) -> str:
 
-        cmd_union = ' && '.join(cmds)
+    """
+    Command running the launcher wrapper for a window (see
+    tmux_spawn_windows for the keys of w), as arguments of a tmux command
+    if tmux is set
+    """
 
-        await run_cmd(remote, cmd_union)
-        
-    elif lsdict[window]['dead']:
+    session, window = w['session'], w['window']
 
-        await run_cmd(remote, 
-                f"tmux respawn-window -t {session}:{window} /tmp/concert_launcher_wrapper.bash {window} '{cmd}'") 
+    # scheduling settings and the cgroup are inherited by the whole
+    # pane process tree
+    ret = f"{limits.prefix(w.get('limits', None), session, window)}{sched.prefix(w.get('sched', None))}" \
+          f"/tmp/concert_launcher_wrapper.bash {window} {shlex.quote(tmux_arg(w['cmd']) if tmux else w['cmd'])}"
 
-    else:
+    # commands in a container are run by the wrapper, with a single exec
+    if w.get('container', None) is not None:
+        ret += f" {w['container']} {container.marker_value(session, window)}"
 
-        raise RuntimeError(f'window {window} exists and is not dead')
+    return ret
 
-    cmds = [
-        f"tmux set -t {session}:{window} remain-on-exit on",
-        f"tmux set -t {session}:{window} history-limit 10000",
-    ]
-        
-    cmd_union = ' && '.join(cmds)
 
-    await run_cmd(remote, cmd_union)
-    
+async def tmux_spawn_windows(remote: asyncssh.SSHClientConnection, windows: list):
+
+    """
+    Make sure that the given windows (dicts with keys session, window, cmd
+    and optionally config_hash, sched, limits and container, see sched.py,
+    limits.py and container.py) are running, by creating or respawning them
+    with a single chained tmux invocation. Session options are set once per
+    session. Returns a dict (session, window) -> {status, config_hash},
+    where status is one of 'exists', 'spawned', 'respawned', and config_hash
+    is the hash the window was launched with.
+    """
+
+    sessions = list(dict.fromkeys(w['session'] for w in windows))
+
+    lsdict = await tmux_list_windows(remote, sessions)
+
+    tmux_cmds = []
+
+    ret = dict()
+
+    for w in windows:
+
+        session, window = w['session'], w['window']
+
+        config_hash = w.get('config_hash', None)
+
+        winfo = lsdict[session].get(window, None)
+
+        wrapper = wrapper_cmd(w, tmux=True)
+
+        if winfo is not None and not winfo['dead']:
+
+            ret[(session, window)] = dict(status='exists', config_hash=winfo['config_hash'])
+
+            continue
+
+        elif winfo is not None:
+
+            tmux_cmds += [
+                f"set -wu -t {session}:{window} @concert_oom",
+                f"set -wu -t {session}:{window} @concert_stopped",
+                f"set -wu -t {session}:{window} @concert_exit",
+                f"respawn-window -t {session}:{window} {wrapper}",
+            ]
+
+            ret[(session, window)] = dict(status='respawned', config_hash=config_hash)
+
+        else:
+
+            if len(lsdict[session]) == 0:
+
+                # create session with this window as the first one
+                tmux_cmds += [
+                    f"new-session -d -s {session} -n {window} {wrapper}",
+                    f"set -t {session} aggressive-resize on",
+                    f"set -t {session} mouse on",
+                    f"set -t {session} remain-on-exit on",
+                    f"set -t {session} history-limit 10000",
+                    f"new-session -d -t {session} -s {window}",
+                    f"set -t {window} mouse on",
+                    f"set -t {window} history-limit 10000",
+                ]
+
+            else:
+
+                # each window gets a grouped session named after it
+                tmux_cmds += [
+                    f"new-session -d -t {session} -s {window}",
+                    f"set -t {window} mouse on",
+                    f"set -t {window} history-limit 10000",
+                    f"new-window -d -a -t {window} -n {window} {wrapper}",
+                ]
+
+            # later windows of the same batch go into the existing session
+            lsdict[session][window] = dict(dead=False, config_hash=config_hash)
+
+            ret[(session, window)] = dict(status='spawned', config_hash=config_hash)
+
+        tmux_cmds += [
+            f"set -w -t {session}:{window} remain-on-exit on",
+            f"set -w -t {session}:{window} aggressive-resize on",
+        ]
+
+        # stamp the window with the hash of the config it was launched with
+        if config_hash is not None:
+            tmux_cmds.append(f"set -w -t {session}:{window} @concert_hash {config_hash}")
+
+    await run_tmux_chain(remote, tmux_cmds)
+
+    return ret
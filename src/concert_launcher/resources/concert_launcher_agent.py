@@ -0,0 +1,533 @@
+import asyncio
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+# usage: concert_launcher_agent.py            (serve requests on stdin)
+#        concert_launcher_agent.py --once '<json request>'
+#
+# resident launcher agent: started once per host by the launcher, it
+# answers requests over its stdin/stdout (i.e. a single ssh channel), one
+# json object per line, so that the shell and ssh channel setup is paid
+# once rather than per request
+#
+# requests: {"id": <int>, "op": <str>, "args": {...}}
+# responses:
+#   {"id": <int>, "ok": true, "result": ...}
+#   {"id": <int>, "ok": false, "error": <str>}
+#   {"id": <int>, "line": <str>}     (streamed output, before the result)
+#
+# ops
+#   hello:   -> {pid, version}
+#   exec:    cmd, timeout -> {retcode, stdout, stderr} (run by the user's
+#            shell in a new process group, killed on timeout or cancel)
+#   watch:   cmd -> streams output lines, then {retcode}
+#   cancel:  target (request id) -> stops a running exec/watch
+#   state:   req -> records (see concert_launcher_state.py)
+#   signal:  targets -> see concert_launcher_signal.py
+#   pstree:  pid -> text (see concert_launcher_print_ps_tree.py)
+#   metrics: pids -> dict pid -> {cpu, rss, num_procs} (whole tree)
+#   sched:   pids -> dict pid -> list of {pid, name, cpus, nice, policy,
+#            priority, io_class, io_priority}, one per process of the tree
+#   cgroup:  pids -> dict pid -> {scope, memory_current, memory_max,
+#            memory_high, cpu, cpu_max, pids_current, pids_max, oom_kills}
+#            for the cgroup of each process (memory in bytes, cpu in
+#            percent; None = no limit or not available)
+#
+# requests are served concurrently; the agent exits when its stdin is
+# closed, killing the commands it is running
+
+VERSION = 1
+
+# line limit of streamed output
+LINE_LIMIT = 1 << 20
+
+# the other resources live next to the agent
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class Metrics:
+
+    """
+    Cpu and ram usage of process trees; processes are kept across requests,
+    so that cpu usage is measured since the previous one
+    """
+
+    def __init__(self):
+        self.procs = {}
+
+    def sample(self, pids, interval=0.2):
+
+        import psutil
+
+        trees = {}
+
+        for pid in pids:
+            try:
+                root = psutil.Process(pid)
+                trees[pid] = [root] + root.children(recursive=True)
+            except psutil.NoSuchProcess:
+                trees[pid] = []
+
+        # reuse known processes (cpu_percent needs a previous sample)
+        new = False
+
+        for pid, tree in trees.items():
+            for i, p in enumerate(tree):
+                known = self.procs.get(p.pid, None)
+                if known is not None and known == p:
+                    tree[i] = known
+                else:
+                    self.procs[p.pid] = p
+                    p.cpu_percent()
+                    new = True
+
+        if new and interval > 0:
+            time.sleep(interval)
+
+        ret = {}
+
+        for pid, tree in trees.items():
+            cpu, rss, num = 0.0, 0, 0
+            for p in tree:
+                try:
+                    cpu += p.cpu_percent()
+                    rss += p.memory_info().rss
+                    num += 1
+                except psutil.NoSuchProcess:
+                    pass
+            ret[str(pid)] = {'cpu': cpu, 'rss': rss, 'num_procs': num}
+
+        # forget exited processes
+        for pid in list(self.procs.keys()):
+            if not self.procs[pid].is_running():
+                del self.procs[pid]
+
+        return ret
+
+
+def sched_info(pids):
+
+    import psutil
+
+    policies = {
+        os.SCHED_OTHER: 'other',
+        os.SCHED_BATCH: 'batch',
+        os.SCHED_IDLE: 'idle',
+        os.SCHED_FIFO: 'fifo',
+        os.SCHED_RR: 'rr',
+    }
+
+    io_classes = ['none', 'realtime', 'best-effort', 'idle']
+
+    ret = {}
+
+    for pid in pids:
+
+        procs = []
+
+        try:
+            root = psutil.Process(pid)
+            tree = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            tree = []
+
+        for p in tree:
+            try:
+                io_class, io_priority = p.ionice()
+                procs.append({
+                    'pid': p.pid,
+                    'name': p.name(),
+                    'cpus': sorted(p.cpu_affinity()),
+                    'nice': p.nice(),
+                    'policy': policies.get(os.sched_getscheduler(p.pid), 'unknown'),
+                    'priority': os.sched_getparam(p.pid).sched_priority,
+                    'io_class': io_classes[int(io_class)],
+                    'io_priority': io_priority,
+                })
+            except (psutil.NoSuchProcess, ProcessLookupError):
+                pass
+
+        ret[str(pid)] = procs
+
+    return ret
+
+
+def read_value(path, key=None):
+
+    # single value file (None for 'max' or when missing), or the value of
+    # key in a flat keyed file
+    try:
+        with open(path, 'r') as f:
+            content = f.read()
+    except OSError:
+        return None
+
+    if key is not None:
+        for l in content.split('\n'):
+            tokens = l.split()
+            if len(tokens) == 2 and tokens[0] == key:
+                return int(tokens[1])
+        return None
+
+    tokens = content.split()
+
+    if len(tokens) == 0 or tokens[0] == 'max':
+        return None
+
+    return int(tokens[0])
+
+
+class CgroupUsage:
+
+    """
+    Usage and limits of the cgroup of processes (cgroup v2, or v1 with the
+    memory, cpuacct and pids controllers); the previous cpu usage sample of
+    each cgroup is kept across requests
+    """
+
+    # v1 'no limit' values are huge
+    V1_UNLIMITED = 1 << 60
+
+    def __init__(self):
+        self.cpu_samples = {}
+
+
+    def dirs(self, pid):
+
+        # controller -> cgroup directory ('unified' for v2), plus the
+        # cgroup name ('scope', i.e. the systemd unit if any)
+        ret = {}
+
+        names = []
+
+        with open(f'/proc/{pid}/cgroup', 'r') as f:
+            lines = f.read().split()
+
+        for l in lines:
+            _, controllers, path = l.split(':', 2)
+            names.append(os.path.basename(path) or '/')
+            if controllers == '':
+                root = '/sys/fs/cgroup/unified' if os.path.isdir('/sys/fs/cgroup/unified') else '/sys/fs/cgroup'
+                ret['unified'] = root + path
+            else:
+                for c in controllers.split(','):
+                    ret[c.replace('name=', '')] = f'/sys/fs/cgroup/{controllers.replace("name=", "")}{path}'
+
+        scopes = [n for n in names if n.endswith('.scope')]
+
+        ret['scope'] = scopes[0] if len(scopes) > 0 else names[-1]
+
+        return ret
+
+
+    def cpu_usage(self, dirs):
+
+        # total cpu time in microseconds
+        unified = dirs.get('unified', None)
+
+        if unified is not None and os.path.exists(f'{unified}/cpu.stat'):
+            return read_value(f'{unified}/cpu.stat', 'usage_usec')
+
+        if 'cpuacct' in dirs.keys():
+            usage = read_value(f'{dirs["cpuacct"]}/cpuacct.usage')
+            return None if usage is None else usage // 1000
+
+        return None
+
+
+    def read(self, dirs):
+
+        unified = dirs.get('unified', None)
+
+        ret = {'scope': dirs['scope']}
+
+        if unified is not None and os.path.exists(f'{unified}/memory.current'):
+
+            ret['memory_current'] = read_value(f'{unified}/memory.current')
+            ret['memory_max'] = read_value(f'{unified}/memory.max')
+            ret['memory_high'] = read_value(f'{unified}/memory.high')
+            ret['oom_kills'] = read_value(f'{unified}/memory.events', 'oom_kill') or 0
+
+        else:
+
+            mem = dirs.get('memory', None)
+
+            unlimited = lambda v: None if v is None or v >= self.V1_UNLIMITED else v
+
+            ret['memory_current'] = None if mem is None else read_value(f'{mem}/memory.usage_in_bytes')
+            ret['memory_max'] = None if mem is None else unlimited(read_value(f'{mem}/memory.limit_in_bytes'))
+            ret['memory_high'] = None
+            ret['oom_kills'] = (None if mem is None else read_value(f'{mem}/memory.oom_control', 'oom_kill')) or 0
+
+        if unified is not None and os.path.exists(f'{unified}/cpu.max'):
+            try:
+                with open(f'{unified}/cpu.max', 'r') as f:
+                    quota, period = f.read().split()
+                ret['cpu_max'] = None if quota == 'max' else 100.0 * int(quota) / int(period)
+            except (OSError, ValueError):
+                ret['cpu_max'] = None
+        elif 'cpu' in dirs.keys():
+            quota = read_value(f'{dirs["cpu"]}/cpu.cfs_quota_us')
+            period = read_value(f'{dirs["cpu"]}/cpu.cfs_period_us')
+            ret['cpu_max'] = None if quota is None or quota < 0 or not period else 100.0 * quota / period
+        else:
+            ret['cpu_max'] = None
+
+        pids_dir = unified if unified is not None and os.path.exists(f'{unified}/pids.current') else dirs.get('pids', None)
+
+        ret['pids_current'] = None if pids_dir is None else read_value(f'{pids_dir}/pids.current')
+        ret['pids_max'] = None if pids_dir is None else read_value(f'{pids_dir}/pids.max')
+
+        return ret
+
+
+    def sample(self, pids, interval=0.2):
+
+        dirs = {}
+
+        for pid in pids:
+            try:
+                dirs[pid] = self.dirs(pid)
+            except OSError:
+                dirs[pid] = None
+
+        # cpu usage since the previous sample (take one if there is none)
+        def cpu_sample(d):
+            return time.time(), self.cpu_usage(d)
+
+        keys = {pid: tuple(sorted(d.items())) for pid, d in dirs.items() if d is not None}
+
+        if any(k not in self.cpu_samples.keys() for k in keys.values()) and interval > 0:
+            for pid, k in keys.items():
+                self.cpu_samples.setdefault(k, cpu_sample(dirs[pid]))
+            time.sleep(interval)
+
+        ret = {}
+
+        for pid, d in dirs.items():
+
+            if d is None:
+                ret[str(pid)] = None
+                continue
+
+            usage = self.read(d)
+
+            now, cpu = cpu_sample(d)
+
+            prev_t, prev_cpu = self.cpu_samples.get(keys[pid], (now, cpu))
+
+            if cpu is None or prev_cpu is None or now <= prev_t:
+                usage['cpu'] = None if cpu is None else 0.0
+            else:
+                usage['cpu'] = 100.0 * (cpu - prev_cpu) / 1e6 / (now - prev_t)
+
+            self.cpu_samples[keys[pid]] = (now, cpu)
+
+            ret[str(pid)] = usage
+
+        return ret
+
+
+class Agent:
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.tasks = {}
+        self.metrics = Metrics()
+        self.cgroups = CgroupUsage()
+        self.shell = os.environ.get('SHELL', '/bin/sh')
+
+
+    def send(self, msg):
+        sys.stdout.write(json.dumps(msg) + '\n')
+        sys.stdout.flush()
+
+
+    def handle(self, line):
+
+        try:
+            req = json.loads(line)
+        except ValueError:
+            return
+
+        rid = req.get('id', None)
+
+        op = req.get('op', None)
+
+        args = req.get('args', {})
+
+        if op == 'cancel':
+            task = self.tasks.get(args.get('target', None), None)
+            if task is not None:
+                task.cancel()
+            return
+
+        fn = getattr(self, f'op_{op}', None)
+
+        if fn is None:
+            self.send({'id': rid, 'ok': False, 'error': f'unknown op {op}'})
+            return
+
+        task = asyncio.ensure_future(self.serve(rid, fn, args))
+
+        self.tasks[rid] = task
+
+
+    async def serve(self, rid, fn, args):
+
+        try:
+            result = await fn(rid, **args)
+            self.send({'id': rid, 'ok': True, 'result': result})
+        except asyncio.CancelledError:
+            self.send({'id': rid, 'ok': False, 'error': 'cancelled'})
+        except BaseException as ex:
+            self.send({'id': rid, 'ok': False, 'error': f'{ex.__class__.__name__}: {ex}'})
+        finally:
+            self.tasks.pop(rid, None)
+
+
+    async def in_thread(self, fn, *args):
+        return await self.loop.run_in_executor(None, fn, *args)
+
+
+    async def spawn(self, cmd):
+        return await asyncio.create_subprocess_exec(self.shell, '-c', cmd,
+                                                    stdin=asyncio.subprocess.DEVNULL,
+                                                    stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE,
+                                                    limit=LINE_LIMIT,
+                                                    start_new_session=True)
+
+
+    def kill(self, proc):
+        # the whole command (e.g. a pipeline), not just the shell
+        if proc.returncode is None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+
+    async def op_hello(self, rid):
+        return {'pid': os.getpid(), 'version': VERSION}
+
+
+    async def op_exec(self, rid, cmd, timeout=None):
+
+        proc = await self.spawn(cmd)
+
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+        finally:
+            self.kill(proc)
+
+        return {'retcode': proc.returncode,
+                'stdout': stdout.decode(errors='replace'),
+                'stderr': stderr.decode(errors='replace')}
+
+
+    async def op_watch(self, rid, cmd):
+
+        proc = await self.spawn(cmd)
+
+        try:
+            while True:
+                l = await proc.stdout.readline()
+                if len(l) == 0:
+                    break
+                self.send({'id': rid, 'line': l.decode(errors='replace')})
+            return {'retcode': await proc.wait()}
+        finally:
+            self.kill(proc)
+
+
+    async def op_state(self, rid, req):
+        import concert_launcher_state
+        return await self.in_thread(concert_launcher_state.update, req)
+
+
+    async def op_signal(self, rid, targets):
+        import concert_launcher_signal
+        return await self.in_thread(concert_launcher_signal.signal_targets, targets)
+
+
+    async def op_pstree(self, rid, pid):
+        import concert_launcher_print_ps_tree
+        return await self.in_thread(concert_launcher_print_ps_tree.ps_tree, int(pid))
+
+
+    async def op_metrics(self, rid, pids):
+        return await self.in_thread(self.metrics.sample, [int(p) for p in pids])
+
+
+    async def op_sched(self, rid, pids):
+        return await self.in_thread(sched_info, [int(p) for p in pids])
+
+
+    async def op_cgroup(self, rid, pids):
+        return await self.in_thread(self.cgroups.sample, [int(p) for p in pids])
+
+
+    def shutdown(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+
+
+def stop(done):
+    if not done.done():
+        done.set_result(True)
+
+
+def read_stdin(loop, agent, done):
+
+    # blocking reads, in a thread
+    for line in sys.stdin:
+        loop.call_soon_threadsafe(agent.handle, line)
+
+    loop.call_soon_threadsafe(stop, done)
+
+
+def serve():
+
+    loop = asyncio.get_event_loop()
+
+    agent = Agent(loop)
+
+    done = loop.create_future()
+
+    loop.add_signal_handler(signal.SIGHUP, stop, done)
+
+    threading.Thread(target=read_stdin, args=(loop, agent, done), daemon=True).start()
+
+    loop.run_until_complete(done)
+
+    # give cancelled requests the chance to kill their commands
+    agent.shutdown()
+
+    pending = list(agent.tasks.values())
+
+    if len(pending) > 0:
+        loop.run_until_complete(asyncio.wait(pending, timeout=1.0))
+
+
+def once(req):
+
+    loop = asyncio.get_event_loop()
+
+    agent = Agent(loop)
+
+    fn = getattr(agent, f'op_{req["op"]}')
+
+    print(json.dumps(loop.run_until_complete(fn(0, **req.get('args', {})))))
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 2 and sys.argv[1] == '--once':
+        once(json.loads(sys.argv[2]))
+    else:
+        serve()
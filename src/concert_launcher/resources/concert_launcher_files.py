@@ -0,0 +1,102 @@
+import base64
+import hashlib
+import json
+import os
+import sys
+import zlib
+
+# usage: concert_launcher_files.py '<json list of {"dst": <path>, "hash": <tree hash>, "paths": <paths>}>'
+#
+# for every destination (a file or a directory, ~ is expanded), compute the
+# tree hash of the files listed in paths (see tree_hash; other files found
+# at dst are not read) and compare it with the given one; paths is the json
+# list of the relative paths of the source ('' for a single file), zlib
+# compressed and base64 encoded (see encode_paths). Prints a json list
+# (same order) of dicts with keys
+#   dst:   the expanded destination path
+#   match: whether the hashes are equal
+#   files: (only if not matching) dict relative path -> sha1 of the listed
+#          files found at dst
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def encode_paths(paths):
+    # note: must match files.encode_paths() on the launcher side
+    return base64.b64encode(zlib.compress(json.dumps(sorted(paths)).encode())).decode()
+
+
+def decode_paths(data):
+    return json.loads(zlib.decompress(base64.b64decode(data)))
+
+
+def manifest(path, paths=None):
+
+    # only the given relative paths, if any
+    if paths is not None:
+        ret = {}
+        for rel in paths:
+            full = os.path.join(path, rel) if rel != '' else path
+            try:
+                if os.path.isfile(full):
+                    ret[rel] = file_hash(full)
+            except OSError:
+                continue
+        return ret
+
+    if os.path.isfile(path):
+        return {'': file_hash(path)}
+
+    ret = {}
+
+    for root, _, files in os.walk(path):
+        for name in files:
+            full = os.path.join(root, name)
+            if not os.path.isfile(full):
+                continue
+            try:
+                ret[os.path.relpath(full, path)] = file_hash(full)
+            except OSError:
+                continue
+
+    return ret
+
+
+def tree_hash(files):
+    # note: must match files.tree_hash() on the launcher side
+    h = hashlib.sha1()
+    for rel in sorted(files.keys()):
+        h.update(f'{rel}\0{files[rel]}\n'.encode())
+    return h.hexdigest()
+
+
+def check(entries):
+
+    ret = []
+
+    for entry in entries:
+
+        dst = os.path.expanduser(entry['dst'])
+
+        files = manifest(dst, decode_paths(entry['paths'])) if os.path.exists(dst) else {}
+
+        match = len(files) > 0 and tree_hash(files) == entry['hash']
+
+        res = dict(dst=dst, match=match)
+
+        if not match:
+            res['files'] = files
+
+        ret.append(res)
+
+    return ret
+
+
+if __name__ == '__main__':
+    print(json.dumps(check(json.loads(sys.argv[1]))))
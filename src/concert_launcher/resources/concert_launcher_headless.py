@@ -0,0 +1,184 @@
+import json
+import os
+import subprocess
+import sys
+
+# usage: concert_launcher_headless.py '<json request>'
+#
+# runs the launcher wrapper of managed processes without tmux (the headless
+# backend, see backend.py): each window is a detached wrapper (own session,
+# no tty, output in /tmp/<window>.stdout as with tmux), whose records live
+# in STATE_DIR/<session>/<window>/ (private to the user)
+#   pid:     wrapper pid and start time (to detect pid reuse)
+#   hash:    config hash the window was launched with
+#   exit:    exit code, oom: oom kills (written by the wrapper)
+#   stopped: present if killed on purpose
+#
+# requests (the output is printed as json):
+#   {"op": "ls", "sessions": [...]}      -> session -> window -> info
+#   {"op": "spawn", "windows": [...]}    -> "session:window" -> {status, config_hash}
+#       (windows are dicts with keys session, window, cmd, config_hash)
+#   {"op": "stop", "windows": [[session, window], ...]}
+
+STATE_DIR = f'/tmp/concert_launcher_headless_{os.getuid()}'
+
+
+def window_dir(session, window):
+    return os.path.join(STATE_DIR, session, window)
+
+
+def read(d, name, default=None):
+    try:
+        with open(os.path.join(d, name), 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def write(d, name, value):
+    tmp = os.path.join(d, f'.{name}.{os.getpid()}')
+    with open(tmp, 'w') as f:
+        f.write(f'{value}\n')
+    os.replace(tmp, os.path.join(d, name))
+
+
+def remove(d, name):
+    try:
+        os.remove(os.path.join(d, name))
+    except FileNotFoundError:
+        pass
+
+
+def start_time(pid):
+
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            stat = f.read()
+    except OSError:
+        return None
+
+    # fields after the command name: state ppid ... (starttime is the 20th)
+    fields = stat[stat.rfind(')') + 2:].split()
+
+    if fields[0] == 'Z':
+        return None
+
+    return fields[19]
+
+
+def info(session, window):
+
+    d = window_dir(session, window)
+
+    pid = read(d, 'pid')
+
+    if pid is None:
+        return None
+
+    pid, _, stime = pid.partition(' ')
+
+    exit_code = read(d, 'exit')
+
+    alive = exit_code is None and start_time(pid) == stime
+
+    return {
+        'pid': int(pid),
+        'dead': not alive,
+        'exitstatus': 0 if exit_code is None else int(exit_code),
+        'exitstatus_known': exit_code is not None,
+        'config_hash': read(d, 'hash'),
+        'oom_kills': int(read(d, 'oom', '0')),
+        'stopped': read(d, 'stopped') is not None,
+    }
+
+
+def ls(sessions):
+
+    ret = {}
+
+    for session in sessions:
+
+        ret[session] = {}
+
+        try:
+            windows = os.listdir(os.path.join(STATE_DIR, session))
+        except FileNotFoundError:
+            continue
+
+        for window in windows:
+            winfo = info(session, window)
+            if winfo is not None:
+                ret[session][window] = winfo
+
+    return ret
+
+
+def spawn(windows):
+
+    ret = {}
+
+    for w in windows:
+
+        session, window = w['session'], w['window']
+
+        key = f'{session}:{window}'
+
+        winfo = info(session, window)
+
+        if winfo is not None and not winfo['dead']:
+            ret[key] = {'status': 'exists', 'config_hash': winfo['config_hash']}
+            continue
+
+        d = window_dir(session, window)
+
+        os.makedirs(STATE_DIR, mode=0o700, exist_ok=True)
+        os.makedirs(d, exist_ok=True)
+
+        for name in ('pid', 'exit', 'oom', 'stopped', 'hash'):
+            remove(d, name)
+
+        if w.get('config_hash', None) is not None:
+            write(d, 'hash', w['config_hash'])
+
+        # the wrapper writes its records to the window dir
+        env = dict(os.environ, CONCERT_LAUNCHER_STATE_DIR=d)
+
+        proc = subprocess.Popen(['bash', '-c', w['cmd']],
+                                stdin=subprocess.DEVNULL,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL,
+                                start_new_session=True,
+                                cwd=os.path.expanduser('~'),
+                                env=env)
+
+        write(d, 'pid', f'{proc.pid} {start_time(proc.pid)}')
+
+        ret[key] = {'status': 'spawned' if winfo is None else 'respawned',
+                    'config_hash': w.get('config_hash', None)}
+
+    return ret
+
+
+def stop(windows):
+
+    for session, window in windows:
+        d = window_dir(session, window)
+        if os.path.isdir(d):
+            write(d, 'stopped', 1)
+
+    return {}
+
+
+def main():
+
+    req = json.loads(sys.argv[1])
+
+    ops = {'ls': lambda: ls(req['sessions']),
+           'spawn': lambda: spawn(req['windows']),
+           'stop': lambda: stop(req['windows'])}
+
+    print(json.dumps(ops[req['op']]()))
+
+
+if __name__ == '__main__':
+    main()
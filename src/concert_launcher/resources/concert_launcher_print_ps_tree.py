@@ -3,6 +3,12 @@ import sys
 import os
 import time
 
+# usage: concert_launcher_print_ps_tree.py <pid>
+#
+# prints the process tree below pid, with cpu and ram usage (the resident
+# agent imports this module, and calls ps_tree(): processes are then kept
+# across calls, so that cpu usage is measured since the previous call)
+
 process_dict = {}
 
 def get_process_info(pid):
@@ -19,27 +25,53 @@ def get_process_info(pid):
         cpu_usage = process.cpu_percent()
         ram_usage = process.memory_info().rss / (1024 * 1024)  # Convert to MB
         return ppid, cmdline, cpu_usage, ram_usage
-    except psutil.NoSuchProcess as e:
+    except (psutil.NoSuchProcess, IndexError) as e:
         return None
 
-def process_tree_info(pid, level=0, print_to_screen=False):
+def process_tree_info(pid, level=0, lines=None):
 
     min_level = 2
 
-    info = get_process_info(pid)
-    
+    try:
+        info = get_process_info(pid)
+    except psutil.NoSuchProcess:
+        info = None
+
     if info is not None:
         
         ppid, cmdline, cpu_usage, ram_usage = info
-        
-        if print_to_screen and level >= min_level:
-            print(f"{' ' * ((level-min_level) * 2)}PID: {pid} ({' '.join(cmdline[:2])} ...)  CPU: {cpu_usage}  RAM: {ram_usage:.2f} MB")
 
-        for child in psutil.Process(pid).children():
-            process_tree_info(child.pid, level + 1, print_to_screen=print_to_screen)
+        if lines is not None and level >= min_level:
+            lines.append(f"{' ' * ((level-min_level) * 2)}PID: {pid} ({' '.join(cmdline[:2])} ...)  CPU: {cpu_usage}  RAM: {ram_usage:.2f} MB")
+
+        try:
+            children = psutil.Process(pid).children()
+        except psutil.NoSuchProcess:
+            children = []
+
+        for child in children:
+            process_tree_info(child.pid, level + 1, lines=lines)
+
+def ps_tree(pid, interval=0.2):
+
+    # forget exited processes
+    for p in list(process_dict.keys()):
+        if not process_dict[p].is_running():
+            del process_dict[p]
+
+    # cpu usage needs two samples: sample new processes first
+    known = set(process_dict.keys())
+
+    process_tree_info(pid)
+
+    if set(process_dict.keys()) != known:
+        time.sleep(interval)
+
+    lines = []
+
+    process_tree_info(pid, lines=lines)
+
+    return '\n'.join(lines)
 
-# Replace 'your_pid_here' with the actual PID you want to start the tree from
-starting_pid = int(sys.argv[1])
-process_tree_info(starting_pid)
-time.sleep(0.2)
-process_tree_info(starting_pid, print_to_screen=True)
\ No newline at end of file
+if __name__ == '__main__':
+    print(ps_tree(int(sys.argv[1])))
@@ -0,0 +1,232 @@
+import collections
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+import psutil
+
+# usage: concert_launcher_profile.py '{"pid": <pane pid>, "duration": 10, "rate": 100, "profiler": "auto"}'
+#
+# samples the processes below a tmux pane for duration seconds, with py-spy
+# (python processes) or perf (native ones), profiler being auto, py-spy or
+# perf; prints a json dict with the profiled targets, the collapsed stacks
+# ("frame;frame;frame count" lines, flamegraph ready, the first frame being
+# the process) and the errors met
+
+# the launcher wrapper chain and shells are not profiled
+skipped = {'bash', 'sh', 'dash', 'zsh', 'script', 'ts'}
+
+
+def is_python(proc: psutil.Process):
+    try:
+        names = [proc.name()] + proc.cmdline()[:1]
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return False
+    return any(re.fullmatch(r'python[0-9.]*', os.path.basename(n)) for n in names)
+
+
+def targets(pid, min_level=2):
+
+    """
+    Processes below the pane (the wrapper, script and the interactive shell
+    are levels 0 to 2), shells excluded unless there is nothing else
+    """
+
+    try:
+        root = psutil.Process(pid)
+    except psutil.NoSuchProcess:
+        return []
+
+    procs = []
+
+    def visit(proc, level):
+        if level >= min_level:
+            procs.append(proc)
+        try:
+            children = proc.children()
+        except psutil.NoSuchProcess:
+            children = []
+        for child in children:
+            visit(child, level + 1)
+
+    visit(root, 0)
+
+    def name(proc):
+        try:
+            return proc.name()
+        except psutil.NoSuchProcess:
+            return None
+
+    ret = [p for p in procs if name(p) is not None and name(p) not in skipped]
+
+    return ret if len(ret) > 0 else procs
+
+
+def label(proc):
+    # root frame of the stacks of a process
+    try:
+        return f'{proc.name()} ({proc.pid})'
+    except psutil.NoSuchProcess:
+        return f'? ({proc.pid})'
+
+
+def run_py_spy(procs, duration, rate, stacks, errors):
+
+    # one (non blocking) sampler per process, in parallel
+    runs = []
+
+    for proc in procs:
+        fd, out = tempfile.mkstemp(prefix='concert_launcher_py_spy_')
+        os.close(fd)
+        # note: py-spy takes whole seconds
+        cmd = ['py-spy', 'record', '--pid', str(proc.pid), '--duration', str(max(1, math.ceil(duration))),
+               '--rate', str(rate), '--format', 'raw', '--nonblocking', '--output', out]
+        runs.append((proc, label(proc), out, subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)))
+
+    for proc, root, out, p in runs:
+
+        _, stderr = p.communicate()
+
+        try:
+            if p.returncode != 0:
+                errors.append(f'py-spy on pid {proc.pid} returned {p.returncode}: {stderr.decode(errors="replace").strip()[-500:]}')
+                continue
+            with open(out) as f:
+                for l in f:
+                    stack, _, count = l.rstrip('\n').rpartition(' ')
+                    if stack:
+                        stacks[f'{root};{stack}'] += int(count)
+        finally:
+            os.remove(out)
+
+
+def collapse_perf(text, stacks):
+
+    """
+    Fold the output of perf script (a header line per sample, followed by
+    one indented line per frame, leaf first) into stacks
+    """
+
+    header = None
+    frames = []
+
+    def flush():
+        if header is not None:
+            stacks[';'.join([header] + frames[::-1])] += 1
+
+    for l in text.split('\n'):
+
+        if len(l.strip()) == 0:
+            flush()
+            header = None
+            frames = []
+            continue
+
+        if not l[0].isspace():
+            m = re.match(r'^(.*?)\s+(\d+)(?:/\d+)?\b', l)
+            header = f'{m.group(1).strip()} ({m.group(2)})' if m else l.split()[0]
+            continue
+
+        # address, symbol (+offset) and (dso)
+        tokens = l.strip().split(' ', 1)
+        sym = tokens[1] if len(tokens) > 1 else tokens[0]
+        sym, _, dso = sym.rpartition(' (')
+        sym = re.sub(r'\+0x[0-9a-f]+$', '', sym)
+        if sym in ('', '[unknown]'):
+            sym = f'[{os.path.basename(dso.rstrip(")"))}]'
+        frames.append(sym.replace(';', ':'))
+
+    flush()
+
+
+def run_perf(procs, duration, rate, stacks, errors):
+
+    fd, out = tempfile.mkstemp(prefix='concert_launcher_perf_')
+    os.close(fd)
+
+    try:
+
+        pids = ','.join(str(p.pid) for p in procs)
+
+        rec = subprocess.run(['perf', 'record', '-q', '-F', str(rate), '-g', '-p', pids, '-o', out,
+                              '--', 'sleep', str(duration)],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+        if rec.returncode != 0:
+            errors.append(f'perf record returned {rec.returncode}: {rec.stderr.decode(errors="replace").strip()[-500:]}')
+            return
+
+        script = subprocess.run(['perf', 'script', '-i', out, '-F', 'comm,pid,ip,sym,dso'],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        if script.returncode != 0:
+            errors.append(f'perf script returned {script.returncode}: {script.stderr.decode(errors="replace").strip()[-500:]}')
+            return
+
+        collapse_perf(script.stdout.decode(errors='replace'), stacks)
+
+    finally:
+        os.remove(out)
+
+
+def profile(pid, duration=10, rate=100, profiler='auto'):
+
+    procs = targets(pid)
+
+    errors = []
+
+    if len(procs) == 0:
+        errors.append(f'no process below pid {pid}')
+
+    # choose the profiler of every process
+    by_profiler = {'py-spy': [], 'perf': []}
+
+    for proc in procs:
+        if profiler == 'auto':
+            by_profiler['py-spy' if is_python(proc) else 'perf'].append(proc)
+        else:
+            by_profiler[profiler].append(proc)
+
+    for name in list(by_profiler.keys()):
+        if len(by_profiler[name]) > 0 and shutil.which(name) is None:
+            errors.append(f'{name} not found (needed for pids {", ".join(str(p.pid) for p in by_profiler[name])})')
+            by_profiler[name] = []
+
+    # both profilers run for the same time window (each with its own stacks)
+    py_stacks, perf_stacks = collections.Counter(), collections.Counter()
+
+    runners = []
+
+    if len(by_profiler['py-spy']) > 0:
+        runners.append(lambda: run_py_spy(by_profiler['py-spy'], duration, rate, py_stacks, errors))
+
+    if len(by_profiler['perf']) > 0:
+        runners.append(lambda: run_perf(by_profiler['perf'], duration, rate, perf_stacks, errors))
+
+    if len(runners) == 2:
+        threads = [threading.Thread(target=r) for r in runners]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    elif len(runners) == 1:
+        runners[0]()
+
+    stacks = py_stacks + perf_stacks
+
+    return {
+        'targets': [dict(pid=p.pid, name=label(p), profiler=name) for name, plist in by_profiler.items() for p in plist],
+        'collapsed': '\n'.join(f'{s} {c}' for s, c in stacks.items()),
+        'samples': sum(stacks.values()),
+        'errors': errors,
+    }
+
+
+if __name__ == '__main__':
+    print(json.dumps(profile(**json.loads(sys.argv[1]))))
@@ -0,0 +1,240 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+# usage: concert_launcher_signal.py '<json target list>'
+#
+# each target is a dict with keys
+#   name:   process name (used as key in the output)
+#   pid:    pane pid (i.e. the launcher wrapper)
+#   ladder: list of [signal name, grace period in seconds]
+#   final:  signal name sent once the ladder is exhausted (or null)
+#   container, marker: for commands run in a container, the container and
+#           the value of the CONCERT_LAUNCHER_WINDOW variable their exec is
+#           tagged with (optional)
+#
+# every process group running below the pane pid (i.e. the actual command,
+# which runs on its own pty) is signalled; groups showing up later (e.g. a
+# kill right after the spawn, before the command started) get the current
+# signal as well. The script returns as soon as all targets exited, and
+# prints a json dict name -> {exited, signals, elapsed}
+# (the resident agent imports this module, and calls signal_targets())
+
+POLL_PERIOD = 0.05
+
+# time to wait for the wrapper to exit once the command is gone
+WRAPPER_EXIT_TIMEOUT = 3.0
+
+# time to wait for the command to show up below a wrapper that did not
+# start it yet
+STARTUP_TIMEOUT = 10.0
+
+# time to wait after the final signal
+FINAL_TIMEOUT = 2.0
+
+# time allowed to a docker exec signalling a container
+DOCKER_TIMEOUT = 5.0
+
+# signals the processes of a container carrying the exec marker (i.e. the
+# exec'd command and its children); args are marker=value and signal
+CONTAINER_KILL_SCRIPT = (
+    'for d in /proc/[0-9]*; do '
+    'tr \'\\000\' \'\\n\' < $d/environ 2>/dev/null | grep -qxF "$1" && kill -s "$2" "${d#/proc/}" 2>/dev/null; '
+    'done; true'
+)
+
+
+def read_proc_table():
+
+    # pid -> (ppid, pgid)
+    table = {}
+
+    for d in os.listdir('/proc'):
+
+        if not d.isdigit():
+            continue
+
+        try:
+            with open(f'/proc/{d}/stat', 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+
+        # fields after the command name: state ppid pgrp ...
+        fields = stat[stat.rfind(')') + 2:].split()
+
+        # skip zombies, they are gone already
+        if fields[0] == 'Z':
+            continue
+
+        table[int(d)] = (int(fields[1]), int(fields[2]))
+
+    return table
+
+
+def get_process_groups(table, root):
+
+    if root not in table.keys():
+        return set()
+
+    children = {}
+
+    for pid, (ppid, _) in table.items():
+        children.setdefault(ppid, []).append(pid)
+
+    root_pgid = table[root][1]
+
+    groups = set()
+
+    stack = list(children.get(root, []))
+
+    while len(stack) > 0:
+        pid = stack.pop()
+        pgid = table[pid][1]
+        if pgid != root_pgid:
+            groups.add(pgid)
+        stack.extend(children.get(pid, []))
+
+    return groups
+
+
+def send(groups, signame):
+
+    for pgid in groups:
+        try:
+            os.killpg(pgid, signal.Signals[signame])
+        except ProcessLookupError:
+            pass
+
+
+def send_container(container, marker, signame):
+
+    # note: killing the docker client would leave the exec running
+    try:
+        subprocess.run(['docker', 'exec', container, 'sh', '-c', CONTAINER_KILL_SCRIPT,
+                        'sh', f'CONCERT_LAUNCHER_WINDOW={marker}', signame[3:]],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       timeout=DOCKER_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        pass
+
+
+class Target:
+
+    def __init__(self, t):
+        self.name = t['name']
+        self.pid = int(t['pid'])
+        self.ladder = [(s, float(g)) for s, g in t.get('ladder', [])]
+        self.final = t.get('final', None)
+        self.container = t.get('container', None)
+        self.marker = t.get('marker', None)
+        self.signals = []
+        self.exited = False
+        self.elapsed = 0.0
+        self.step = -1
+        self.deadline = 0.0
+        # groups that got the current signal
+        self.sent = set()
+        # a command was found below the wrapper
+        self.started = False
+
+    def signame(self):
+        if self.step < len(self.ladder):
+            return self.ladder[self.step][0]
+        return self.final
+
+    def send(self, groups):
+
+        signame = self.signame()
+
+        if self.container is None:
+            send(groups, signame)
+        else:
+            send_container(self.container, self.marker, signame)
+            # the docker client goes away with the exec, or on the final signal
+            if self.step >= len(self.ladder):
+                send(groups, signame)
+
+        self.sent.update(groups)
+
+    def escalate(self, groups, now):
+
+        self.step += 1
+
+        if self.step < len(self.ladder):
+            signame, grace = self.ladder[self.step]
+        elif self.step == len(self.ladder) and self.final is not None:
+            signame, grace = self.final, FINAL_TIMEOUT
+        else:
+            return False
+
+        self.sent = set()
+        self.send(groups)
+
+        self.signals.append(signame)
+        self.deadline = now + grace
+
+        return True
+
+
+def signal_targets(targets):
+
+    targets = [Target(t) for t in targets]
+
+    t0 = time.time()
+
+    pending = list(targets)
+
+    wrapper_deadline = {}
+
+    while len(pending) > 0:
+
+        now = time.time()
+
+        table = read_proc_table()
+
+        for t in list(pending):
+
+            groups = get_process_groups(table, t.pid)
+
+            if t.pid not in table.keys():
+                t.exited = True
+            elif len(groups) == 0:
+                # command is gone (wait for the wrapper to exit), or not
+                # started yet
+                timeout = WRAPPER_EXIT_TIMEOUT if t.started else STARTUP_TIMEOUT
+                wrapper_deadline.setdefault(t.name, now + timeout)
+                t.exited = now > wrapper_deadline[t.name]
+            else:
+                t.started = True
+                wrapper_deadline.pop(t.name, None)
+                if t.step < 0 or now > t.deadline:
+                    if not t.escalate(groups, now):
+                        # nothing left to send
+                        pending.remove(t)
+                        t.elapsed = now - t0
+                elif len(groups - t.sent) > 0:
+                    # new groups get the signal the others got
+                    t.send(groups - t.sent)
+                continue
+
+            if t.exited:
+                pending.remove(t)
+                t.elapsed = now - t0
+
+        if len(pending) > 0:
+            time.sleep(POLL_PERIOD)
+
+    return {t.name: {'exited': t.exited, 'signals': t.signals, 'elapsed': t.elapsed} for t in targets}
+
+
+def main():
+    print(json.dumps(signal_targets(json.loads(sys.argv[1]))))
+
+
+if __name__ == '__main__':
+    main()
+
@@ -0,0 +1,118 @@
+import fcntl
+import json
+import os
+import sys
+import time
+
+# usage: concert_launcher_state.py '<json request>'
+#
+# maintains the launcher state records of this host in a single json file,
+# as a dict key ('session:window') -> record with keys
+#   state:       e.g. 'starting', 'killing'
+#   owner_host:  host of the launcher owning the record
+#   owner_pid:   pid of the launcher owning the record
+#   started:     time the record was created (this host's clock)
+#   config_hash: config hash of the process (or null)
+#   lease:       lease duration in seconds
+#   expires:     time the lease expires (this host's clock)
+#
+# request keys (all optional)
+#   owner:   'host:pid' of the caller
+#   set:     dict key -> record (state, config_hash, lease) to be written
+#   renew:   list of keys whose lease is extended (own records only)
+#   release: list of keys to be dropped (own records only)
+#
+# records with an expired lease are dropped on every call; the file is
+# updated under a lock and replaced atomically, and the resulting records
+# are printed as json (the resident agent imports this module, and calls
+# update() in process)
+
+STATE_DIR = f'/tmp/concert_launcher_{os.getuid()}'
+
+STATE_FILE = os.path.join(STATE_DIR, 'state.json')
+
+LOCK_FILE = os.path.join(STATE_DIR, 'state.lock')
+
+
+def load():
+
+    try:
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save(records):
+
+    tmp = f'{STATE_FILE}.{os.getpid()}'
+
+    with open(tmp, 'w') as f:
+        json.dump(records, f)
+
+    os.replace(tmp, STATE_FILE)
+
+
+def is_owner(record, owner):
+    return owner is not None and f'{record["owner_host"]}:{record["owner_pid"]}' == owner
+
+
+def update(req):
+
+    owner = req.get('owner', None)
+
+    os.makedirs(STATE_DIR, mode=0o700, exist_ok=True)
+
+    with open(LOCK_FILE, 'w') as lock:
+
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        now = time.time()
+
+        records = load()
+
+        # drop stale leases
+        changed = False
+
+        for key in list(records.keys()):
+            if records[key]['expires'] < now:
+                del records[key]
+                changed = True
+
+        for key in req.get('release', []):
+            if key in records.keys() and is_owner(records[key], owner):
+                del records[key]
+                changed = True
+
+        for key in req.get('renew', []):
+            if key in records.keys() and is_owner(records[key], owner):
+                records[key]['expires'] = now + records[key]['lease']
+                changed = True
+
+        for key, r in req.get('set', {}).items():
+            owner_host, owner_pid = owner.rsplit(':', 1)
+            lease = float(r.get('lease', 30.0))
+            records[key] = {
+                'state': r['state'],
+                'owner_host': owner_host,
+                'owner_pid': int(owner_pid),
+                'started': now,
+                'config_hash': r.get('config_hash', None),
+                'lease': lease,
+                'expires': now + lease,
+            }
+            changed = True
+
+        if changed:
+            save(records)
+
+    return records
+
+
+def main():
+    req = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    print(json.dumps(update(req)))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,25 +3,83 @@
 NAME=$1
 CMD=$2
 
+# container to run the command in (optional), and the value of the marker
+# variable its exec is tagged with (see container.py)
+CONTAINER=$3
+MARKER=$4
+
 if ! command -v ts &> /dev/null
 then
     echo "ts could not be found"
+    TS=
 else
-    CMD="$CMD | ts '[%Y-%m-%d %H:%M:%.S]'"
+    TS="ts '[%Y-%m-%d %H:%M:%.S]'"
+fi
+
+if [ -n "$CONTAINER" ]; then
+    # a single exec, with its own interactive shell (no host shell), the
+    # timestamps being added on the host
+    RUN="docker exec -it -e CONCERT_LAUNCHER_WINDOW=$MARKER -e PYTHONUNBUFFERED=1 $CONTAINER bash -ic \"$CMD\""
+    [ -n "$TS" ] && RUN="$RUN | $TS"
+else
+    [ -n "$TS" ] && CMD="$CMD | $TS"
+    RUN="bash -ic \"$CMD\""
 fi
 
 STDOUT_FILE=/tmp/$NAME.stdout
 
+# records of the process: window options with tmux, files in the window
+# state dir with the headless backend (see backend.py)
+set_record() {
+    if [ -n "$CONCERT_LAUNCHER_STATE_DIR" ]; then
+        echo $2 > "$CONCERT_LAUNCHER_STATE_DIR/$1"
+    else
+        tmux set -w -t "$TMUX_PANE" @concert_$1 $2
+    fi
+}
+
+# oom kills in the cgroup of this process, if it runs in its own scope
+# (see limits.py), for cgroup v2 and v1
+oom_kills() {
+    local line path file
+    for line in $(cat /proc/self/cgroup); do
+        path=${line#*:*:}
+        case "$path" in
+            */concert_launcher-*.scope) ;;
+            *) continue ;;
+        esac
+        case "$line" in
+            0::*) file=/sys/fs/cgroup$path/memory.events ;;
+            *:memory:*) file=/sys/fs/cgroup/memory$path/memory.oom_control ;;
+            *) continue ;;
+        esac
+        if [ -r $file ]; then
+            awk '/^oom_kill /{print $2; exit}' $file
+            return
+        fi
+    done
+}
+
 echo "starting process $NAME ($CMD)" >> $STDOUT_FILE
 
 export PYTHONUNBUFFERED=1
 
-script --append --flush --return --command "bash -ic \"$CMD\"" $STDOUT_FILE
+script --append --flush --return --command "$RUN" $STDOUT_FILE
 
 RET=$?
 
 echo "process exited with code $RET" >> $STDOUT_FILE
 
+OOM_KILLS=$(oom_kills)
+
+if [ "${OOM_KILLS:-0}" -gt 0 ]; then
+    echo "process was killed by the oom killer ($OOM_KILLS kills)" >> $STDOUT_FILE
+    set_record oom $OOM_KILLS
+fi
+
+# tmux does not always report the exit status of respawned panes
+set_record exit $RET
+
 sleep 1
 
 exit $RET
\ No newline at end of file
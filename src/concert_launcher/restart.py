@@ -0,0 +1,98 @@
+from typing import List, Dict
+
+# restart policy of a process (the 'restart' field, defaults can also go
+# under context.restart), used by the supervisor, e.g.
+#
+#   restart:
+#     policy: on-failure   # never (default), on-failure, always
+#     max_restarts: 5      # restarts within window seconds before the
+#     window: 60           # process is declared crash looping
+#     backoff: 1.0         # delay before the 2nd restart within window,
+#     backoff_max: 30      # doubled at every further one, up to backoff_max
+#     cascade: false       # restart the dependants too
+
+fields = ['policy', 'max_restarts', 'window', 'backoff', 'backoff_max', 'cascade']
+
+policies = ['never', 'on-failure', 'always']
+
+defaults = {
+    'policy': 'never',
+    'max_restarts': 5,
+    'window': 60.0,
+    'backoff': 1.0,
+    'backoff_max': 30.0,
+    'cascade': False,
+}
+
+
+class RestartPolicy:
+
+    def __init__(self, policy='never', max_restarts=5, window=60.0,
+                 backoff=1.0, backoff_max=30.0, cascade=False):
+        self.policy = policy
+        self.max_restarts = max_restarts
+        self.window = float(window)
+        self.backoff = float(backoff)
+        self.backoff_max = float(backoff_max)
+        self.cascade = cascade
+
+
+    @staticmethod
+    def from_cfg(cfg: Dict, process: str):
+        # process settings override context ones
+        restart_cfg = dict(defaults)
+        restart_cfg.update(cfg['context'].get('restart', {}))
+        restart_cfg.update(cfg[process].get('restart', {}))
+        return RestartPolicy(**restart_cfg)
+
+
+    def should_restart(self, exitstatus) -> bool:
+        if self.policy == 'always':
+            return True
+        if self.policy == 'on-failure':
+            return exitstatus != 0
+        return False
+
+
+    def delay(self, num_restarts) -> float:
+        # delay before a restart, given the number of restarts within the
+        # window (the first one is immediate)
+        if num_restarts == 0:
+            return 0.0
+        return min(self.backoff * 2 ** (num_restarts - 1), self.backoff_max)
+
+
+    def __repr__(self):
+        return f'RestartPolicy({", ".join(f"{k}={getattr(self, k)}" for k in fields)})'
+
+
+def validate(restart: Dict) -> List[str]:
+
+    """
+    Return the list of errors in a restart field
+    """
+
+    if not isinstance(restart, dict):
+        return ['restart must be a mapping']
+
+    errors = []
+
+    for k in restart.keys():
+        if k not in fields:
+            errors.append(f'unknown restart field {k}')
+
+    if restart.get('policy', 'never') not in policies:
+        errors.append(f'unknown restart.policy {restart["policy"]} (one of {", ".join(policies)})')
+
+    if 'max_restarts' in restart.keys() and \
+            (not isinstance(restart['max_restarts'], int) or restart['max_restarts'] < 1):
+        errors.append('restart.max_restarts must be a positive integer')
+
+    for k in ('window', 'backoff', 'backoff_max'):
+        if k in restart.keys() and (not isinstance(restart[k], (int, float)) or restart[k] < 0):
+            errors.append(f'restart.{k} must be a non negative number (seconds)')
+
+    if 'cascade' in restart.keys() and not isinstance(restart['cascade'], bool):
+        errors.append('restart.cascade must be true or false')
+
+    return errors
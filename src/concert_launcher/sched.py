@@ -0,0 +1,190 @@
+from typing import List, Dict
+
+# scheduling settings of a process (the 'sched' field), e.g.
+#
+#   sched:
+#     cpus: 2-3            # cpu list (as taskset -c), or a list of cpus
+#     nice: -5
+#     policy: fifo         # other, batch, idle, fifo, rr
+#     priority: 80         # real time priority (fifo, rr)
+#     io_class: realtime   # realtime, best-effort, idle
+#     io_priority: 0       # 0 (highest) to 7 (realtime, best-effort)
+#
+# they are applied by running the tmux pane (i.e. the launcher wrapper) under
+# taskset/chrt/nice/ionice, so the whole pane process tree inherits them
+
+fields = ['cpus', 'nice', 'policy', 'priority', 'io_class', 'io_priority']
+
+# chrt flags
+policies = {
+    'other': '-o',
+    'batch': '-b',
+    'idle': '-i',
+    'fifo': '-f',
+    'rr': '-r',
+}
+
+realtime_policies = ['fifo', 'rr']
+
+# ionice classes
+io_classes = {
+    'realtime': 1,
+    'best-effort': 2,
+    'idle': 3,
+}
+
+
+def parse_cpus(cpus) -> List[int]:
+
+    """
+    Cpu list from an int, a list, or a taskset style string ('0-2,5')
+    """
+
+    if isinstance(cpus, int):
+        return [cpus]
+
+    if isinstance(cpus, (list, tuple)):
+        return sorted(set(int(c) for c in cpus))
+
+    ret = set()
+
+    for token in str(cpus).split(','):
+        first, _, last = token.strip().partition('-')
+        ret.update(range(int(first), int(last or first) + 1))
+
+    return sorted(ret)
+
+
+def format_cpus(cpus: List[int]) -> str:
+
+    ranges = []
+
+    for c in sorted(cpus):
+        if len(ranges) > 0 and ranges[-1][1] == c - 1:
+            ranges[-1][1] = c
+        else:
+            ranges.append([c, c])
+
+    return ','.join(f'{a}' if a == b else f'{a}-{b}' for a, b in ranges)
+
+
+def validate(sched: Dict) -> List[str]:
+
+    """
+    Return the list of errors in a sched field
+    """
+
+    if not isinstance(sched, dict):
+        return ['sched must be a mapping']
+
+    errors = []
+
+    for k in sched.keys():
+        if k not in fields:
+            errors.append(f'unknown sched field {k}')
+
+    if 'cpus' in sched.keys():
+        try:
+            if len(parse_cpus(sched['cpus'])) == 0:
+                errors.append('sched.cpus is empty')
+        except ValueError:
+            errors.append(f'invalid sched.cpus {sched["cpus"]}')
+
+    if 'nice' in sched.keys() and sched['nice'] not in range(-20, 20):
+        errors.append('sched.nice must be an integer in [-20, 19]')
+
+    policy = sched.get('policy', None)
+
+    if policy is not None and policy not in policies.keys():
+        errors.append(f'unknown sched.policy {policy} (one of {", ".join(policies.keys())})')
+
+    if 'priority' in sched.keys():
+        if policy not in realtime_policies:
+            errors.append(f'sched.priority needs a real time policy ({", ".join(realtime_policies)})')
+        elif sched['priority'] not in range(1, 100):
+            errors.append('sched.priority must be an integer in [1, 99]')
+
+    if policy in realtime_policies and 'priority' not in sched.keys():
+        errors.append(f'sched.policy {policy} needs a priority')
+
+    io_class = sched.get('io_class', None)
+
+    if io_class is not None and io_class not in io_classes.keys():
+        errors.append(f'unknown sched.io_class {io_class} (one of {", ".join(io_classes.keys())})')
+
+    if 'io_priority' in sched.keys():
+        if io_class not in ('realtime', 'best-effort'):
+            errors.append('sched.io_priority needs io_class realtime or best-effort')
+        elif sched['io_priority'] not in range(0, 8):
+            errors.append('sched.io_priority must be an integer in [0, 7]')
+
+    return errors
+
+
+def is_realtime(sched: Dict) -> bool:
+    return sched is not None and sched.get('policy', None) in realtime_policies
+
+
+def prefix(sched: Dict) -> str:
+
+    """
+    Command prefix applying the given settings (empty if none)
+    """
+
+    if sched is None:
+        return ''
+
+    tokens = []
+
+    if 'cpus' in sched.keys():
+        tokens.append(f'taskset -c {format_cpus(parse_cpus(sched["cpus"]))}')
+
+    if 'policy' in sched.keys():
+        tokens.append(f'chrt {policies[sched["policy"]]} {sched.get("priority", 0)}')
+
+    if 'nice' in sched.keys():
+        tokens.append(f'nice -n {sched["nice"]}')
+
+    if 'io_class' in sched.keys():
+        io_prio = f' -n {sched["io_priority"]}' if 'io_priority' in sched.keys() else ''
+        tokens.append(f'ionice -c {io_classes[sched["io_class"]]}{io_prio}')
+
+    return ''.join(t + ' ' for t in tokens)
+
+
+def drift(sched: Dict, procs: List[Dict]) -> List[str]:
+
+    """
+    Compare the settings of a process tree, as returned by the agent 'sched'
+    request (dicts with pid, name, cpus, nice, policy, priority, io_class,
+    io_priority), with the wanted ones; return the differences
+    """
+
+    if sched is None:
+        return []
+
+    expected = dict(sched)
+
+    if 'cpus' in expected.keys():
+        expected['cpus'] = parse_cpus(expected['cpus'])
+
+    if 'policy' in expected.keys() and expected['policy'] not in realtime_policies:
+        expected['priority'] = 0
+
+    ret = []
+
+    for p in procs:
+
+        actual = dict(p)
+
+        # no io class means best effort, with priority from the nice value
+        if actual['io_class'] == 'none':
+            actual['io_class'] = 'best-effort'
+            actual['io_priority'] = (actual['nice'] + 20) // 5
+
+        for k, v in expected.items():
+            if actual.get(k, None) != v:
+                show = format_cpus if k == 'cpus' else str
+                ret.append(f'pid {p["pid"]} ({p["name"]}) {k} is {show(actual[k])}, expected {show(v)}')
+
+    return ret
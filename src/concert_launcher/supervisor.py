@@ -0,0 +1,253 @@
+from typing import List, Dict
+import asyncio
+import collections
+import logging
+import time
+
+from concert_launcher import plan
+from concert_launcher.restart import RestartPolicy
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor:
+
+    """
+    Watches the windows of the supervised processes (those with a restart
+    policy other than never) with one ls per host, backend and period, and
+    restarts the processes that die according to their policy: ready checks
+    are run again, and dependants are restarted too if the policy says so.
+    Processes killed by the launcher are left alone. A process restarted
+    more than max_restarts times within the policy window is declared crash
+    looping, and is not restarted until it is brought up by other means.
+
+    States published on the launcher event bus: Died, BackingOff,
+    Restarting, RestartFailed, CrashLoop (the restart itself publishes the
+    usual run states).
+    """
+
+    def __init__(self, launcher, processes: List[str] = None, period=1.0, params={}, variants=[]):
+
+        self.launcher = launcher
+
+        # used by restarts
+        self.params = params
+        self.variants = variants
+
+        cfg = launcher.cfg
+
+        if processes is None:
+            processes = launcher.get_processes()
+
+        self.policies = {p: RestartPolicy.from_cfg(cfg, p) for p in processes}
+
+        # one shot commands are not supervised
+        self.supervised = [p for p in processes
+                           if self.policies[p].policy != 'never' and plan.is_persistent(cfg, p)]
+
+        # seconds between polls
+        self.period = period
+
+        # process -> times of the restarts within the policy window
+        self.history : Dict[str, collections.deque] = {p: collections.deque() for p in self.supervised}
+
+        # process -> pane pid of the last death that was handled
+        self.handled : Dict[str, int] = dict()
+
+        self.crash_looping = set()
+
+        # processes found dead with no exit status yet
+        self.unsettled = set()
+
+        # process -> task handling its death
+        self.tasks : Dict[str, asyncio.Future] = dict()
+
+        # restarts are done one at a time (a cascade can cover other deaths)
+        self.lock = asyncio.Lock()
+
+
+    async def run(self):
+
+        """
+        Supervise until cancelled
+        """
+
+        if len(self.supervised) == 0:
+            logger.warning('no process has a restart policy, nothing to supervise')
+
+        try:
+
+            while True:
+
+                t0 = time.time()
+
+                windows = await self._poll()
+
+                for p, winfo in windows.items():
+                    self._check(p, winfo)
+
+                await asyncio.sleep(max(0.0, self.period - (time.time() - t0)))
+
+        finally:
+
+            for t in self.tasks.values():
+                t.cancel()
+
+
+    async def _poll(self) -> Dict[str, Dict]:
+
+        # supervised process -> window info (None if there is no window),
+        # processes on unreachable hosts are left out
+        by_host = dict()
+
+        for p in self.supervised:
+            e = self.launcher.config_parser(p)
+            by_host.setdefault(e.machine, []).append(e)
+
+        async def poll_host(elist):
+
+            if not await elist[0].connect():
+                return {}
+
+            by_backend = dict()
+
+            for e in elist:
+                by_backend.setdefault(e.backend.name, []).append(e)
+
+            async def poll_backend(blist):
+                sessions = list(dict.fromkeys(e.session for e in blist))
+                lsdict = await blist[0].backend.list_windows(blist[0].ssh, sessions)
+                return {e.name: lsdict[e.session].get(e.name, None) for e in blist}
+
+            ret = dict()
+
+            try:
+                for windows in await asyncio.gather(*[poll_backend(blist) for blist in by_backend.values()]):
+                    ret.update(windows)
+            except (RuntimeError, ConnectionError, asyncio.TimeoutError) as ex:
+                logger.warning(f'supervisor: could not list windows on {elist[0].machine} ({ex})')
+                return {}
+
+            return ret
+
+        ret = dict()
+
+        for windows in await asyncio.gather(*[poll_host(elist) for elist in by_host.values()]):
+            ret.update(windows)
+
+        return ret
+
+
+    def _check(self, p, winfo):
+
+        if winfo is None or p in self.tasks.keys():
+            return
+
+        if not winfo['dead']:
+            # brought back up by someone else
+            if p in self.crash_looping and self.handled.get(p, None) != winfo['pid']:
+                logger.info(f'{p} is running again, supervising it')
+                self.crash_looping.discard(p)
+                self.history[p].clear()
+            return
+
+        # killed on purpose, or already handled
+        if winfo['stopped'] or self.handled.get(p, None) == winfo['pid']:
+            return
+
+        # the exit status might not be there yet
+        if not winfo['exitstatus_known'] and p not in self.unsettled:
+            self.unsettled.add(p)
+            return
+
+        self.unsettled.discard(p)
+
+        self.handled[p] = winfo['pid']
+
+        task = asyncio.ensure_future(self._on_death(p, winfo))
+
+        self.tasks[p] = task
+
+        task.add_done_callback(lambda _: self.tasks.pop(p, None))
+
+
+    async def _on_death(self, p, winfo):
+
+        e = self.launcher.config_parser(p)
+
+        policy = self.policies[p]
+
+        exitstatus = winfo['exitstatus']
+
+        oom = ', killed by the oom killer' if winfo['oom_kills'] > 0 else ''
+
+        await e.print(f'died (exit code {exitstatus}{oom})')
+        await e.notify_state(state='Died', exit_code=exitstatus)
+
+        if not policy.should_restart(exitstatus):
+            await e.print(f'not restarting (restart policy is {policy.policy})')
+            return
+
+        # restarts within the window
+        history = self.history[p]
+
+        while len(history) > 0 and history[0] < time.time() - policy.window:
+            history.popleft()
+
+        if len(history) >= policy.max_restarts:
+            await e.print(f'crash loop: restarted {len(history)} times within {policy.window:g} s, giving up')
+            await e.notify_state(state='CrashLoop', exit_code=exitstatus)
+            self.crash_looping.add(p)
+            return
+
+        delay = policy.delay(len(history))
+
+        if delay > 0:
+            await e.print(f'restarting in {delay:.1f} s')
+            await e.notify_state(state='BackingOff')
+            await asyncio.sleep(delay)
+
+        history.append(time.time())
+
+        async with self.lock:
+
+            try:
+                await self._restart(e, policy)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                # a new death is handled on the next poll
+                await e.print(f'restart failed ({ex.__class__.__name__}: {ex})')
+                await e.notify_state(state='RestartFailed')
+
+
+    async def _restart(self, e, policy: RestartPolicy):
+
+        p = e.name
+
+        # a cascade restart might have brought the process back meanwhile
+        if not await e.connect():
+            raise ConnectionError(f'failed to connect to {e.machine}')
+
+        winfo = (await e.backend.list_windows(e.ssh, [e.session]))[e.session].get(p, None)
+
+        if winfo is not None and not winfo['dead']:
+            return
+
+        await e.notify_state(state='Restarting')
+
+        targets = [p]
+
+        if policy.cascade:
+
+            # persistent dependants, killed before p is started again
+            dependants = [d for level in plan.get_kill_levels(self.launcher.cfg, [p]) for d in level if d != p]
+
+            if len(dependants) > 0:
+                await e.print(f'restarting dependants: {", ".join(dependants)}')
+                await self.launcher.kill(p)
+                targets += dependants
+
+        await e.print('restarting')
+
+        await self.launcher.execute_processes(targets, params=self.params, variants=self.variants)
@@ -0,0 +1,66 @@
+import asyncio
+
+from concert_launcher import events
+
+
+def state(process, state):
+    return events.LauncherEvent(events.LauncherEvent.STATE, process, state=state)
+
+
+def message(process, text):
+    return events.LauncherEvent(events.LauncherEvent.MESSAGE, process, message=text)
+
+
+def drain(sub):
+    ret = []
+    while len(sub.queue) > 0:
+        ret.append(sub.get_nowait())
+    return ret
+
+
+def test_state_coalescing():
+    bus = events.EventBus()
+    sub = bus.subscribe()
+    bus.publish(state('a', 'Running'))
+    bus.publish(message('a', 'hello'))
+    bus.publish(state('a', 'Ready'))
+    # the newer state takes the place of the queued one, at the back
+    assert [(ev.kind, ev.state or ev.message) for ev in drain(sub)] == \
+        [('message', 'hello'), ('state', 'Ready')]
+    assert sub.dropped == 0
+
+
+def test_full_queue_drops_oldest_message():
+    bus = events.EventBus()
+    sub = bus.subscribe(maxsize=2)
+    bus.publish(message('a', 'm1'))
+    bus.publish(message('a', 'm2'))
+    bus.publish(message('a', 'm3'))
+    assert [ev.message for ev in drain(sub)] == ['m2', 'm3']
+    assert sub.dropped == 1
+
+
+def test_full_queue_keeps_latest_states():
+    bus = events.EventBus()
+    sub = bus.subscribe(maxsize=2)
+    for p in ('a', 'b', 'c'):
+        bus.publish(state(p, 'Running'))
+    bus.publish(message('a', 'dropped'))
+    bus.publish(state('b', 'Ready'))
+    # every process keeps its latest state, even past maxsize
+    assert [(ev.process, ev.state) for ev in drain(sub)] == [('a', 'Running'), ('c', 'Running'), ('b', 'Ready')]
+    assert sub.dropped == 1
+
+
+def test_filter_and_close():
+
+    async def main():
+        bus = events.EventBus()
+        sub = bus.subscribe(filter_fn=lambda ev: ev.process == 'a')
+        bus.publish(state('a', 'Running'))
+        bus.publish(state('b', 'Running'))
+        sub.close()
+        bus.publish(state('a', 'Ready'))
+        return [ev async for ev in sub]
+
+    assert [(ev.process, ev.state) for ev in asyncio.run(main())] == [('a', 'Running')]
@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+
+from concert_launcher import config, executor, remote
+
+
+def make_cfg(**processes):
+    cfg = {'context': {'session': 'test', 'params': {'rate': 10}}}
+    cfg.update(processes)
+    return cfg
+
+
+def test_connect_failure(tmp_path):
+    # nothing runs when the machine cannot be reached (in particular, not
+    # on the local machine)
+    marker = tmp_path / 'ran'
+    launcher = executor.Launcher(make_cfg(a={'cmd': f'touch {marker}', 'persistent': False,
+                                             'machine': 'u@nosuch.invalid'}))
+    with pytest.raises(ConnectionError):
+        asyncio.run(launcher.execute_process('a'))
+    assert not marker.exists()
+
+
+def test_slow_callback():
+
+    # a legacy callback that cannot keep up does not hold up the operation
+    launcher = executor.Launcher(make_cfg(a={'cmd': 'a'}))
+    launcher.callback_drain = 0.1
+
+    async def callback(process, text):
+        await asyncio.sleep(10)
+
+    async def coro(op):
+        await launcher.config_parser('a', op=op).notify_state(state='Running')
+        return True
+
+    async def main():
+        op = executor.Operation()
+        return await launcher._with_callback(op, callback, coro(op))
+
+    t0 = time.monotonic()
+    assert asyncio.run(main())
+    assert time.monotonic() - t0 < 2.0
+
+
+def test_plan():
+    launcher = executor.Launcher(make_cfg(a={'cmd': 'a --rate {rate}'},
+                                          b={'cmd': 'b', 'depends': ['a'], 'machine': 'u@pc1'}))
+    schedule = launcher.plan(['b'])
+    assert schedule['errors'] == []
+    assert [list(hosts.keys()) for hosts in schedule['levels']] == [['local'], ['u@pc1']]
+    assert schedule['levels'][0]['local'][0]['cmd'] == 'a --rate 10'
+
+
+def test_plan_reports_all_errors():
+    # param and variant errors are reported along with graph errors
+    launcher = executor.Launcher(make_cfg(a={'cmd': 'a {foo}', 'depends': ['b']},
+                                          b={'cmd': 'b', 'depends': ['a', 'nosuch']}))
+    schedule = launcher.plan(['a'], variants=['fast'])
+    assert schedule['levels'] == []
+    assert 'dependency cycle: a -> b -> a' in schedule['errors']
+    assert 'b: depends on unknown process nosuch' in schedule['errors']
+    assert 'a: missing param foo' in schedule['errors']
+    assert 'unknown variant fast' in schedule['errors']
+
+
+def test_kill_ladder():
+    cfg = make_cfg(a={'cmd': 'a', 'kill': {'signals': ['SIGINT', 'SIGTERM'], 'grace': [1, 2, 3]}},
+                   b={'cmd': 'b', 'kill': {'grace': 2}, 'force_sigquit': True})
+    assert executor.ConfigParser('a', cfg).kill_ladder() == ([['SIGINT', 1.0], ['SIGTERM', 2.0]], 'SIGKILL')
+    assert executor.ConfigParser('b', cfg).kill_ladder() == ([['SIGQUIT', 2.0]], 'SIGKILL')
+    assert executor.ConfigParser('a', cfg).kill_ladder(graceful=False) == ([], 'SIGKILL')
+
+
+def test_kill_ladder_malformed():
+    # a string used to be taken as a list of single character signals
+    cfg = make_cfg(a={'cmd': 'a', 'kill': {'signals': 'SIGINT'}})
+    with pytest.raises(ValueError):
+        executor.ConfigParser('a', cfg).kill_ladder()
+
+
+def test_local_ready_check_timeout():
+    # the local machine has no connection carrying the command timeout
+    launcher = executor.Launcher(make_cfg(a={'cmd': 'a', 'ready_check': 'sleep 10'}),
+                                 timeouts=config.Timeouts(command=0.2))
+    t0 = time.monotonic()
+    assert asyncio.run(launcher._check_ready(launcher.config_parser('a'))) == -1
+    assert time.monotonic() - t0 < 2.0
+
+
+def test_command_timeout_per_connection():
+    # the launcher does not touch the process wide default
+    launcher = executor.Launcher(make_cfg(a={'cmd': 'a'}), timeouts=config.Timeouts(command=7.0))
+    assert config.ConfigOptions.command_timeout is None
+    ssh = launcher.pool.host_connection('u@pc1')
+    assert ssh.command_timeout == 7.0
+    assert remote._timeout(None, ssh) == 7.0
+    assert remote._timeout(3, ssh) == 3
+    assert remote._timeout(0, ssh) is None
+    assert remote._timeout(None, None) is None
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from concert_launcher import files
+from concert_launcher.resources import concert_launcher_files
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_tree_hash_matches_remote_side(tmp_path):
+    write(str(tmp_path / 'src' / 'a.txt'), 'a')
+    write(str(tmp_path / 'src' / 'sub' / 'b.txt'), 'b')
+    manifest = files.HashCache(str(tmp_path / 'cache.json')).manifest(str(tmp_path / 'src'))
+    assert sorted(manifest.keys()) == ['a.txt', os.path.join('sub', 'b.txt')]
+    assert manifest == concert_launcher_files.manifest(str(tmp_path / 'src'))
+    assert files.tree_hash(manifest) == concert_launcher_files.tree_hash(manifest)
+
+
+def test_tree_hash_order_and_content():
+    assert files.tree_hash({'a': '1', 'b': '2'}) == files.tree_hash({'b': '2', 'a': '1'})
+    assert files.tree_hash({'a': '1', 'b': '2'}) != files.tree_hash({'a': '2', 'b': '1'})
+
+
+def test_hash_cache(tmp_path):
+
+    path = str(tmp_path / 'f.txt')
+    cache_path = str(tmp_path / 'cache' / 'hashes.json')
+
+    write(path, 'one')
+
+    cache = files.HashCache(cache_path)
+    h = cache.hash(path)
+    assert cache.dirty
+
+    cache.save()
+    assert not cache.dirty
+
+    # a new cache reads the saved hashes, which stay valid while size and
+    # mtime do not change
+    cache = files.HashCache(cache_path)
+    assert cache.hashes[path][2] == h
+    assert cache.hash(path) == h
+    assert not cache.dirty
+
+    write(path, 'two')
+    os.utime(path, ns=(0, 1))
+    assert cache.hash(path) != h
+    assert cache.dirty
+
+
+def test_hash_cache_missing_src(tmp_path):
+    cache = files.HashCache(str(tmp_path / 'cache.json'))
+    with pytest.raises(FileNotFoundError):
+        cache.manifest(str(tmp_path / 'nosuch'))
+
+
+def test_get_manifest_shared(tmp_path):
+
+    write(str(tmp_path / 'src' / 'a.txt'), 'a')
+
+    cache = files.HashCache(str(tmp_path / 'cache.json'))
+
+    calls = []
+    manifest = cache.manifest
+
+    def counting_manifest(src):
+        calls.append(src)
+        return manifest(src)
+
+    cache.manifest = counting_manifest
+
+    async def main():
+        # concurrent requests for the same src share the computation
+        return await asyncio.gather(*[cache.get_manifest(str(tmp_path / 'src')) for _ in range(4)])
+
+    res = asyncio.run(main())
+
+    assert len(calls) == 1
+    assert all(m == res[0] for m in res)
+
+
+def test_save_while_hashing(tmp_path):
+
+    # hashes are added from worker threads while save() runs
+    for i in range(200):
+        write(str(tmp_path / 'src' / f'{i}.txt'), str(i))
+
+    cache = files.HashCache(str(tmp_path / 'cache.json'))
+
+    t = threading.Thread(target=cache.manifest, args=(str(tmp_path / 'src'),))
+    t.start()
+    while t.is_alive():
+        cache.save()
+    t.join()
+
+    cache.save()
+
+    assert len(files.HashCache(str(tmp_path / 'cache.json')).hashes) == 200
+
+
+def test_remote_check_ignores_extra_files(tmp_path):
+    # files found at dst that the source does not have are not read
+    write(str(tmp_path / 'src' / 'a.txt'), 'a')
+    write(str(tmp_path / 'dst' / 'a.txt'), 'a')
+    write(str(tmp_path / 'dst' / 'build' / 'out.bin'), 'x')
+    manifest = files.HashCache(str(tmp_path / 'cache.json')).manifest(str(tmp_path / 'src'))
+    req = dict(dst=str(tmp_path / 'dst'), hash=files.tree_hash(manifest), paths=files.encode_paths(manifest.keys()))
+    assert concert_launcher_files.check([req])[0]['match']
+    write(str(tmp_path / 'dst' / 'a.txt'), 'b')
+    res = concert_launcher_files.check([req])[0]
+    assert not res['match']
+    assert list(res['files'].keys()) == ['a.txt']
+
+
+def test_check_destinations():
+    cfg = {'context': {'files': {'u@pc1': [{'src': 'conf', 'dst': '~/conf'}]}},
+           'a': {'cmd': 'a', 'machine': 'u@pc1', 'files': [{'src': 'conf/', 'dst': '~/conf/'}]},
+           'b': {'cmd': 'b', 'machine': 'u@pc1', 'files': [{'src': 'other', 'dst': '~/conf'}]},
+           'c': {'cmd': 'c', 'files': [{'src': 'other', 'dst': '~/conf'}]}}
+    assert files.check_destinations(cfg, ['a', 'c']) == []
+    assert files.check_destinations(cfg, ['a', 'b']) == \
+        ['b: files.dst ~/conf is also the destination of conf (context.files.u@pc1)']
+
+
+def test_sync_same_destination():
+    sync = files.FileSync(None, None)
+    with pytest.raises(ValueError):
+        asyncio.run(sync.sync([dict(src='a', dst='/tmp/x'), dict(src='b', dst='/tmp/x')]))
@@ -0,0 +1,33 @@
+import os
+import signal
+import stat
+
+from concert_launcher.resources import concert_launcher_headless as headless
+
+
+def test_spawn_ls_stop(tmp_path, monkeypatch):
+
+    state_dir = str(tmp_path / 'state')
+    monkeypatch.setattr(headless, 'STATE_DIR', state_dir)
+
+    w = dict(session='s', window='w', cmd='sleep 30', config_hash='h')
+
+    assert headless.spawn([w]) == {'s:w': {'status': 'spawned', 'config_hash': 'h'}}
+
+    # the records are private to the user
+    assert stat.S_IMODE(os.stat(state_dir).st_mode) == 0o700
+
+    winfo = headless.ls(['s', 'nosuch'])['s']['w']
+    assert not winfo['dead'] and not winfo['stopped']
+    assert headless.ls(['nosuch']) == {'nosuch': {}}
+
+    # a live window is not spawned again
+    assert headless.spawn([w])['s:w']['status'] == 'exists'
+
+    headless.stop([['s', 'w']])
+    os.killpg(winfo['pid'], signal.SIGKILL)
+    os.waitpid(winfo['pid'], 0)
+
+    winfo = headless.ls(['s'])['s']['w']
+    assert winfo['dead'] and winfo['stopped']
+    assert not winfo['exitstatus_known']
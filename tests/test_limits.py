@@ -0,0 +1,26 @@
+import pytest
+
+from concert_launcher import limits
+
+
+def test_parse_size():
+    assert limits.parse_size(1024) == 1024
+    assert limits.parse_size('512') == 512
+    assert limits.parse_size('512M') == 512 << 20
+    assert limits.parse_size('1.5G') == 3 << 29
+    assert limits.parse_size(' 2K ') == 2048
+    assert limits.parse_size('infinity') is None
+
+
+@pytest.mark.parametrize('size', ['M', '10MB', '-1K', '1 G'])
+def test_parse_size_invalid(size):
+    with pytest.raises(ValueError):
+        limits.parse_size(size)
+
+
+def test_validate():
+    assert limits.validate({'memory_max': '1G', 'cpu_quota': '50%', 'pids_max': 'infinity'}) == []
+    assert limits.validate({'memory_max': '1GB'}) == \
+        ['invalid limits.memory_max 1GB (bytes, or a number with K, M, G or T suffix)']
+    assert limits.validate({'cpu_quota': '0%'}) == \
+        ['invalid limits.cpu_quota 0% (percentage, 100% = one cpu)']
@@ -0,0 +1,128 @@
+from concert_launcher import plan
+
+
+def make_cfg(**processes):
+    cfg = {'context': {'session': 'test'}}
+    cfg.update(processes)
+    return cfg
+
+
+def test_validate_graph_ok():
+    cfg = make_cfg(a={'cmd': 'a'}, b={'cmd': 'b', 'depends': ['a']})
+    assert plan.validate_graph(cfg, ['b']) == []
+
+
+def test_validate_graph_missing_dependency():
+    cfg = make_cfg(a={'cmd': 'a', 'depends': ['nosuch']})
+    assert plan.validate_graph(cfg, ['a']) == ['a: depends on unknown process nosuch']
+
+
+def test_validate_graph_unknown_process():
+    cfg = make_cfg(a={'cmd': 'a'})
+    assert plan.validate_graph(cfg, ['b']) == ['unknown process b']
+
+
+def test_validate_graph_cycle():
+    cfg = make_cfg(a={'cmd': 'a', 'depends': ['b']}, b={'cmd': 'b', 'depends': ['a']})
+    assert plan.validate_graph(cfg, ['a']) == ['dependency cycle: a -> b -> a']
+
+
+def test_validate_graph_missing_cmd_and_session():
+    cfg = {'context': {}, 'a': {}}
+    errors = plan.validate_graph(cfg, ['a'])
+    assert 'context.session is missing' in errors
+    assert 'a: cmd is missing' in errors
+
+
+def test_validate_graph_malformed_kill():
+    # a string of signals used to crash the planner
+    cfg = make_cfg(a={'cmd': 'a', 'kill': {'signals': 'SIGINT', 'final': 9, 'grace': 'abc'}})
+    errors = plan.validate_graph(cfg, ['a'])
+    assert 'a: kill.signals must be a list of signal names (got SIGINT)' in errors
+    assert 'a: unknown kill signal 9' in errors
+    assert 'a: kill.grace must be a non negative number, or a list of them (got abc)' in errors
+
+
+def test_validate_graph_kill_from_context():
+    cfg = make_cfg(a={'cmd': 'a'})
+    cfg['context']['kill'] = {'signals': ['SIGNOPE']}
+    assert plan.validate_graph(cfg, ['a']) == ['a: unknown kill signal SIGNOPE']
+    cfg['context']['kill'] = 'SIGINT'
+    assert plan.validate_graph(cfg, ['a']) == ['a: kill must be a mapping']
+
+
+def test_validate_kill():
+    assert plan.validate_kill({}) == []
+    assert plan.validate_kill({'signals': ['SIGINT', 'SIGTERM'], 'grace': [1, 2.5], 'final': None}) == []
+    assert plan.validate_kill({'grace': True}) != []
+    assert plan.validate_kill({'grace': -1}) != []
+    assert plan.validate_kill({'grace': []}) == ['kill.grace must not be an empty list']
+    assert plan.validate_kill(['SIGINT']) == ['kill must be a mapping']
+
+
+def test_get_run_levels():
+    cfg = make_cfg(a={'cmd': 'a'},
+                   b={'cmd': 'b', 'depends': ['a']},
+                   c={'cmd': 'c', 'depends': ['a']},
+                   d={'cmd': 'd', 'depends': ['b', 'c']},
+                   e={'cmd': 'e'})
+    assert plan.get_run_levels(cfg, ['d']) == [['a'], ['b', 'c'], ['d']]
+    assert plan.get_run_levels(cfg, ['d', 'e']) == [['a', 'e'], ['b', 'c'], ['d']]
+
+
+def test_get_dependency_closure_skips_unknown():
+    cfg = make_cfg(a={'cmd': 'a', 'depends': ['nosuch', 'b']}, b={'cmd': 'b', 'depends': ['a']})
+    assert plan.get_dependency_closure(cfg, ['a', 'other']) == ['a', 'b']
+
+
+def test_expand_replicas_count():
+    cfg = make_cfg(cam={'replicas': 2, 'machine': ['u@pc1', 'u@pc2'], 'cmd': 'cam /dev/video{replica}'},
+                   user={'cmd': 'user', 'depends': ['cam']})
+    expanded = plan.expand_replicas(cfg)
+    assert plan.get_processes(expanded) == ['cam_0', 'cam_1', 'user']
+    assert expanded['cam_1'] == {'cmd': 'cam /dev/video1', 'machine': 'u@pc2'}
+    assert expanded['user']['depends'] == ['cam_0', 'cam_1']
+    assert expanded['context']['replica_groups'] == {'cam': ['cam_0', 'cam_1']}
+    assert plan.resolve_names(expanded, ['cam', 'user']) == ['cam_0', 'cam_1', 'user']
+    assert plan.validate_graph(expanded, ['user']) == []
+
+
+def test_expand_replicas_matrix():
+    cfg = make_cfg(drv={'matrix': {'side': ['l', 'r'], 'joint': ['hip']}, 'cmd': 'drv {side} {joint} {other}'})
+    expanded = plan.expand_replicas(cfg)
+    assert [expanded[p]['cmd'] for p in plan.get_processes(expanded)] == ['drv l hip {other}', 'drv r hip {other}']
+
+
+def test_expand_replicas_noop():
+    cfg = make_cfg(a={'cmd': 'a'})
+    assert plan.expand_replicas(cfg) is cfg
+    expanded = plan.expand_replicas(make_cfg(a={'cmd': 'a', 'replicas': 2}))
+    assert plan.expand_replicas(expanded) is expanded
+
+
+def test_expand_replicas_malformed():
+    # malformed templates and name clashes are kept, and reported
+    cfg = make_cfg(a={'cmd': 'a', 'replicas': 0}, b={'cmd': 'b', 'replicas': 1}, b_0={'cmd': 'b0'})
+    expanded = plan.expand_replicas(cfg)
+    assert expanded == cfg
+    errors = plan.validate_graph(expanded, ['a', 'b'])
+    assert 'a: replicas must be a positive int or a list of param mappings' in errors
+    assert 'b: replica names clash with process b_0' in errors
+
+
+def test_get_kill_levels():
+    cfg = make_cfg(a={'cmd': 'a'},
+                   b={'cmd': 'b', 'depends': ['a']},
+                   c={'cmd': 'c', 'depends': ['b']},
+                   g={'cmd': 'g', 'depends': ['a'], 'persistent': False})
+    # dependants first, one shot processes are left out
+    assert plan.get_kill_levels(cfg, ['a']) == [['c'], ['b'], ['a']]
+    assert plan.get_kill_levels(cfg, ['g']) == [['c'], ['b'], ['a']]
+
+
+def test_get_kill_levels_cycle():
+    # processes on a cycle are killed together, after their dependants
+    cfg = make_cfg(a={'cmd': 'a', 'depends': ['b']},
+                   b={'cmd': 'b', 'depends': ['a']},
+                   c={'cmd': 'c', 'depends': ['a']})
+    assert plan.get_kill_levels(cfg, ['a']) == [['c'], ['a', 'b']]
@@ -0,0 +1,28 @@
+from concert_launcher import profiling
+
+
+def test_parse_collapsed():
+    assert profiling.parse_collapsed('main;f 3\n\nmain;g;f 1\n') == [(['main', 'f'], 3), (['main', 'g', 'f'], 1)]
+
+
+def test_to_speedscope():
+
+    ret = profiling.to_speedscope('main;f 3\nmain;g;f 1\n', 'proc', rate=100)
+
+    assert ret['shared']['frames'] == [{'name': 'main'}, {'name': 'f'}, {'name': 'g'}]
+
+    profile = ret['profiles'][0]
+
+    # frames are shared, weights are in seconds
+    assert profile['samples'] == [[0, 1], [0, 2, 1]]
+    assert profile['weights'] == [0.03, 0.01]
+    assert profile['endValue'] == 0.04
+    assert profile['unit'] == 'seconds'
+    assert ret['name'] == profile['name'] == 'proc'
+
+
+def test_to_speedscope_empty():
+    ret = profiling.to_speedscope('', 'proc', rate=100)
+    assert ret['shared']['frames'] == []
+    assert ret['profiles'][0]['samples'] == []
+    assert ret['profiles'][0]['endValue'] == 0
@@ -0,0 +1,22 @@
+from concert_launcher import remote
+
+
+def test_tmux_arg():
+    assert remote.tmux_arg('sleep 1') == 'sleep 1'
+    assert remote.tmux_arg('sleep 1;') == 'sleep 1\\;'
+    assert remote.tmux_arg('find . -exec rm {} \\;') == 'find . -exec rm {} \\\\;'
+
+
+def test_wrapper_cmd():
+    w = dict(session='s', window='w', cmd='sleep 1;')
+    # commands given to tmux get their trailing ';' escaped, the others not
+    assert remote.wrapper_cmd(w, tmux=True) == "/tmp/concert_launcher_wrapper.bash w 'sleep 1\\;'"
+    assert remote.wrapper_cmd(w) == "/tmp/concert_launcher_wrapper.bash w 'sleep 1;'"
+
+
+def test_jump_host():
+    jumps = {'u@pc1': 'u@gw', 'pc2': 'v@gw'}
+    assert remote.jump_host(jumps, 'u@pc1') == 'u@gw'
+    assert remote.jump_host(jumps, 'x@pc2') == 'v@gw'
+    assert remote.jump_host(jumps, 'u@pc3') is None
+    assert remote.jump_host(jumps, None) is None
@@ -0,0 +1,32 @@
+from concert_launcher import restart
+
+
+def test_should_restart():
+    assert not restart.RestartPolicy().should_restart(1)
+    assert restart.RestartPolicy(policy='on-failure').should_restart(1)
+    assert not restart.RestartPolicy(policy='on-failure').should_restart(0)
+    assert restart.RestartPolicy(policy='always').should_restart(0)
+
+
+def test_backoff():
+    policy = restart.RestartPolicy(backoff=1.0, backoff_max=5.0)
+    # first restart is immediate, then doubling up to backoff_max
+    assert [policy.delay(n) for n in range(6)] == [0.0, 1.0, 2.0, 4.0, 5.0, 5.0]
+
+
+def test_from_cfg():
+    cfg = {'context': {'session': 's', 'restart': {'policy': 'always', 'backoff': 2}},
+           'a': {'cmd': 'a', 'restart': {'max_restarts': 3}},
+           'b': {'cmd': 'b', 'restart': {'policy': 'never'}}}
+    a = restart.RestartPolicy.from_cfg(cfg, 'a')
+    assert (a.policy, a.max_restarts, a.backoff, a.window) == ('always', 3, 2.0, 60.0)
+    assert restart.RestartPolicy.from_cfg(cfg, 'b').policy == 'never'
+
+
+def test_validate():
+    assert restart.validate({'policy': 'on-failure', 'max_restarts': 2, 'window': 10, 'cascade': True}) == []
+    assert restart.validate('always') == ['restart must be a mapping']
+    assert restart.validate({'policy': 'sometimes'}) == ['unknown restart.policy sometimes (one of never, on-failure, always)']
+    assert restart.validate({'max_restarts': 0}) == ['restart.max_restarts must be a positive integer']
+    assert restart.validate({'backoff': -1}) == ['restart.backoff must be a non negative number (seconds)']
+    assert restart.validate({'retries': 1}) == ['unknown restart field retries']
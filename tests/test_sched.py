@@ -0,0 +1,30 @@
+import pytest
+
+from concert_launcher import sched
+
+
+def test_parse_cpus():
+    assert sched.parse_cpus(3) == [3]
+    assert sched.parse_cpus([2, 0, 2]) == [0, 2]
+    assert sched.parse_cpus('0-2,5') == [0, 1, 2, 5]
+    assert sched.parse_cpus(' 4 , 1-2') == [1, 2, 4]
+
+
+def test_parse_cpus_invalid():
+    with pytest.raises(ValueError):
+        sched.parse_cpus('a-b')
+
+
+def test_format_cpus():
+    assert sched.format_cpus([5, 0, 1, 2]) == '0-2,5'
+
+
+def test_validate():
+    assert sched.validate({'cpus': '0-1', 'policy': 'fifo', 'priority': 50, 'nice': -5}) == []
+    assert sched.validate('fifo') == ['sched must be a mapping']
+    assert sched.validate({'cpus': 'x'}) == ['invalid sched.cpus x']
+    assert sched.validate({'policy': 'fifo'}) == ['sched.policy fifo needs a priority']
+    assert sched.validate({'priority': 10}) != []
+    assert sched.validate({'nice': 20}) == ['sched.nice must be an integer in [-20, 19]']
+    assert sched.validate({'io_priority': 3}) == ['sched.io_priority needs io_class realtime or best-effort']
+    assert sched.validate({'affinity': 1}) == ['unknown sched field affinity']
@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import concert_launcher
+
+# run as on the target machine
+script = os.path.join(os.path.dirname(concert_launcher.__file__), 'resources', 'concert_launcher_signal.py')
+
+
+def spawn(cmd):
+    # stands in for the launcher wrapper, the command runs in its own group
+    return subprocess.Popen(['bash', '-c', cmd], stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def signal(proc):
+    target = dict(name='p', pid=proc.pid, ladder=[['SIGTERM', 5.0], ['SIGINT', 5.0]], final='SIGKILL')
+    ret = json.loads(subprocess.check_output([sys.executable, script, json.dumps([target])]))['p']
+    proc.wait()
+    return ret
+
+
+def test_signal():
+    proc = spawn('setsid sleep 30 & wait')
+    time.sleep(0.2)
+    ret = signal(proc)
+    assert ret['exited']
+    assert ret['signals'] == ['SIGTERM']
+
+
+def test_signal_before_command_starts():
+    # a kill right after the spawn: the command shows up later, and must
+    # get the first signal rather than waiting for the grace period
+    ret = signal(spawn('sleep 0.3; setsid sleep 30 & wait'))
+    assert ret['exited']
+    assert ret['signals'] == ['SIGTERM']
+    assert ret['elapsed'] < 3.0
+
+
+def test_signal_late_group():
+    # a group started after the first signal gets it as well
+    ret = signal(spawn('setsid sleep 30 & sleep 0.3; setsid sleep 30 & wait'))
+    assert ret['exited']
+    assert ret['signals'] == ['SIGTERM']
+    assert ret['elapsed'] < 3.0
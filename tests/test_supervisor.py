@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+from concert_launcher import executor, supervisor
+
+
+def make_supervisor(**restart):
+    cfg = {'context': {'session': 'test'},
+           'a': {'cmd': 'a', 'restart': dict(policy='on-failure', backoff=0.01, backoff_max=0.02, **restart)}}
+    sup = supervisor.Supervisor(executor.Launcher(cfg))
+
+    # states published for a, restarts done
+    states = []
+    restarts = []
+
+    config_parser = sup.launcher.config_parser
+
+    def recording_config_parser(process, **kwargs):
+        e = config_parser(process, **kwargs)
+        async def notify_state(state, exit_code=None):
+            states.append(state)
+        e.notify_state = notify_state
+        return e
+
+    async def restart(e, policy):
+        restarts.append(time.time())
+
+    sup.launcher.config_parser = recording_config_parser
+    sup._restart = restart
+
+    return sup, states, restarts
+
+
+def window(pid, dead=True, exitstatus=1):
+    return dict(pid=pid, dead=dead, stopped=False, exitstatus=exitstatus,
+                exitstatus_known=True, oom_kills=0)
+
+
+async def die(sup, pid):
+    sup._check('a', window(pid))
+    await asyncio.gather(*sup.tasks.values())
+
+
+def test_backoff():
+
+    sup, states, restarts = make_supervisor()
+
+    async def main():
+        for pid in range(4):
+            await die(sup, pid)
+
+    asyncio.run(main())
+
+    # the first restart is immediate, the others back off
+    assert len(restarts) == 4
+    assert states == ['Died', 'Died', 'BackingOff', 'Died', 'BackingOff', 'Died', 'BackingOff']
+
+    # a death that was handled already is not handled again
+    asyncio.run(die(sup, 3))
+    assert len(restarts) == 4
+
+
+def test_crash_loop():
+
+    sup, states, restarts = make_supervisor(max_restarts=2)
+
+    async def main():
+        for pid in range(3):
+            await die(sup, pid)
+
+    asyncio.run(main())
+
+    assert len(restarts) == 2
+    assert states[-1] == 'CrashLoop'
+    assert 'a' in sup.crash_looping
+
+    # not restarted until brought up by other means, then supervised again
+    sup._check('a', window(2, dead=False))
+    assert 'a' in sup.crash_looping
+
+    sup._check('a', window(3, dead=False))
+    assert 'a' not in sup.crash_looping
+    assert len(sup.history['a']) == 0
+
+
+def test_crash_loop_window():
+
+    sup, states, restarts = make_supervisor(max_restarts=2, window=0.2)
+
+    async def main():
+        for pid in range(2):
+            await die(sup, pid)
+        # the restarts fall out of the window
+        await asyncio.sleep(0.3)
+        await die(sup, 2)
+
+    asyncio.run(main())
+
+    assert len(restarts) == 3
+    assert 'CrashLoop' not in states